@@ -20,6 +20,9 @@
 Definitions for nodes in the abstract syntax tree.
 '''
 
+import copy
+import hashlib
+
 from . import symtab
 
 
@@ -99,6 +102,110 @@ class Node(object):
 
         return False
 
+    def clone(self):
+        '''
+        Creates a shallow copy of the node, sharing its children with
+        the original node.
+        '''
+        node = copy.copy(self)
+        if '_children' in self.__dict__:
+            node._children = list(self._children)
+
+        return node
+
+    def clone_replace(self, child, node):
+        '''
+        Creates a shallow copy of the node, where the direct descendant
+        child is replaced with node.
+        '''
+        clone = self.clone()
+        for k, v in clone.__dict__.items():
+            if v is child:
+                clone.__dict__[k] = node
+                return clone
+
+        if '_children' in clone.__dict__:
+            clone._children = [node if c is child else c
+                               for c in clone._children]
+
+        return clone
+
+    def find_path(self, target):
+        '''
+        Finds the nodes on the path from this node down to target, or
+        None if target is not a descendant.
+        '''
+        if self is target:
+            return [self]
+
+        for c in filter(None, self.children):
+            if not isinstance(c, Node):
+                continue
+
+            path = c.find_path(target)
+            if path:
+                path.insert(0, self)
+                return path
+
+    def clone_path(self, target, replacement=None, index=None):
+        '''
+        Copies the nodes on the path from this node down to target. All
+        subtrees off the path are shared with the original tree. Target
+        is copied as well, unless a replacement node is given. The path
+        is looked up in index when given, instead of searching the tree.
+
+        Returns the copy of this node, and the copy of target (or its
+        replacement).
+        '''
+        if index:
+            path = index.path(target)
+        else:
+            path = self.find_path(target)
+
+        if not path or path[0] is not self:
+            return None, None
+
+        if replacement is None:
+            replacement = target.clone()
+
+        node = replacement
+        for parent, child in zip(reversed(path[:-1]), reversed(path[1:])):
+            node = parent.clone_replace(child, node)
+
+        return node, replacement
+
+    def fingerprint(self):
+        '''
+        Computes a hash of the tree rooted at this node, normalized so that
+        it only depends on the structure of the tree, and the names and
+        values of its nodes. Positions and types are ignored, i.e. the hash
+        is not affected by changes to code located elsewhere in a file.
+        '''
+        md5 = hashlib.md5()
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                md5.update(b'-')
+                continue
+
+            md5.update(type(node).__name__.encode())
+            for k in sorted(node.__dict__.keys()):
+                v = node.__dict__[k]
+                if k.startswith('_') or k == 'pos_info':
+                    continue
+
+                if isinstance(v, (str, int, float, bool)):
+                    md5.update(('%s=%r;' % (k, v)).encode())
+
+            children = [c for c in node.children
+                        if c is None or isinstance(c, Node)]
+            md5.update(('(%d)' % len(children)).encode())
+            stack.extend(reversed(children))
+
+        return md5.hexdigest()
+
     @property
     def position(self):
         if hasattr(self, 'pos_info'):
@@ -126,6 +233,52 @@ class Node(object):
         return self.name
 
 
+class NodeIndex(object):
+    '''
+    Index of the nodes in a tree, built in a single pass, mapping each
+    node to its parent. The index keeps a reference to every node, so
+    that the id of a node is never reused by another one while the index
+    is alive, and lookups check the identity of the node found.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.parents = dict()
+
+        stack = [(root, None)]
+        while stack:
+            node, parent = stack.pop()
+            self.parents[id(node)] = (node, parent)
+
+            for c in reversed(list(filter(None, node.children))):
+                if isinstance(c, Node):
+                    stack.append((c, node))
+
+    def parent(self, node):
+        entry = self.parents.get(id(node))
+        if entry is None or entry[0] is not node:
+            raise KeyError(node)
+
+        return entry[1]
+
+    def path(self, node):
+        '''
+        Returns the nodes on the path from the root down to node, or None
+        if node is not in the tree.
+        '''
+        entry = self.parents.get(id(node))
+        if entry is None or entry[0] is not node:
+            return None
+
+        path = []
+        while node is not None:
+            path.append(node)
+            node = self.parent(node)
+
+        path.reverse()
+        return path
+
+
 class ProgramNode(Node):
 
     def __init__(self, identifier, block, identifier_list=None):
@@ -27,6 +27,7 @@ from . import ast
 from . import symtab
 from . import fn
 from . import log
+from . import constants
 
 
 def c_int(val, width=32):
@@ -765,6 +766,27 @@ class Context(symtab.SymbolTable):
 
             return func, args
 
+        elif name == 'begintest':
+            handle = fn.f_begin_test(self.module)
+            ty = fn.translate_function(handle)
+            func = symtab.FunctionValue(handle, ty)
+
+            return func, args
+
+        elif name == 'failtest':
+            handle = fn.f_fail_test(self.module)
+            ty = fn.translate_function(handle)
+            func = symtab.FunctionValue(handle, ty)
+
+            return func, args
+
+        elif name == 'gettestorder':
+            handle = fn.f_get_test_order(self.module)
+            ty = fn.translate_function(handle)
+            func = symtab.FunctionValue(handle, ty)
+
+            return func, args
+
         elif name == 'new':
             handle = fn.f_new(self.module)
             ty = fn.translate_function(handle)
@@ -1229,8 +1251,24 @@ class Context(symtab.SymbolTable):
 
 class CodegenVisitor(ast.DefaultP86Visitor):
 
-    def __init__(self, mutants):
+    def __init__(self, mutants, loop_budget=False, coverage=False,
+                 split_stream=False, weak_mutation=False):
         self.mutants = mutants
+        self.loop_budget = loop_budget
+        self.coverage = coverage
+        self.split_stream = split_stream
+        self.weak_mutation = weak_mutation
+
+        # set while comparing an original expression with its mutant
+        self.diverging = False
+
+        # per function loads of the current mutant id
+        self.mutant_id_loads = dict()
+
+        # position of each mutant in the mutant table of the module
+        self.mutant_index = dict()
+        for index, m_id in enumerate(sorted(set(mutants))):
+            self.mutant_index[m_id] = index
         self.ctx = Context()
         self.ctx.enter_scope()
         self.func_scope_level = 0
@@ -1585,9 +1623,93 @@ class CodegenVisitor(ast.DefaultP86Visitor):
 #     Branching      #
 ######################
 
+    def loop_tick(self):
+        '''
+        Counts an iteration at the back edge of a loop when loop budgets
+        are enabled, and halts the program with a distinct exit code once
+        the budget is exceeded.
+        '''
+        if not self.loop_budget:
+            return
+
+        cnt_var, bgt_var = fn.loop_budget_vars(self.ctx.module)
+
+        cnt = self.ctx.builder.load(cnt_var)
+        cnt = self.ctx.builder.add(cnt, c_int(1, 64))
+        self.ctx.builder.store(cnt, cnt_var)
+
+        bgt = self.ctx.builder.load(bgt_var)
+        cond = self.ctx.builder.icmp(lc.ICMP_UGT, cnt, bgt)
+
+        bb_halt = self.ctx.function.append_basic_block('loop.timeout')
+        bb_cont = self.ctx.function.append_basic_block('loop.continue')
+        branch = self.ctx.builder.cbranch(cond, bb_halt, bb_cont)
+
+        mds = lc.MetaDataString.get(self.ctx.module, 'branch_weights')
+        md = lc.MetaData.get(self.ctx.module, [mds, c_int(1), c_int(2 ** 20)])
+        branch.set_metadata('prof', md)
+
+        self.ctx.builder.position_at_end(bb_halt)
+        code = c_int(constants.TIMEOUT_EXIT_CODE)
+        self.ctx.builder.call(fn.f_exit(self.ctx.module), [code])
+        self.ctx.builder.unreachable()
+
+        self.ctx.builder.position_at_end(bb_cont)
+
+    def mutant_switch(self, node):
+        '''
+        Lowers a chain of if-statements, each one guarding a mutant of the
+        same statement, into a single switch on the current mutant id.
+        The original statement at the end of the chain is the default.
+        '''
+        cases = []
+        seen = set()
+
+        while getattr(node, 'mutant_chain', False):
+            m_id = node.expr.mutant
+            if m_id not in seen:
+                seen.add(m_id)
+                cases.append((m_id, node.iftrue))
+                self.mark_covered(m_id)
+                self.split_mutant(m_id, getattr(node, 'diverge', None))
+                self.infect_mutant(m_id, getattr(node, 'diverge', None))
+
+            node = node.iffalse
+
+        value = self.load_mutant_id()
+
+        bb_default = self.ctx.function.append_basic_block('mutant.original')
+        bb_exit = self.ctx.function.append_basic_block('mutant.exit')
+
+        switch = self.ctx.builder.switch(value.handle, bb_default, len(cases))
+
+        mds = lc.MetaDataString.get(self.ctx.module, 'branch_weights')
+        weights = [c_int(len(self.mutants))] + [c_int(1)] * len(cases)
+        md = lc.MetaData.get(self.ctx.module, [mds] + weights)
+        switch.set_metadata('prof', md)
+
+        for m_id, stmt in cases:
+            bb_case = self.ctx.function.append_basic_block('mutant.case')
+            switch.add_case(c_int(m_id), bb_case)
+
+            self.ctx.builder.position_at_end(bb_case)
+            if stmt:
+                stmt.accept(self)
+            self.ctx.builder.branch(bb_exit)
+
+        self.ctx.builder.position_at_end(bb_default)
+        if node:
+            node.accept(self)
+        self.ctx.builder.branch(bb_exit)
+
+        self.ctx.builder.position_at_end(bb_exit)
+
     def visit_IfNode(self, node, arg=None):
         assert isinstance(node, ast.IfNode)
 
+        if getattr(node, 'mutant_chain', False):
+            return self.mutant_switch(node)
+
         bb_true = self.ctx.function.append_basic_block('if.true')
         bb_endif = self.ctx.function.append_basic_block('if.end')
 
@@ -1645,6 +1767,7 @@ class CodegenVisitor(ast.DefaultP86Visitor):
         # body block
         self.ctx.builder.position_at_end(bb_body)
         node.body.accept(self)
+        self.loop_tick()
         self.ctx.builder.branch(bb_cond)
 
         # exit block
@@ -1661,6 +1784,7 @@ class CodegenVisitor(ast.DefaultP86Visitor):
         self.ctx.builder.branch(bb_body)
         self.ctx.builder.position_at_end(bb_body)
         node.body.accept(self)
+        self.loop_tick()
         self.ctx.builder.branch(bb_cond)
 
         # cond block
@@ -1705,6 +1829,7 @@ class CodegenVisitor(ast.DefaultP86Visitor):
 
         # generate increment
         self.ctx.builder.position_at_end(bb_incr)
+        self.loop_tick()
 
         handle = self.ctx.builder.load(var.handle)
         var_value = symtab.ConstantValue(handle, var.type)
@@ -1816,8 +1941,10 @@ class CodegenVisitor(ast.DefaultP86Visitor):
         self.ctx.builder.branch(jmp_bb)
         block.entries.append(jmp_bb)
 
+        # backward jumps may form loops
         if block.handle:
             self.ctx.builder.position_at_end(jmp_bb)
+            self.loop_tick()
             self.ctx.builder.branch(block.handle)
 
         # might be unreachable
@@ -1843,6 +1970,127 @@ class CodegenVisitor(ast.DefaultP86Visitor):
 #    Expressions     #
 ######################
 
+    def mark_covered(self, m_id):
+        '''
+        Flags a mutant as covered when coverage is enabled, i.e. the guard
+        of the mutant has been evaluated.
+        '''
+        if not self.coverage or m_id not in self.mutant_index:
+            return
+
+        cov_var = fn.mutant_coverage_var(self.ctx.module)
+        indices = [c_int(0), c_int(self.mutant_index[m_id])]
+        handle = self.ctx.builder.gep(cov_var, indices)
+        self.ctx.builder.store(c_int(1, 8), handle)
+
+    def branch_diverge(self, diverge, bb_true, bb_false):
+        '''
+        Branches to bb_true if the original and the mutated expression in
+        diverge evaluate to different values, and to bb_false otherwise.
+        Branches to bb_true unconditionally when there is nothing to compare.
+        Returns True if the expressions were compared.
+        '''
+        scalar = (symtab.IntType, symtab.CharType, symtab.RealType)
+        if not diverge or not all(isinstance(n.type, scalar)
+                                  for n in diverge):
+            self.ctx.builder.branch(bb_true)
+            return False
+
+        self.diverging = True
+        try:
+            org = diverge[0].accept(self)
+            mut = diverge[1].accept(self)
+        finally:
+            self.diverging = False
+
+        if str(org.handle.type) != str(mut.handle.type):
+            self.ctx.builder.branch(bb_true)
+            return False
+
+        cond = self.ctx.cmp_neq(org, mut)
+        self.ctx.builder.cbranch(cond.handle, bb_true, bb_false)
+        return True
+
+    def split_mutant(self, m_id, diverge=None):
+        '''
+        Emits a split point when generating code for split-stream execution.
+        While the original program executes, a child continuing as the
+        mutant is forked by P86.splitmutation() the first time the state of
+        the mutant diverges. If diverge holds the original and the mutated
+        expression of the mutant, both are evaluated and the state diverges
+        once their values differ, otherwise as soon as the guard is reached.
+        '''
+        if not self.split_stream or self.diverging:
+            return
+
+        if m_id not in self.mutant_index:
+            return
+
+        var = fn.mutant_split_var(self.ctx.module, len(self.mutant_index))
+        indices = [c_int(0), c_int(self.mutant_index[m_id])]
+        flag = self.ctx.builder.gep(var, indices)
+
+        value = self.ctx.builder.load(fn.mutant_id_var(self.ctx.module))
+        original = self.ctx.builder.icmp(lc.ICMP_EQ, value, c_int(0))
+        value = self.ctx.builder.load(flag)
+        pending = self.ctx.builder.icmp(lc.ICMP_EQ, value, c_int(0, 8))
+        cond = self.ctx.builder.and_(original, pending)
+
+        bb_check = self.ctx.function.append_basic_block('split.check')
+        bb_fork = self.ctx.function.append_basic_block('split.fork')
+        bb_cont = self.ctx.function.append_basic_block('split.continue')
+
+        branch = self.ctx.builder.cbranch(cond, bb_check, bb_cont)
+
+        mds = lc.MetaDataString.get(self.ctx.module, 'branch_weights')
+        md = lc.MetaData.get(self.ctx.module, [mds, c_int(1),
+                                               c_int(len(self.mutants))])
+        branch.set_metadata('prof', md)
+
+        self.ctx.builder.position_at_end(bb_check)
+        self.branch_diverge(diverge, bb_fork, bb_cont)
+
+        self.ctx.builder.position_at_end(bb_fork)
+        self.ctx.builder.store(c_int(1, 8), flag)
+        func = fn.f_split_mutation(self.ctx.module)
+        self.ctx.builder.call(func, [c_int(m_id)])
+        self.ctx.builder.branch(bb_cont)
+
+        self.ctx.builder.position_at_end(bb_cont)
+
+    def infect_mutant(self, m_id, diverge=None):
+        '''
+        Emits an infection check when generating code for weak mutation.
+        The mutant is flagged as infected when its mutated expression in
+        diverge evaluates to a different value than the original one. When
+        there is nothing to compare, e.g. for deleted statements, it is only
+        flagged as reached, since its infection is unknown.
+        '''
+        if not self.weak_mutation or self.diverging:
+            return
+
+        if m_id not in self.mutant_index:
+            return
+
+        bb_infect = self.ctx.function.append_basic_block('weak.infect')
+        bb_cont = self.ctx.function.append_basic_block('weak.continue')
+
+        if self.branch_diverge(diverge, bb_infect, bb_cont):
+            flag = constants.INFECTED_FLAG
+        else:
+            flag = constants.REACHED_FLAG
+
+        self.ctx.builder.position_at_end(bb_infect)
+        var = fn.mutant_infected_var(self.ctx.module)
+        indices = [c_int(0), c_int(self.mutant_index[m_id])]
+        handle = self.ctx.builder.gep(var, indices)
+        flags = self.ctx.builder.load(handle)
+        flags = self.ctx.builder.or_(flags, c_int(flag, 8))
+        self.ctx.builder.store(flags, handle)
+        self.ctx.builder.branch(bb_cont)
+
+        self.ctx.builder.position_at_end(bb_cont)
+
     def visit_UnaryOpNode(self, node, arg=None):
         assert isinstance(node, ast.UnaryOpNode)
 
@@ -1861,6 +2109,12 @@ class CodegenVisitor(ast.DefaultP86Visitor):
     def visit_BinaryOpNode(self, node, arg=None):
         assert isinstance(node, ast.BinaryOpNode)
 
+        # guards of mutants are tagged with the mutant id
+        if hasattr(node, 'mutant'):
+            self.mark_covered(node.mutant)
+            self.split_mutant(node.mutant)
+            self.infect_mutant(node.mutant)
+
         sign = node.op.name
         left = node.left.accept(self)
         right = node.right.accept(self)
@@ -2092,9 +2346,41 @@ class CodegenVisitor(ast.DefaultP86Visitor):
 
         return symtab.VariableValue(sym.handle, ty)
 
+    def load_mutant_id(self):
+        '''
+        Loads the current mutant id directly from P86.mutant_id. Within
+        functions, the id is loaded once in the entry block, so that guards
+        in loops use the same value and can be hoisted. The load is not
+        marked invariant, since P86.mutant_id is written by the runtime
+        functions of the same module. The main program
+        may select mutants itself, and loads the id where it is used, as
+        do all functions when a child may take on a mutant at a split point.
+        '''
+        var = fn.mutant_id_var(self.ctx.module)
+        ty = symtab.SIntType(32)
+
+        if self.func_scope_level == 0 or self.split_stream:
+            handle = self.ctx.builder.load(var)
+            return symtab.ConstantValue(handle, ty)
+
+        name = self.ctx.function.name
+        if name not in self.mutant_id_loads:
+            bb_entry = self.ctx.function.entry_basic_block
+            builder = lc.Builder.new(bb_entry)
+            builder.position_at_beginning(bb_entry)
+
+            handle = builder.load(var, 'mutant_id')
+            self.mutant_id_loads[name] = handle
+
+        return symtab.ConstantValue(self.mutant_id_loads[name], ty)
+
     def visit_VarLoadNode(self, node, arg=None):
         assert isinstance(node, ast.VarLoadNode)
 
+        # guards of mutants load the mutant id directly
+        if getattr(node, 'active_mutant', False):
+            return self.load_mutant_id()
+
         var = node.var_access.accept(self)
         if isinstance(var, symtab.ConstantValue):
             return var
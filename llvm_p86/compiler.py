@@ -24,18 +24,25 @@ import datetime
 import sys
 import hashlib
 import os
+import re
 import shutil
 
+from collections import OrderedDict
+
 from . import pre
 from . import tokens
 from . import grammar
 from . import ast
 from . import mutation
+from . import report
 from . import typesys
 from . import sourcegen
 from . import log
+from . import executor
+from . import store
 
 try:
+    from llvm import core
     from llvm import ee
     from llvm import passes
     from llvm import target
@@ -49,6 +56,37 @@ except ImportError:
     pass
 
 
+def normalize_ir(text):
+    '''
+    Normalize the LLVM-IR of a function by stripping comments and metadata
+    attachments, and by renaming local values and basic blocks in order of
+    appearance. Identical code thus gets identical text, regardless of the
+    names given to values during code generation.
+    '''
+    names = dict()
+
+    def rename(m):
+        name = m.group(1)
+        if name not in names:
+            names[name] = '%%%d' % len(names)
+
+        return m.group(0).replace('%' + name, names[name], 1)
+
+    def rename_label(m):
+        name = m.group(1)
+        if name not in names:
+            names[name] = '%%%d' % len(names)
+
+        return names[name][1:] + ':'
+
+    text = re.sub(r';.*$', '', text, flags=re.M)
+    text = re.sub(r',\s*![\w.]+\s+!\d+', '', text)
+    text = re.sub(r'^([-\w.$]+):', rename_label, text, flags=re.M)
+    text = re.sub(r'%([-\w.$]+)', rename, text)
+
+    return text
+
+
 class PrintVisitor(ast.NodeVisitor):
 
     def __init__(self):
@@ -142,9 +180,12 @@ class Compiler(object):
 
         self.chars = None
         self.hash = None
+        self.report = None
+        self.report_path = None
         self.mutants = []
         self.defines = dict()
         self.includes = ['.']
+        self.region = None
 
     def define(self, d):
         d = d.split('=')
@@ -172,6 +213,42 @@ class Compiler(object):
         else:
             log.w("compiler", "Invalid include '%s'", path)
 
+    def restrict_function(self, pattern):
+        '''
+        Only mutate functions and procedures with names matching the glob
+        pattern, e.g. 'Check*'.
+        '''
+        self.region = self.region or report.Region()
+        self.region.add_function(pattern)
+
+    def restrict_lines(self, ranges):
+        '''
+        Only mutate the given lines, e.g. '10-20,42'.
+        '''
+        self.region = self.region or report.Region()
+        for r in ranges.split(','):
+            try:
+                bounds = [int(x) for x in r.split('-')]
+            except ValueError:
+                bounds = []
+
+            if len(bounds) not in (1, 2):
+                log.w("compiler", "Invalid line range '%s'" % r)
+                continue
+
+            self.region.add_lines(*bounds)
+
+    def restrict_diff(self, path):
+        '''
+        Only mutate lines changed according to a unified diff.
+        '''
+        self.region = self.region or report.Region()
+        f = open(path, 'r')
+        try:
+            self.region.add_diff(f, self.filename)
+        finally:
+            f.close()
+
     def analyze(self):
         log.d("compiler", "Parsing source code")
         pre.pre_defines = self.defines
@@ -242,36 +319,303 @@ class Compiler(object):
         v = typesys.CallByRefVisitor()
         self.ast.accept(v)
 
-    def mutate(self, mop, rep_path):
-
-        if mop == 'sc':
-            mutator = mutation.SCMutationVisitor(self.filename, self.hash)
-        elif mop == 'dcc':
-            mutator = mutation.DCCMutationVisitor(self.filename, self.hash)
-        elif mop == 'ror':
-            mutator = mutation.RorMutationVisitor(self.filename, self.hash)
-        elif mop == 'cor':
-            mutator = mutation.CorMutationVisitor(self.filename, self.hash)
-        elif mop == 'aor':
-            mutator = mutation.AorMutationVisitor(self.filename, self.hash)
-        elif mop == 'sdl':
-            mutator = mutation.SdlMutationVisitor(self.filename, self.hash)
-        else:
-            log.e("compiler", "Unknown mutation operator %s" % mop)
-            return
+    def mutate(self, mops, rep_path, sequential_ids=False, sample=None,
+               seed=0, stratify=None):
+        '''
+        Mutate the program using one or more mutation operators, given as
+        a list or a comma separated string, e.g. 'ror,aor,cor,sdl'. The
+        operators are applied in sequence, and collect their mutants in
+        one combined report where each mutant is tagged by operator.
+
+        If sample is given, only a random sample of the mutants is
+        generated; a fraction of them (sample below one) or a fixed
+        number, optionally stratified per 'operator', 'function' or
+        'line'.
+        '''
+        if isinstance(mops, str):
+            mops = mops.split(',')
+
+        mutators = []
+        for mop in mops:
+            mop = mop.strip().lower()
+            if mop not in mutation.OPERATORS:
+                log.e("compiler", "Unknown mutation operator %s" % mop)
+                return
+
+            if mop in [m for m, _ in mutators]:
+                continue
+
+            mutator = mutation.OPERATORS[mop](self.filename, self.hash)
+            mutators.append((mop, mutator))
+
+        name = ', '.join([m.report.name for _, m in mutators])
+        rep = report.MutationReport(name, self.filename, self.hash,
+                                    sequential_ids)
+
+        rep.region = self.region
+        for name, hash_, start in self._function_hashes():
+            rep.add_function(name, hash_, start)
+
+        if sample:
+            # enumerate all mutants without generating any, then draw
+            rep.sampler = report.Sampler(sample, seed, stratify)
+            self._apply_mutators(mutators, rep)
+            rep.sampler.draw()
 
-        self.ast.accept(mutator)
+        self._apply_mutators(mutators, rep)
 
-        self.mutants = mutator.report.ids()
+        self.report = rep
+        self.mutants = rep.ids()
         log.i("compiler", "Generated %d mutants" % len(self.mutants))
 
         if rep_path:
-            mutator.report.save(rep_path + "/" + self.name + ".json")
+            self.report_path = rep_path
+            self._save_report()
             shutil.copy2(self.filename, rep_path + "/" + self.name + ".p")
 
-    def synthesize(self):
+    def _routines(self):
+        '''
+        Returns the functions and procedures of the program, keyed by their
+        qualified name, e.g. Outer.Inner for a routine nested within Outer.
+        Each name maps to a list of nodes, since a routine may be declared
+        forward before it is defined.
+        '''
+        routines = OrderedDict()
+
+        stack = [(self.ast, None)]
+        while stack:
+            node, scope = stack.pop()
+            if isinstance(node, (ast.FunctionNode, ast.ProcedureNode)):
+                ident = node.header.identifier
+                if ident:
+                    if scope:
+                        scope = '%s.%s' % (scope, ident.name)
+                    else:
+                        scope = ident.name
+
+                    routines.setdefault(scope, []).append(node)
+
+            stack.extend([(c, scope) for c in reversed(node.children)
+                          if isinstance(c, ast.Node)])
+
+        return routines
+
+    @staticmethod
+    def _references(node):
+        '''
+        Returns the (lower case) names of all identifiers in the tree
+        rooted at node.
+        '''
+        names = set()
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ast.IdentifierNode):
+                names.add(node.name.lower())
+
+            stack.extend([c for c in node.children if isinstance(c, ast.Node)])
+
+        return names
+
+    def _declarations_hash(self):
+        '''
+        Computes a hash of the constants, types and variables declared
+        outside of any function or procedure.
+        '''
+        md5 = hashlib.md5()
+        decls = (ast.ConstListNode, ast.TypeDeclListNode, ast.VarDeclListNode)
+
+        stack = [self.ast]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (ast.FunctionNode, ast.ProcedureNode)):
+                continue
+
+            if isinstance(node, decls):
+                md5.update(node.fingerprint().encode())
+                continue
+
+            stack.extend([c for c in reversed(node.children)
+                          if isinstance(c, ast.Node)])
+
+        return md5.hexdigest()
+
+    def _function_hashes(self):
+        '''
+        Yields the qualified name, dependency hash and start position of
+        each function and procedure in the program.
+
+        The hash of a routine covers its own normalized AST, the routines
+        it calls (transitively), the routines calling it (transitively),
+        the routines it is nested within and the declarations outside of
+        any routine. Routines called by name are resolved conservatively,
+        i.e. a reference depends on every routine with that name.
+        '''
+        routines = self._routines()
+        decls = self._declarations_hash()
+
+        fingerprints = dict()
+        references = dict()
+        by_name = dict()
+        for name, nodes in routines.items():
+            fingerprints[name] = ''.join([n.fingerprint() for n in nodes])
+            references[name] = set()
+            for n in nodes:
+                references[name] |= self._references(n)
+
+            bare = name.split('.')[-1].lower()
+            by_name.setdefault(bare, []).append(name)
+
+        callees = dict()
+        callers = dict([(name, set()) for name in routines])
+        for name in routines:
+            callees[name] = set()
+            for ref in references[name]:
+                callees[name].update(by_name.get(ref, []))
+
+            for callee in callees[name]:
+                callers[callee].add(name)
+
+        def closure(name, edges):
+            seen = set([name])
+            stack = [name]
+            while stack:
+                for other in edges[stack.pop()]:
+                    if other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+            return seen
+
+        for name, nodes in routines.items():
+            deps = closure(name, callees) | closure(name, callers)
+            parts = name.split('.')
+            for i in range(1, len(parts)):
+                deps.add('.'.join(parts[:i]))
+
+            md5 = hashlib.md5(decls.encode())
+            md5.update(fingerprints[name].encode())
+            for dep in sorted(deps - set([name])):
+                md5.update(('%s=%s;' % (dep, fingerprints[dep])).encode())
+
+            node = [n for n in nodes if n.block] or nodes
+            if node[-1].position:
+                yield name, md5.hexdigest(), node[-1].position.lexpos
+
+    def tests_hash(self, args=''):
+        '''
+        Computes a hash of the tests executed when running mutants, i.e.
+        the statements of the main program, the declarations outside of
+        any routine and the arguments. Routines used by the tests are
+        covered by the hash of each mutated routine, see _function_hashes().
+        '''
+        md5 = hashlib.md5(args.encode())
+        md5.update(self._declarations_hash().encode())
+
+        stack = [self.ast]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ast.ProgramNode):
+                if node.block and node.block.stmt:
+                    md5.update(node.block.stmt.fingerprint().encode())
+                break
+
+            stack.extend([c for c in node.children if isinstance(c, ast.Node)])
+
+        return md5.hexdigest()
+
+    def _save_report(self):
+        self.report.save(self.report_path + "/" + self.name +
+                         report.REPORT_EXT)
+
+        st = store.ResultsStore(store.store_path(self.report_path))
+        st.save_report(self.name, self.report)
+        st.close()
+
+    def _apply_mutators(self, mutators, rep):
+        for mop, mutator in mutators:
+            log.d("compiler", "Applying mutation operator %s" % mop)
+            mutator.report = rep
+            rep.operator = mop
+            self.ast.accept(mutator)
+
+        rep.operator = None
+
+    def prune(self, level=2):
+        '''
+        Prune mutants that are trivially equivalent to the original program
+        or to another mutant. The program is specialized for each mutant by
+        making the mutant id a constant, and then optimized. Mutants where
+        all optimized functions are identical to those of the original
+        program are equivalent, and mutants identical to an earlier mutant
+        are duplicates. Neither is executed.
+        '''
+        if not self.mutants:
+            return
+
+        log.i("compiler", "Pruning mutants at optimization level %d" % level)
+        self.synthesize()
+        module = self.ctx.module
+        self.ctx = None
+
+        original = self._fingerprint(module, 0, level)
+        fingerprints = dict()
+        pruned = set()
+
+        for m_id in self.mutants:
+            fingerprint = self._fingerprint(module, m_id, level)
+
+            if fingerprint == original:
+                self.report.set_equivalent(m_id)
+                pruned.add(m_id)
+
+            elif fingerprint in fingerprints:
+                self.report.set_duplicate(m_id, fingerprints[fingerprint])
+                pruned.add(m_id)
+
+            else:
+                fingerprints[fingerprint] = m_id
+
+        self.report.pruning = {'level': level,
+                               'equivalent': self.report.count_equivalent(),
+                               'duplicate': self.report.count_duplicate()}
+
+        self.mutants = [m_id for m_id in self.mutants if m_id not in pruned]
+        log.i("compiler", "Pruned %d mutants, %d remaining" %
+                          (len(pruned), len(self.mutants)))
+
+        if self.report_path:
+            self._save_report()
+
+    def _fingerprint(self, module, m_id, level):
+        '''
+        Hash the functions of a module specialized for a mutant, and
+        optimized at the given level.
+        '''
+        module = module.clone()
+
+        var = fn.mutant_id_var(module)
+        var.initializer = core.Constant.int(core.Type.int(32), m_id)
+        var.global_constant = True
+
+        self._run_passes(module, level)
+
+        hashes = []
+        for func in module.functions:
+            if func.is_declaration or func.name.startswith('P86.'):
+                continue
+
+            text = normalize_ir(str(func))
+            hashes.append((func.name,
+                           hashlib.md5(text.encode()).hexdigest()))
+
+        return tuple(sorted(hashes))
+
+    def synthesize(self, loop_budget=False, coverage=False,
+                   split_stream=False, weak_mutation=False):
         log.d("compiler", "Generating code")
-        v = codegen.CodegenVisitor(self.mutants)
+        v = codegen.CodegenVisitor(self.mutants, loop_budget, coverage,
+                                   split_stream, weak_mutation)
         self.ast.accept(v)
         self.ctx = v.ctx
 
@@ -280,25 +624,33 @@ class Compiler(object):
 
     def optimize(self, level=0):
         log.i("compiler", "Optimizing code at level %d" % level)
+        self._run_passes(self.ctx.module, level)
 
+    def _run_passes(self, module, level):
         pm = passes.PassManager.new()
         pmb = passes.PassManagerBuilder.new()
 
         pmb.opt_level = level
         pmb.populate(pm)
 
-        pm.run(self.ctx.module)
+        pm.run(module)
 
-    def execute(self, args=''):
+    def _jit(self):
         tm = ee.TargetMachine.new(opt=0, cm=ee.CM_JITDEFAULT)
         engine = ee.EngineBuilder.new(self.ctx.module).create(tm)
 
         func = fn.f_module_constructor(self.ctx.module)
         engine.run_function(func, [])
 
-        func = fn.f_main(self.ctx.module)
+        return engine
+
+    def _jit_function(self, engine, func, ret_ct, *arg_cts):
         func = engine.get_pointer_to_function(func)
+        FUNC_TYPE = ctypes.CFUNCTYPE(ret_ct, *arg_cts)
 
+        return FUNC_TYPE(func)
+
+    def _jit_main(self, engine, args):
         if len(args):
             args = args.split(' ')
             args.insert(0, self.filename)
@@ -307,17 +659,278 @@ class Compiler(object):
 
         args = [x.encode() for x in args]
 
-        ret_ct = ctypes.c_int
+        ret_ct = None
         argv_ct = ctypes.ARRAY(ctypes.c_char_p, len(args))
         argc_ct = ctypes.c_int
 
-        FUNC_TYPE = ctypes.CFUNCTYPE(ret_ct, *[argc_ct, argv_ct])
-        py_main = FUNC_TYPE(func)
+        func = fn.f_main(self.ctx.module)
+        py_main = self._jit_function(engine, func, ret_ct, argc_ct, argv_ct)
 
         argc = argc_ct(len(args))
         argv = argv_ct(*args)
 
-        py_main(argc, argv)
+        return lambda: py_main(argc, argv)
+
+    def execute(self, args=''):
+        engine = self._jit()
+        py_main = self._jit_main(engine, args)
+        py_main()
+
+    def run_mutants(self, args='', jobs=1, path=None, timeout=None,
+                    coverage=False, split_stream=False, tests=False,
+                    history=None, cache_path=None):
+        '''
+        Execute the main function once for each mutant. The program is
+        JIT compiled and its module constructor is executed once, and then
+        a copy-on-write child is forked for each mutant, running at most
+        jobs children at a time. A mutant is killed if its child terminates
+        with a non-zero exit status. Results are streamed to path, which
+        defaults to the folder of the mutation report (if any).
+
+        If the code was synthesized with loop budgets, timeout is the
+        number of times more loop iterations a mutant may execute compared
+        to the original program before it is halted.
+
+        If the code was synthesized with coverage, mutants never reached
+        by the original program are recorded as survived (not covered)
+        without being executed.
+
+        If the code was synthesized for split-stream execution, the original
+        program is executed once, and a child is forked for each mutant when
+        its state first diverges from the original program.
+
+        If tests is set, the test cases killing each mutant are recorded,
+        see executor.Executor.track_tests(). The test cases are prioritized
+        using the kill matrix of an earlier results file, history.
+
+        If cache_path is given, verdicts of mutants in functions that are
+        unchanged since an earlier run with the same tests are reused from
+        the results store in cache_path, and new verdicts are added to it
+        (incremental mutation testing).
+        '''
+        engine = self._jit()
+        py_main = self._jit_main(engine, args)
+
+        func = fn.f_set_mutation(self.ctx.module)
+        set_mutation = self._jit_function(engine, func, None, ctypes.c_int)
+
+        func = fn.f_get_mutation_id(self.ctx.module)
+        get_mutation_id = self._jit_function(engine, func, ctypes.c_int)
+
+        func = fn.f_get_mutation_count(self.ctx.module)
+        get_mutation_count = self._jit_function(engine, func, ctypes.c_int)
+
+        func = fn.f_get_mutation_covered(self.ctx.module)
+        get_mutation_covered = self._jit_function(engine, func, ctypes.c_int,
+                                                  ctypes.c_int)
+
+        func = fn.f_get_loop_count(self.ctx.module)
+        get_loop_count = self._jit_function(engine, func, ctypes.c_uint64)
+
+        func = fn.f_set_loop_budget(self.ctx.module)
+        set_loop_budget = self._jit_function(engine, func, None,
+                                             ctypes.c_uint64)
+
+        def run_mutant(index):
+            set_mutation(index)
+            py_main()
+
+        def mutant_id(index):
+            set_mutation(index)
+            m_id = get_mutation_id()
+            set_mutation(0)
+            return m_id
+
+        count = get_mutation_count()
+
+        def calibrate():
+            loops = get_loop_count()
+            covered = [i for i in range(1, count + 1)
+                       if get_mutation_covered(i)]
+            return loops, covered
+
+        if not path and self.report_path:
+            path = self.report_path + "/" + self.name + report.RESULTS_EXT
+
+        info = {'filename': self.filename,
+                'md5': self.hash}
+
+        e = executor.ForkExecutor(run_mutant, jobs, path, mutant_id, info)
+        covered = None
+
+        if tests or history:
+            if history:
+                history = executor.load_kill_matrix(history)
+
+            e.track_tests(history)
+
+        if timeout or coverage:
+            value, code = e.probe(0, calibrate)
+            if code != 0:
+                log.w("compiler", "The original program terminated abnormally")
+
+            loops, covered = value or (0, [])
+
+            if not coverage:
+                covered = None
+            else:
+                covered = set(covered)
+                log.i("compiler", "Original program reached %d of %d "
+                                  "mutants" % (len(covered), count))
+
+            if timeout:
+                budget = max(loops * timeout, executor.MIN_LOOP_BUDGET)
+                log.i("compiler", "Original program executed %d loop "
+                                  "iterations, halting mutants after %d" %
+                                  (loops, budget))
+                set_loop_budget(budget)
+
+        # the original program also tells the number of test cases
+        if e.tests or not (timeout or coverage or split_stream):
+            e.check_original()
+
+        known = dict()
+        keys = dict()
+        tests_hash = None
+        if cache_path and self.report:
+            tests_hash = self.tests_hash(args)
+            st = store.ResultsStore(cache_path)
+
+            for index in range(1, count + 1):
+                m_id = mutant_id(index)
+                mutant = self.report.get_mutant(m_id)
+                if not mutant:
+                    continue
+
+                keys[m_id] = store.cache_key(self.report, mutant)
+                obj = st.lookup(keys[m_id], tests_hash)
+                if obj:
+                    res = executor.MutantResult(index, m_id, obj['exit'],
+                                                obj['time'], obj['covered'],
+                                                obj.get('tests'), cached=True)
+                    known[index] = res
+
+            st.close()
+            log.i("compiler", "Reusing %d cached verdicts" % len(known))
+
+        if split_stream:
+            func = fn.f_set_split_hook(self.ctx.module)
+            set_split_hook = self._jit_function(engine, func, None,
+                                                executor.SPLIT_HOOK)
+            hook = executor.SPLIT_HOOK(e.split)
+            set_split_hook(hook)
+
+            e.run_split(range(1, count + 1), covered, known)
+        else:
+            e.run(range(1, count + 1), covered, known)
+
+        # unknown outcomes are never reused
+        for res in e.results:
+            if res.verdict == executor.UNKNOWN:
+                keys.pop(res.id, None)
+
+        # the results are saved to the store of the reports, and to the
+        # store used as cache (if another one) along with the report
+        paths = list()
+        report_store = None
+        if self.report_path:
+            report_store = os.path.abspath(store.store_path(self.report_path))
+            paths.append(report_store)
+        if keys and os.path.abspath(cache_path) != report_store:
+            paths.append(os.path.abspath(cache_path))
+
+        for path in paths:
+            st = store.ResultsStore(path)
+            if path != report_store:
+                st.save_report(self.name, self.report)
+
+            st.save_results(self.name, e.info(), e.results, tests_hash, keys)
+            st.close()
+
+        e.summary()
+
+        return e.results
+
+    def run_weak_mutation(self, args='', path=None):
+        '''
+        Execute the main function once, without any mutant selected, and
+        record the mutants that infected the state of the program, i.e.
+        whose mutated expression evaluated to a different value than the
+        original one. Requires code synthesized for weak mutation. The
+        weak kill set is saved to path, which defaults to the folder of the
+        mutation report (if any).
+        '''
+        engine = self._jit()
+        py_main = self._jit_main(engine, args)
+
+        func = fn.f_set_mutation(self.ctx.module)
+        set_mutation = self._jit_function(engine, func, None, ctypes.c_int)
+
+        func = fn.f_get_mutation_id(self.ctx.module)
+        get_mutation_id = self._jit_function(engine, func, ctypes.c_int)
+
+        func = fn.f_get_mutation_count(self.ctx.module)
+        get_mutation_count = self._jit_function(engine, func, ctypes.c_int)
+
+        func = fn.f_get_mutation_covered(self.ctx.module)
+        get_mutation_covered = self._jit_function(engine, func, ctypes.c_int,
+                                                  ctypes.c_int)
+
+        func = fn.f_get_mutation_infected(self.ctx.module)
+        get_mutation_infected = self._jit_function(engine, func, ctypes.c_int,
+                                                   ctypes.c_int)
+
+        def run_mutant(index):
+            set_mutation(index)
+            py_main()
+
+        count = get_mutation_count()
+
+        def flags():
+            return [(get_mutation_infected(i), get_mutation_covered(i))
+                    for i in range(1, count + 1)]
+
+        e = executor.ForkExecutor(run_mutant)
+        flags, code = e.probe(0, flags)
+        if code != 0:
+            log.w("compiler", "The original program terminated abnormally")
+
+        if flags is None:
+            flags = [(0, 0)] * count
+
+        if not path and self.report_path:
+            path = self.report_path + "/" + self.name + report.WEAK_EXT
+
+        if path:
+            info = {'filename': self.filename,
+                    'md5': self.hash,
+                    'weak': True}
+            out = executor.ResultsFile(path, info)
+        else:
+            out = None
+
+        results = []
+        for index, (infected, covered) in enumerate(flags, 1):
+            set_mutation(index)
+            res = executor.WeakResult(index, get_mutation_id(), infected,
+                                      bool(covered))
+            results.append(res)
+            if out:
+                out.write(res)
+
+        set_mutation(0)
+        if out:
+            out.close()
+
+        infected = len([r for r in results if r.infected])
+        unknown = len([r for r in results if r.unknown])
+        print("Infected: %d of %d" % (infected, count))
+        print("Unknown:  %d (reached, nothing to compare)" % unknown)
+        if count > unknown:
+            print("Weak mutation score: %.1f%%" %
+                  (100.0 * infected / (count - unknown)))
+
+        return results
 
     def _open_file(self, path):
         basedir = os.path.dirname(path)
@@ -0,0 +1,32 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Constants shared by the code generator and the mutant executor.
+'''
+
+# exit code of mutants halted when exceeding their loop budget, or their
+# time limit
+TIMEOUT_EXIT_CODE = 124
+
+# infection flags of mutants under weak mutation, set when the mutated
+# expression evaluates to a different value than the original one, and
+# when the mutant is reached without anything to compare respectively
+INFECTED_FLAG = 1
+REACHED_FLAG = 2
@@ -0,0 +1,856 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Parallel execution of mutants.
+'''
+
+import ctypes
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from argparse import ArgumentTypeError
+from collections import Counter
+
+from . import log
+from . import store
+from .constants import TIMEOUT_EXIT_CODE, INFECTED_FLAG, REACHED_FLAG
+
+
+KILLED = 'killed'
+SURVIVED = 'survived'
+TIMEOUT = 'timeout'
+UNKNOWN = 'unknown'
+
+# smallest loop budget given to mutants, regardless of calibration
+MIN_LOOP_BUDGET = 100000
+
+# shortest time limit in seconds given to mutants, see Executor.timeout
+MIN_TIMEOUT = 1.0
+
+# hook installed with P86.setsplithook() for split-stream execution
+SPLIT_HOOK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int)
+
+
+def exit_code(status):
+    '''
+    Translate a status returned by os.wait() into an exit code. Processes
+    terminated by a signal get the negated signal number as exit code.
+    '''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+def timeout_factor(s):
+    try:
+        factor = float(s)
+    except ValueError:
+        raise ArgumentTypeError("invalid timeout factor '%s'" % s)
+
+    if factor <= 0:
+        raise ArgumentTypeError("timeout factor must be positive")
+
+    return factor
+
+
+def load_kill_matrix(path, by_index=False):
+    '''
+    Load the kill matrix recorded in a results file, i.e. the test cases
+    that killed each mutant, keyed by mutant id (or index when the id is
+    unknown, or by_index is set).
+    '''
+    matrix = dict()
+    with open(path) as f:
+        for lineno, line in enumerate(f):
+            if not lineno or not line.strip():
+                continue
+
+            obj = json.loads(line)
+            if obj.get('tests') is None:
+                continue
+
+            key = obj['index']
+            if obj.get('id') is not None and not by_index:
+                key = obj['id']
+
+            matrix[key] = obj['tests']
+
+    return matrix
+
+
+class MutantResult(object):
+    '''
+    Outcome of executing a mutant, given by its exit code. Mutants with
+    no exit code were never executed, and have an unknown outcome.
+    '''
+
+    def __init__(self, index, id_, code, elapsed, covered=True, tests=None,
+                 cached=False):
+        self.index = index
+        self.id = id_
+        self.code = code
+        self.time = elapsed
+        self.covered = covered
+        self.tests = tests
+        self.cached = cached
+
+    @property
+    def verdict(self):
+        if not self.covered:
+            return SURVIVED
+        elif self.code is None:
+            return UNKNOWN
+        elif self.code == TIMEOUT_EXIT_CODE:
+            return TIMEOUT
+        elif self.code != 0:
+            return KILLED
+        else:
+            return SURVIVED
+
+    def obj(self):
+        obj = {'index': self.index,
+               'id': self.id,
+               'verdict': self.verdict,
+               'exit': self.code,
+               'time': round(self.time, 6),
+               'covered': self.covered}
+
+        if self.tests is not None:
+            obj['tests'] = self.tests
+
+        if self.cached:
+            obj['cached'] = True
+
+        return obj
+
+
+class WeakResult(object):
+    '''
+    Outcome of a mutant under weak mutation, i.e. whether the mutant
+    infected the state of the original program when executed once, given
+    by its infection flags. Mutants reached without anything to compare
+    have an unknown outcome, and are not part of the weak mutation score.
+    '''
+
+    def __init__(self, index, id_, flags, covered=True):
+        self.index = index
+        self.id = id_
+        self.flags = flags
+        self.covered = covered
+
+    @property
+    def infected(self):
+        return bool(self.flags & INFECTED_FLAG)
+
+    @property
+    def unknown(self):
+        return not self.infected and bool(self.flags & REACHED_FLAG)
+
+    @property
+    def verdict(self):
+        if self.infected:
+            return KILLED
+        elif self.unknown:
+            return UNKNOWN
+        else:
+            return SURVIVED
+
+    def obj(self):
+        return {'index': self.index,
+                'id': self.id,
+                'verdict': self.verdict,
+                'infected': self.infected,
+                'covered': self.covered}
+
+
+class ResultsFile(object):
+    '''
+    Streams results as JSON lines. The first line holds information
+    about the run, followed by one line per executed mutant.
+    '''
+
+    def __init__(self, path, info):
+        log.i("executor", "Saving results to %s" % path)
+        dir_ = os.path.dirname(path)
+        if dir_ and not os.path.exists(dir_):
+            os.makedirs(dir_)
+
+        self.f = open(path, 'w')
+
+        info = dict(info)
+        info['timestamp'] = int(time.time())
+        self._write(info)
+
+    def _write(self, obj):
+        self.f.write(json.dumps(obj) + '\n')
+        self.f.flush()
+
+    def write(self, result):
+        self._write(result.obj())
+
+    def close(self):
+        self.f.close()
+
+
+class Executor(object):
+    '''
+    Executes mutants in parallel, using at most jobs child processes at
+    a time. The class is abstract: each mutant is executed in a child
+    forked by spawn(), and subclasses implement execute() to decide how
+    the child executes the mutant.
+    '''
+
+    def __init__(self, jobs=1, path=None):
+        self.jobs = max(1, jobs)
+        self.path = path
+        self.results = list()
+
+        # wall time limit in seconds of each mutant, see wait()
+        self.timeout = None
+        self.original_time = None
+        self._halted = set()
+
+        # test case tracking, see track_tests()
+        self.tests = False
+        self.history = None
+        self.ranking = list()
+        self.test_count = 0
+        self._test_files = dict()
+
+        # mutant ids reported by the children, keyed by index, when
+        # report_ids is set
+        self.report_ids = False
+        self.ids = dict()
+
+    def spawn(self, index):
+        '''
+        Fork a child executing the mutant with the given index (zero for
+        the original program), and return its pid. The child terminates
+        with the exit code returned by execute().
+        '''
+        pid = self.fork(index)
+        if pid:
+            return pid
+
+        status = 1
+        try:
+            status = self.execute(index)
+        finally:
+            os._exit(status)
+
+    def execute(self, index):
+        '''
+        Execute the mutant with the given index in a child, and return its
+        exit code. Must be implemented by subclasses.
+        '''
+        raise NotImplementedError
+
+    def mutant_id(self, index):
+        return self.ids.get(index)
+
+    def info(self):
+        info = {'jobs': self.jobs}
+        if self.tests:
+            info['tests'] = self.test_count
+            info['prioritized'] = self.history is not None
+
+        return info
+
+    def track_tests(self, history=None):
+        '''
+        Record the test cases killing each mutant, as reported by programs
+        calling P86.begintest() and P86.failtest(). Given the kill matrix
+        of an earlier run (history), the test cases of each mutant are
+        ordered by P86.gettestorder() so that those that killed the mutant
+        before, followed by those that killed the most mutants, are executed
+        first. Mutants are then halted at their first failing test case.
+        '''
+        self.tests = True
+        self.history = history
+
+        if history:
+            kills = Counter()
+            for tests in history.values():
+                kills.update(tests)
+
+            self.ranking = [t for t, _ in kills.most_common()]
+
+    def test_order(self, index):
+        '''
+        Returns the order in which the test cases should be executed for
+        the mutant with the given index, as a permutation of all test cases,
+        or None for the natural order. The original program (index 0) is
+        executed in the natural order, which tells the number of test cases
+        (see check_original()). Until then, the order is unknown.
+        '''
+        if not self.history or not index or not self.test_count:
+            return None
+
+        key = self.mutant_id(index)
+        if key is None:
+            key = index
+
+        # test cases no longer in the suite are dropped, and those never
+        # ranked follow in their natural order
+        order = []
+        seen = set()
+        tests = list(self.history.get(key, []))
+        tests += self.ranking + list(range(1, self.test_count + 1))
+        for t in tests:
+            if 1 <= t <= self.test_count and t not in seen:
+                seen.add(t)
+                order.append(t)
+
+        return order
+
+    def fork(self, index=None):
+        '''
+        Fork a child with stdout and stderr redirected to /dev/null. When
+        tracking test cases or mutant ids, the child reports them to a
+        temporary file.
+        '''
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        tmp = None
+        if (self.tests or self.report_ids) and index is not None:
+            tmp = tempfile.TemporaryFile()
+
+        pid = os.fork()
+        if pid == 0:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+
+            if tmp:
+                # keep the file open for as long as the child lives
+                self._test_files[os.getpid()] = (index, tmp)
+
+                if hasattr(os, 'set_inheritable'):
+                    os.set_inheritable(tmp.fileno(), True)
+
+                os.environ['P86_TEST_FD'] = str(tmp.fileno())
+
+                order = self.tests and self.test_order(index)
+                if order:
+                    os.environ['P86_TEST_ORDER'] = ','.join(map(str, order))
+                    os.environ['P86_TEST_STOP'] = '1'
+
+        elif tmp:
+            self._test_files[pid] = (index, tmp)
+
+        return pid
+
+    def collect_tests(self, pid, code):
+        '''
+        Returns the test cases that killed the child pid terminating with
+        exit code, or None if test cases are not tracked. A child that
+        terminates abnormally without any failing test case was killed by
+        the test case in progress. The mutant id reported by the child,
+        if any, is recorded in ids.
+        '''
+        index, tmp = self._test_files.pop(pid, (None, None))
+        if tmp is None:
+            return None
+
+        tmp.seek(0)
+        failed = []
+        current = None
+        for line in tmp.read().decode().splitlines():
+            event, _, num = line.partition(' ')
+            if event == 'begin':
+                current = int(num)
+                self.test_count = max(self.test_count, current)
+            elif event == 'fail' and int(num) not in failed:
+                failed.append(int(num))
+            elif event == 'mutant' and index:
+                self.ids[index] = int(num)
+
+        tmp.close()
+
+        if not self.tests:
+            return None
+
+        if code != 0 and not failed and current is not None:
+            failed.append(current)
+
+        return failed
+
+    def check_original(self):
+        '''
+        Run the original program (mutant 0) to make sure the test suite
+        passes before any mutant is executed.
+        '''
+        start = time.time()
+        pid = self.spawn(0)
+        _, code = self.wait({pid: (0, start)})
+        self.original_time = time.time() - start
+
+        failed = self.collect_tests(pid, code)
+        if failed:
+            log.w("executor", "Test cases %s fail on the original program" %
+                              ', '.join(map(str, failed)))
+
+        if code != 0:
+            log.w("executor", "The original program terminated abnormally")
+            return False
+
+        return True
+
+    def run(self, indices, covered=None, known=None):
+        '''
+        Execute the mutants with the given indices. If covered is given,
+        mutants not in covered are never reached by the test suite, and
+        are recorded as survived without being executed. Results already
+        known, e.g. from an earlier run, are given by known (a dict keyed
+        by index) and recorded as is.
+        '''
+        indices = iter(indices)
+        running = dict()
+
+        if self.path:
+            out = ResultsFile(self.path, self.info())
+        else:
+            out = None
+
+        try:
+            while True:
+                while len(running) < self.jobs:
+                    index = next(indices, None)
+                    if index is None:
+                        break
+
+                    if known and index in known:
+                        self.record(known[index], out)
+                        continue
+
+                    if covered is not None and index not in covered:
+                        res = MutantResult(index, self.mutant_id(index),
+                                           None, 0.0, False)
+                        self.record(res, out)
+                        continue
+
+                    pid = self.spawn(index)
+                    running[pid] = (index, time.time())
+
+                if not running:
+                    break
+
+                pid, code = self.wait(running)
+                if pid not in running:
+                    continue
+
+                index, start = running.pop(pid)
+                tests = self.collect_tests(pid, code)
+                res = MutantResult(index, self.mutant_id(index), code,
+                                   time.time() - start, tests=tests)
+                self.record(res, out)
+        finally:
+            if out:
+                out.close()
+
+        return self.results
+
+    def wait(self, running):
+        '''
+        Wait for a child to terminate, and return its pid and exit code.
+        Children in running (a dict of index and start time keyed by pid)
+        executing for longer than timeout seconds are killed, and reported
+        with TIMEOUT_EXIT_CODE.
+        '''
+        if not self.timeout:
+            pid, status = os.wait()
+            return pid, exit_code(status)
+
+        while True:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid in self._halted:
+                self._halted.discard(pid)
+                return pid, TIMEOUT_EXIT_CODE
+            elif pid:
+                return pid, exit_code(status)
+
+            now = time.time()
+            for pid, (_, start) in running.items():
+                if now - start > self.timeout and pid not in self._halted:
+                    os.kill(pid, signal.SIGKILL)
+                    self._halted.add(pid)
+
+            time.sleep(0.01)
+
+    def record(self, res, out=None):
+        if res.covered and res.verdict == SURVIVED and not res.cached:
+            log.i("executor", "Mutant %s survived" %
+                              (res.id if res.id is not None
+                               else '#%d' % res.index))
+
+        self.results.append(res)
+        if out:
+            out.write(res)
+
+    def count(self, verdict):
+        return len([r for r in self.results if r.verdict == verdict])
+
+    def summary(self):
+        print("Killed:   %d" % self.count(KILLED))
+        print("Timeout:  %d" % self.count(TIMEOUT))
+        uncovered = len([r for r in self.results if not r.covered])
+        print("Survived: %d (%d not covered)" % (self.count(SURVIVED),
+                                                 uncovered))
+        if self.count(UNKNOWN):
+            print("Unknown:  %d" % self.count(UNKNOWN))
+
+
+class ForkExecutor(Executor):
+    '''
+    Executes mutants of a program already loaded into this process.
+    Each child is a copy-on-write fork of the parent that executes
+    func(index) and exits.
+    '''
+
+    def __init__(self, func, jobs=1, path=None, mutant_id=None, info=None):
+        Executor.__init__(self, jobs, path)
+        self.func = func
+        self._mutant_id = mutant_id
+        self._info = info or dict()
+
+        # children forked by the original program during split-stream
+        # execution, only set in the process executing the original program
+        self._split = None
+        self._wfd = None
+        self._libc = None
+        self._skip = set()
+
+    def mutant_id(self, index):
+        if self._mutant_id:
+            return self._mutant_id(index)
+
+    def info(self):
+        info = Executor.info(self)
+        info.update(self._info)
+        return info
+
+    def execute(self, index):
+        try:
+            self.func(index)
+        except:
+            return 1
+
+        return 0
+
+    def probe(self, index, func):
+        '''
+        Execute a mutant in a child, and return a tuple (value, code) where
+        value is func() evaluated in the child when it terminates, e.g. a
+        counter maintained by the program, and code is the exit code of the
+        child. The value must be serializable as json. Programs may
+        terminate by calling exit() directly, so func() is also evaluated
+        by an exit handler (glibc only). If the child never evaluates
+        func(), value is None.
+        '''
+        rfd, wfd = os.pipe()
+
+        pid = self.fork()
+        if pid == 0:
+            os.close(rfd)
+            reported = []
+
+            def report(*args):
+                if not reported:
+                    reported.append(True)
+                    os.write(wfd, json.dumps(func()).encode())
+
+            hook = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.c_void_p)
+            hook = hook(report)
+            try:
+                ctypes.CDLL(None).on_exit(hook, None)
+            except AttributeError:
+                pass
+
+            status = 0
+            try:
+                self.func(index)
+            except:
+                status = 1
+
+            report()
+            os._exit(status)
+
+        os.close(wfd)
+
+        data = b''
+        while True:
+            chunk = os.read(rfd, 64)
+            if not chunk:
+                break
+            data += chunk
+
+        os.close(rfd)
+        _, status = os.waitpid(pid, 0)
+
+        value = None
+        if data:
+            value = json.loads(data.decode())
+
+        return value, exit_code(status)
+
+
+    def split(self, m_id):
+        '''
+        Split hook, called by the original program when the state of the
+        mutant m_id first diverges from it. A child is forked that continues
+        executing as the mutant, and zero is returned within that child.
+        At most jobs children run at a time.
+        '''
+        if self._split is None or m_id in self._skip:
+            return -1
+
+        while len(self._split) >= self.jobs:
+            self._reap()
+
+        # avoid buffered output being written by both processes
+        self._libc.fflush(None)
+
+        try:
+            pid = self.fork()
+        except OSError as e:
+            log.w("executor", "Unable to fork mutant %d: %s" % (m_id, e))
+            return -1
+
+        if pid == 0:
+            self._split = None
+            os.close(self._wfd)
+            return 0
+
+        self._split[pid] = (m_id, time.time())
+        return pid
+
+    def _reap(self):
+        pid, status = os.wait()
+        if pid not in self._split:
+            return
+
+        m_id, start = self._split.pop(pid)
+        obj = {'id': m_id,
+               'exit': exit_code(status),
+               'time': time.time() - start}
+        os.write(self._wfd, (json.dumps(obj) + '\n').encode())
+
+    def _run_original(self, wfd):
+        '''
+        Execute the original program in a child forked by run_split(),
+        and report the result of each mutant forked by split() to wfd.
+        '''
+        self._split = dict()
+        self._wfd = wfd
+        self._libc = ctypes.CDLL(None)
+
+        def finish(*args):
+            # mutants terminating by calling exit() run the handler as well
+            if self._split is None:
+                return
+
+            while self._split:
+                self._reap()
+
+            self._split = None
+
+        hook = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.c_void_p)
+        hook = hook(finish)
+        try:
+            self._libc.on_exit(hook, None)
+        except AttributeError:
+            pass
+
+        status = 0
+        try:
+            self.func(0)
+        except:
+            status = 1
+
+        finish()
+        os._exit(status)
+
+    def run_split(self, indices, covered=None, known=None):
+        '''
+        Split-stream execution of the mutants with the given indices. The
+        original program is executed once, and forks a child continuing as
+        a mutant when the state of the mutant first diverges (see split()),
+        so that the execution leading up to that point is shared by all
+        mutants. Requires the program to be synthesized for split-stream
+        execution, with split() installed as its split hook.
+
+        Mutants never forked behave like the original program, and are
+        recorded as survived without being executed. If the original program
+        terminates abnormally, their outcome is unknown instead, since they
+        may never have reached the point of divergence. If covered is given,
+        mutants not in covered are flagged as not covered. Mutants with
+        known results (a dict keyed by index) are never forked.
+        '''
+        known = known or dict()
+        self._skip = set([res.id for res in known.values()])
+
+        rfd, wfd = os.pipe()
+
+        pid = self.fork()
+        if pid == 0:
+            os.close(rfd)
+            self._run_original(wfd)
+
+        os.close(wfd)
+
+        data = b''
+        while True:
+            chunk = os.read(rfd, 4096)
+            if not chunk:
+                break
+            data += chunk
+
+        os.close(rfd)
+        _, status = os.waitpid(pid, 0)
+
+        # exit code of mutants that never diverged from the original program
+        code = 0
+        if exit_code(status) != 0:
+            log.w("executor", "The original program terminated abnormally")
+            code = None
+
+        split = dict()
+        for line in data.decode().splitlines():
+            obj = json.loads(line)
+            split[obj['id']] = obj
+
+        log.i("executor", "%d mutants diverged from the original program" %
+                          len(split))
+
+        if self.path:
+            out = ResultsFile(self.path, self.info())
+        else:
+            out = None
+
+        try:
+            for index in indices:
+                m_id = self.mutant_id(index)
+                obj = split.get(m_id)
+
+                if index in known:
+                    res = known[index]
+                elif obj:
+                    res = MutantResult(index, m_id, obj['exit'], obj['time'])
+                else:
+                    reached = covered is None or index in covered
+                    res = MutantResult(index, m_id, code, 0.0, reached)
+
+                self.record(res, out)
+        finally:
+            if out:
+                out.close()
+
+        return self.results
+
+
+class CommandExecutor(Executor):
+    '''
+    Executes mutants of a linked program, e.g. a test driver, by passing
+    the mutant index as the last command line argument. The id of each
+    mutant is reported by the program when selecting it, see
+    P86.setmutation().
+    '''
+
+    def __init__(self, cmd, jobs=1, path=None):
+        Executor.__init__(self, jobs, path)
+        self.cmd = list(cmd)
+        self.report_ids = True
+
+    def info(self):
+        info = Executor.info(self)
+        info['command'] = ' '.join(self.cmd)
+        return info
+
+    def mutant_count(self):
+        '''
+        Ask the program for the number of mutants, by executing it
+        without a mutant index.
+        '''
+        out = subprocess.check_output(self.cmd)
+        return int(out.split()[-1])
+
+    def execute(self, index):
+        args = self.cmd + [str(index)]
+        try:
+            os.execvp(args[0], args)
+        except OSError:
+            return 127
+
+
+def run():
+    try:
+        parser = ArgumentParser(description="Execute each mutant of a "
+                                "program linked with llvm-p86 mutants. The "
+                                "mutant index is passed as the last argument")
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, help="number of mutants to execute in parallel")
+        parser.add_argument("-n", "--count", dest="count", type=int, help="number of mutants, by default the program is asked by executing it without any mutant index")
+        parser.add_argument("-o", "--output", dest="output", metavar="PATH", action="store", help="stream the results to PATH in json lines format")
+        parser.add_argument("-t", "--tests", dest="tests", action="store_true", help="record the test cases killing each mutant, reported by the program\nwith begintest() and failtest()")
+        parser.add_argument("-p", "--prioritize", dest="history", metavar="PATH", action="store", help="execute the test cases that killed mutants in the results stored in\nPATH first, halting each mutant at its first failing test case")
+        parser.add_argument("--timeout", dest="timeout", metavar="FACTOR", action="store", type=timeout_factor, help="halt mutants executing FACTOR times longer than the original program\n(at least %.0f second)" % MIN_TIMEOUT)
+        parser.add_argument("-s", "--store", dest="store", metavar="PATH", action="store", help="save the results to the results store (sqlite) in PATH, holding the\nreports of the linked modules, e.g. wwwroot/data/llvm-p86.sqlite")
+        parser.add_argument(dest="cmd", metavar="command", nargs='+')
+
+        args = parser.parse_args()
+
+        e = CommandExecutor(args.cmd, args.jobs, args.output)
+        if args.tests or args.history:
+            history = None
+            if args.history:
+                # linked programs select their mutants by index
+                history = load_kill_matrix(args.history, by_index=True)
+
+            e.track_tests(history)
+
+        count = args.count
+        if count is None:
+            count = e.mutant_count()
+
+        if not e.check_original():
+            print("Test suite contains errors")
+
+        if args.timeout:
+            e.timeout = max(e.original_time * args.timeout, MIN_TIMEOUT)
+            log.i("executor", "Halting mutants after %.1f seconds" % e.timeout)
+
+        e.run(range(1, count + 1))
+
+        if args.store:
+            st = store.ResultsStore(args.store)
+            st.save_run(e.info(), e.results)
+            st.close()
+
+        e.summary()
+
+        return 0
+
+    except KeyboardInterrupt:
+        return 0
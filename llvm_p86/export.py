@@ -0,0 +1,297 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Export of mutation reports as a static web site, which can be served by
+any web server without running llvm-p86-webserver.
+
+The site holds an index page listing the reports, and one page per
+report and range of lines holding the source on those lines, followed by
+each mutant located there rendered as a hunk of source.
+'''
+
+import io
+import json
+import os
+import shutil
+import time
+from argparse import ArgumentParser
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+from . import log
+from . import report
+
+
+# default number of source lines on each page of a report
+PAGE_SIZE = 500
+
+PAGE_HEADER = '''<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<script type="text/javascript">var g_mutant;</script>
+<script type="text/javascript" src="js/sh_main.js"></script>
+<script type="text/javascript" src="js/sh_pascal.js"></script>
+<link type="text/css" rel="stylesheet" href="css/sh_style.css">
+<link type="text/css" rel="stylesheet" href="css/xx.css">
+</head>
+<body onload="if(window.sh_highlightDocument) sh_highlightDocument();">
+<h1>%(title)s</h1>
+'''
+
+PAGE_FOOTER = '''</body>
+</html>
+'''
+
+
+def load_verdicts(path):
+    '''
+    Load the verdict of each mutant in a results file, keyed by mutant id.
+    '''
+    verdicts = dict()
+    with open(path) as f:
+        for lineno, line in enumerate(f):
+            if not lineno or not line.strip():
+                continue
+
+            obj = json.loads(line)
+            if obj.get('id') is not None:
+                verdicts[str(obj['id'])] = obj['verdict']
+
+    return verdicts
+
+
+def page_name(name, page):
+    if page == 0:
+        return '%s.html' % name
+    else:
+        return '%s.%d.html' % (name, page + 1)
+
+
+class StaticSite(object):
+
+    def __init__(self, data, output, page_size=PAGE_SIZE,
+                 context=report.HUNK_CONTEXT):
+        self.data = data
+        self.output = output
+        self.page_size = max(page_size, 1)
+        self.context = context
+        self.reports = list()
+
+    def write(self, filename, text):
+        f = io.open(os.path.join(self.output, filename), 'w', encoding='utf-8')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+    def copy_assets(self, root):
+        for folder in ('js', 'css'):
+            src = os.path.join(root, folder)
+            dst = os.path.join(self.output, folder)
+            if not os.path.isdir(src):
+                log.w("export", "No %s folder in %s, pages will not be "
+                                "highlighted" % (folder, root))
+                continue
+
+            if os.path.exists(dst):
+                shutil.rmtree(dst)
+            shutil.copytree(src, dst)
+
+    def export(self):
+        if not os.path.exists(self.output):
+            os.makedirs(self.output)
+
+        # reports in json lines format take precedence over legacy ones
+        files = dict()
+        for f in sorted(os.listdir(self.data)):
+            name = report.report_name(f)
+            if name and os.path.exists(os.path.join(self.data, name + '.p')):
+                files[name] = f
+
+        for name in sorted(files):
+            self.export_report(name, files[name])
+
+        self.export_index()
+
+    def export_report(self, name, filename):
+        log.i("export", "Exporting report %s" % name)
+        rep = report.load(os.path.join(self.data, filename))
+
+        f = io.open(os.path.join(self.data, name + '.p'), 'rb')
+        try:
+            source = f.read().decode('utf-8', 'replace')
+        finally:
+            f.close()
+
+        verdicts = dict()
+        results = os.path.join(self.data, name + report.RESULTS_EXT)
+        if os.path.exists(results):
+            verdicts = load_verdicts(results)
+
+        lines = source.split('\n')
+        count = (len(lines) - 1) // self.page_size + 1
+
+        pages = [list() for _ in range(count)]
+        for m in sorted(rep['mutants'], key=lambda m: (m['line'], m['start'])):
+            page = min((m['line'] - 1) // self.page_size, count - 1)
+            pages[page].append(m)
+
+        for page, mutants in enumerate(pages):
+            first = page * self.page_size
+            last = min(first + self.page_size, len(lines))
+
+            html = PAGE_HEADER % {'title': escape(name)}
+            html += self.report_info(rep, verdicts)
+            html += self.page_links(name, len(lines), page)
+            html += '<h2>Lines %d-%d</h2>\n' % (first + 1, last)
+            html += '<pre class="sh_pascal">%s</pre>\n' % escape(
+                '\n'.join(lines[first:last]))
+
+            html += '<h2>Mutants</h2>\n'
+            for m in mutants:
+                html += self.render_mutant(source, m,
+                                          verdicts.get(str(m['id'])))
+
+            html += PAGE_FOOTER
+            self.write(page_name(name, page), html)
+
+        self.reports.append((name, rep, verdicts))
+
+    def report_info(self, rep, verdicts):
+        html = '<table>\n'
+        html += '<tr><td><span class="xx_label">Source file: </span></td>'
+        html += '<td>%s</td></tr>\n' % escape(rep.get('filename') or '')
+        html += '<tr><td><span class="xx_label">MD5: </span></td>'
+        html += '<td>%s</td></tr>\n' % escape(rep.get('md5') or '')
+
+        if rep.get('timestamp'):
+            date = time.strftime('%Y-%m-%d %H:%M:%S',
+                                 time.localtime(rep['timestamp']))
+            html += '<tr><td><span class="xx_label">Time stamp: </span></td>'
+            html += '<td>%s</td></tr>\n' % date
+
+        html += '<tr><td><span class="xx_label">Mutants: </span></td>'
+        html += '<td>%s</td></tr>\n' % self.summary(rep, verdicts)
+        html += '</table>\n'
+        return html
+
+    def summary(self, rep, verdicts):
+        s = '%d' % len(rep['mutants'])
+        if verdicts:
+            counts = dict()
+            for verdict in verdicts.values():
+                counts[verdict] = counts.get(verdict, 0) + 1
+
+            s += ' (%s)' % ', '.join(['%d %s' % (counts[v], v)
+                                      for v in sorted(counts)])
+        return s
+
+    def page_links(self, name, lines, current):
+        if lines <= self.page_size:
+            return ''
+
+        links = []
+        for page in range((lines - 1) // self.page_size + 1):
+            text = '%d-%d' % (page * self.page_size + 1,
+                              min((page + 1) * self.page_size, lines))
+            if page == current:
+                links.append('<b>%s</b>' % text)
+            else:
+                links.append('<a href="%s">%s</a>' %
+                             (escape(page_name(name, page)), text))
+
+        return '<p><span class="xx_label">Lines: </span>%s</p>\n' % \
+            ' | '.join(links)
+
+    def render_mutant(self, source, mutant, verdict):
+        hunk = report.hunk(source, mutant, self.context)
+
+        title = '#%s, lines %d-%d' % (hunk['id'], hunk['line'], hunk['last'])
+        if mutant.get('operator'):
+            title += ', %s' % mutant['operator']
+        if verdict:
+            title += ', %s' % verdict
+
+        html = '<div id="%s">\n' % escape(hunk['id'], True)
+        html += '<span class="xx_label">%s</span>\n' % escape(title)
+        html += '<pre class="sh_pascal">%s<a class="xx_mutation" ' \
+                'title="%s">%s</a>%s</pre>\n' % (escape(hunk['before']),
+                                                 escape(hunk['original'],
+                                                        True),
+                                                 escape(hunk['value']),
+                                                 escape(hunk['after']))
+        html += '</div>\n'
+        return html
+
+    def export_index(self):
+        html = PAGE_HEADER % {'title': 'Mutation reports'}
+        html += '<table>\n'
+
+        for name, rep, verdicts in self.reports:
+            html += '<tr><td><a href="%s">%s</a></td><td>%s</td>' \
+                    '<td>%s</td></tr>\n' % (escape(page_name(name, 0), True),
+                                            escape(name),
+                                            escape(rep.get('filename') or ''),
+                                            self.summary(rep, verdicts))
+
+        html += '</table>\n'
+        html += PAGE_FOOTER
+        self.write('index.html', html)
+
+
+def run():
+    try:
+        parser = ArgumentParser(description="Tools for mutation reports "
+                                "saved by llvm-p86")
+        commands = parser.add_subparsers(dest="command", metavar="command")
+
+        export = commands.add_parser("export", help="render the reports in a folder as a static web site")
+        export.add_argument(dest="data", metavar="PATH", help="folder holding the mutation reports and sources, e.g. wwwroot/data")
+        export.add_argument("-o", "--output", dest="output", metavar="PATH", action="store", required=True, help="folder to save the web site in")
+        export.add_argument("-r", "--root", dest="root", metavar="PATH", action="store", help="www root holding the scripts and style sheets of the viewer,\nby default the parent of the report folder")
+        export.add_argument("-n", "--page-size", dest="page_size", metavar="N", action="store", type=int, default=PAGE_SIZE, help="number of source lines on each page (default %d)" % PAGE_SIZE)
+        export.add_argument("-c", "--context", dest="context", metavar="N", action="store", type=int, default=report.HUNK_CONTEXT, help="lines of context around each mutant (default %d)" % report.HUNK_CONTEXT)
+        export.add_argument("-v", "--verbosity", dest="verbosity", action="count", default=0, help="set verbosity level")
+
+        args = parser.parse_args()
+        if args.command is None:
+            parser.print_help()
+            return 1
+
+        log.set_verbosity(args.verbosity + 1)
+
+        site = StaticSite(args.data, args.output, args.page_size,
+                          args.context)
+        site.export()
+
+        root = args.root
+        if root is None:
+            root = os.path.dirname(os.path.abspath(args.data))
+
+        site.copy_assets(root)
+        print("Exported %d reports to %s" % (len(site.reports), args.output))
+
+        return 0
+
+    except KeyboardInterrupt:
+        return 0
@@ -31,9 +31,19 @@ from llvm_cbuilder import CTemp
 from llvm_cbuilder import CVar
 
 
-mutant_t = Type.opaque('P86.mutant_t')
-mutant_t.set_body([Type.int(32), Type.pointer(Type.int(8)),
-                  Type.pointer(mutant_t)])
+# descriptor of a static mutant table, one per module:
+#   number of mutants, sorted mutant ids, module name, next descriptor,
+#   coverage flags and infection flags (one byte per mutant)
+mutant_table_t = Type.opaque('P86.mutant_table_t')
+mutant_table_t.set_body([Type.int(32), Type.pointer(Type.int(32)),
+                         Type.pointer(Type.int(8)),
+                         Type.pointer(mutant_table_t),
+                         Type.pointer(Type.int(8)),
+                         Type.pointer(Type.int(8))])
+
+# hook called when the state of a mutant diverges from the original program,
+# returns zero in a child process that continues executing as the mutant
+split_hook_t = Type.function(Type.int(32), [Type.int(32)])
 
 
 class New(CDefinition):
@@ -343,8 +353,10 @@ class ParamStr(CDefinition):
 
 class SetMutation(CDefinition):
     '''
-    Sets the active mutant by iterating the list of mutants until
-    the Nth (index) mutant is selected
+    Sets the active mutant by skipping whole mutant tables until the one
+    containing the Nth (index) mutant is found, and then indexing it. The
+    id of the mutant is reported like test cases, see _report_test(), so
+    that an executor can tell which mutant the Nth one is.
     '''
     _name_ = 'P86.setmutation'
     _argtys_ = [('index', Type.int(32))]
@@ -357,6 +369,7 @@ class SetMutation(CDefinition):
         id_var = mod.add_global_variable(Type.int(32), "P86.mutant_id")
         id_var.initializer = Constant.int(Type.int(32), 0)
         id_var.linkage = core.LINKAGE_EXTERNAL
+        id_var.visibility = core.VISIBILITY_HIDDEN
 
         # global place holder module name containing the currently
         # selected mutant
@@ -365,13 +378,15 @@ class SetMutation(CDefinition):
         str_var.initializer = Constant.null(Type.pointer(Type.int(8)))
         str_var.linkage = core.LINKAGE_EXTERNAL
 
-        # pointer to the tail of the mutant list (reverse order)
-        lst_var = mod.add_global_variable(Type.pointer(mutant_t),
-                                          "P86.mutant_list")
-        lst_var.initializer = Constant.null(Type.pointer(mutant_t))
+        # pointer to the head of the list of mutant tables
+        lst_var = mod.add_global_variable(Type.pointer(mutant_table_t),
+                                          "P86.mutant_tables")
+        lst_var.initializer = Constant.null(Type.pointer(mutant_table_t))
         lst_var.linkage = core.LINKAGE_EXTERNAL
 
-        ptr = self.var(Type.pointer(mutant_t), self.builder.load(lst_var))
+        lst_val = self.builder.load(lst_var)
+        ptr = self.var(Type.pointer(mutant_table_t), lst_val)
+        null = Constant.null(Type.pointer(mutant_table_t))
         zero = self.constant(Type.int(32), 0)
         one = self.constant(Type.int(32), 1)
 
@@ -382,26 +397,42 @@ class SetMutation(CDefinition):
                 self.builder.store(str_var.initializer, str_var)
                 self.ret()
 
-        # iterate the list until we get to the Nth element
+        # iterate the tables until we get to the one with the Nth element
         with self.loop() as loop:
             with loop.condition() as setcond:
-                setcond(index > one)
+                not_null = self.builder.icmp(core.ICMP_NE, ptr.value, null)
+                setcond(CTemp(self, not_null))
 
             with loop.body():
-                nxt = self.builder.gep(ptr.value, [c_int32(0), c_int32(2)])
-                ptr.assign(CVar(self, nxt))
-                index -= one
+                cnt = self.builder.gep(ptr.value, [c_int32(0), c_int32(0)])
+                cnt = CTemp(self, self.builder.load(cnt))
 
-        # assign mutant id
-        handle = self.builder.gep(ptr.value, [c_int32(0), c_int32(0)])
-        handle = self.builder.load(handle)
-        self.builder.store(handle, id_var)
+                with self.ifelse(index <= cnt) as ifelse:
+                    with ifelse.then():
+                        # assign mutant id
+                        ids = self.builder.gep(ptr.value,
+                                               [c_int32(0), c_int32(1)])
+                        ids = self.builder.load(ids)
+                        pos = (index - one).value
+                        handle = self.builder.gep(ids, [pos])
+                        handle = CTemp(self, self.builder.load(handle))
+                        self.builder.store(handle.value, id_var)
+                        _report_test(self, 'mutant', handle)
+
+                        # assign module name containing the mutant
+                        handle = self.builder.gep(ptr.value,
+                                                  [c_int32(0), c_int32(2)])
+                        handle = self.builder.load(handle)
+                        self.builder.store(handle, str_var)
+                        self.ret()
 
-        # assign module name containing the mutant
-        handle = self.builder.gep(ptr.value, [c_int32(0), c_int32(1)])
-        handle = self.builder.load(handle)
-        self.builder.store(handle, str_var)
+                index -= cnt
+                nxt = self.builder.gep(ptr.value, [c_int32(0), c_int32(3)])
+                ptr.assign(CVar(self, nxt))
 
+        # index out of range, disable all mutants
+        self.builder.store(id_var.initializer, id_var)
+        self.builder.store(str_var.initializer, str_var)
         self.ret()
 
 
@@ -457,108 +488,580 @@ class GetMutationCount(CDefinition):
 
 class SetMutationId(CDefinition):
     '''
-    Sets the active mutant by iterating the list of mutants until
-    it finds the requested id. If the id is not in the list, the
+    Sets the active mutant by a binary search for the requested id in
+    each of the (sorted) mutant tables. If the id is not found, the
     mutant will be set to zero (no mutant active).
     '''
     _name_ = 'P86.setmutationid'
     _argtys_ = [('idx', Type.int(32))]
 
     def body(self, idx):
+        mod = self.function.module
+        c_int32 = lambda val: Constant.int(Type.int(32), val)
 
-        get_id = self.get_function_named('P86.getmutationid')
-        get_cnt = self.get_function_named('P86.getmutationcount')
-        set_mut = self.get_function_named('P86.setmutation')
+        id_var = mod.get_global_variable_named("P86.mutant_id")
+        str_var = mod.get_global_variable_named("P86.mutant_mod")
+        lst_var = mod.get_global_variable_named("P86.mutant_tables")
 
-        index = self.var(Type.int(32), 0)
-        one = self.constant(Type.int(32), 1)
+        lst_val = self.builder.load(lst_var)
+        ptr = self.var(Type.pointer(mutant_table_t), lst_val)
+        null = Constant.null(Type.pointer(mutant_table_t))
+        lo = self.var(Type.int(32), 0)
+        hi = self.var(Type.int(32), 0)
         zero = self.constant(Type.int(32), 0)
-        cnt = get_cnt()
+        one = self.constant(Type.int(32), 1)
 
         with self.loop() as loop:
             with loop.condition() as setcond:
-                setcond(index <= cnt)
+                not_null = self.builder.icmp(core.ICMP_NE, ptr.value, null)
+                setcond(CTemp(self, not_null))
 
             with loop.body():
-                set_mut(index)
-                with self.ifelse(get_id() == idx) as ifelse:
+                cnt = self.builder.gep(ptr.value, [c_int32(0), c_int32(0)])
+                cnt = CTemp(self, self.builder.load(cnt))
+
+                ids = self.builder.gep(ptr.value, [c_int32(0), c_int32(1)])
+                ids = self.builder.load(ids)
+
+                lo.assign(zero)
+                hi.assign(cnt)
+
+                # find the lower bound of idx
+                with self.loop() as search:
+                    with search.condition() as setcond:
+                        setcond(lo < hi)
+
+                    with search.body():
+                        mid = self.builder.add(lo.value, hi.value)
+                        mid = self.builder.lshr(mid, c_int32(1))
+                        val = self.builder.load(self.builder.gep(ids, [mid]))
+                        less = self.builder.icmp(core.ICMP_SLT, val, idx.value)
+                        mid = CTemp(self, mid)
+
+                        with self.ifelse(CTemp(self, less)) as ifelse:
+                            with ifelse.then():
+                                lo.assign(mid + one)
+                            with ifelse.otherwise():
+                                hi.assign(mid)
+
+                with self.ifelse(lo < cnt) as ifelse:
                     with ifelse.then():
-                        set_mut(index)
-                        self.ret()
-                index += one
+                        val = self.builder.gep(ids, [lo.value])
+                        val = CTemp(self, self.builder.load(val))
+
+                        with self.ifelse(val == idx) as found:
+                            with found.then():
+                                self.builder.store(val.value, id_var)
+
+                                handle = self.builder.gep(ptr.value,
+                                                    [c_int32(0), c_int32(2)])
+                                handle = self.builder.load(handle)
+                                self.builder.store(handle, str_var)
+                                self.ret()
 
-        set_mut(zero)
+                nxt = self.builder.gep(ptr.value, [c_int32(0), c_int32(3)])
+                ptr.assign(CVar(self, nxt))
+
+        self.builder.store(id_var.initializer, id_var)
+        self.builder.store(str_var.initializer, str_var)
         self.ret()
 
 
-class CTor(CDefinition):
+class CheckMutationIds(CDefinition):
     '''
-    Creates a module constructor used for initializing mutants generated
-    in different modules.
+    Checks that none of the ids in a mutant table (tbl) is also defined by
+    one of the tables chained so far. Since there is only one global mutant
+    id, selecting a duplicated id would enable several mutants at once, so
+    the program is halted instead. Both tables are sorted, so they are
+    merged in a single pass.
+    '''
+    _name_ = 'P86.checkmutationids'
+    _argtys_ = [('tbl', Type.pointer(mutant_table_t))]
+
+    def body(self, tbl):
+        mod = self.function.module
+        c_int32 = lambda val: Constant.int(Type.int(32), val)
+
+        lst_var = mod.get_global_variable_named("P86.mutant_tables")
+
+        lst_val = self.builder.load(lst_var)
+        ptr = self.var(Type.pointer(mutant_table_t), lst_val)
+        null = Constant.null(Type.pointer(mutant_table_t))
+        i = self.var(Type.int(32), 0)
+        j = self.var(Type.int(32), 0)
+        zero = self.constant(Type.int(32), 0)
+        one = self.constant(Type.int(32), 1)
+
+        cnt = self.builder.gep(tbl.value, [c_int32(0), c_int32(0)])
+        cnt = CTemp(self, self.builder.load(cnt))
+        ids = self.builder.gep(tbl.value, [c_int32(0), c_int32(1)])
+        ids = self.builder.load(ids)
+
+        with self.loop() as loop:
+            with loop.condition() as setcond:
+                not_null = self.builder.icmp(core.ICMP_NE, ptr.value, null)
+                setcond(CTemp(self, not_null))
+
+            with loop.body():
+                other_cnt = self.builder.gep(ptr.value,
+                                             [c_int32(0), c_int32(0)])
+                other_cnt = CTemp(self, self.builder.load(other_cnt))
+                other_ids = self.builder.gep(ptr.value,
+                                             [c_int32(0), c_int32(1)])
+                other_ids = self.builder.load(other_ids)
+
+                i.assign(zero)
+                j.assign(zero)
+
+                with self.loop() as merge:
+                    with merge.condition() as setcond:
+                        cond = self.builder.and_((i < cnt).value,
+                                                 (j < other_cnt).value)
+                        setcond(CTemp(self, cond))
+
+                    with merge.body():
+                        a = self.builder.gep(ids, [i.value])
+                        a = CTemp(self, self.builder.load(a))
+                        b = self.builder.gep(other_ids, [j.value])
+                        b = CTemp(self, self.builder.load(b))
+
+                        with self.ifelse(a == b) as ifelse:
+                            with ifelse.then():
+                                name = self.builder.gep(tbl.value,
+                                                    [c_int32(0), c_int32(2)])
+                                name = self.builder.load(name)
+                                other = self.builder.gep(ptr.value,
+                                                    [c_int32(0), c_int32(2)])
+                                other = self.builder.load(other)
+                                fmt = _string_constant(self,
+                                    "P86.str.mutant_clash",
+                                    "P86: mutant id %d is defined in both "
+                                    "%s and %s\n")
+                                self.builder.call(f_dprintf(mod),
+                                                  [c_int32(2), fmt, a.value,
+                                                   name, other])
+                                self.builder.call(f_exit(mod), [c_int32(1)])
+
+                        less = self.builder.icmp(core.ICMP_SLT, a.value,
+                                                 b.value)
+                        with self.ifelse(CTemp(self, less)) as ifelse:
+                            with ifelse.then():
+                                i.assign(i + one)
+                            with ifelse.otherwise():
+                                j.assign(j + one)
+
+                nxt = self.builder.gep(ptr.value, [c_int32(0), c_int32(3)])
+                ptr.assign(CVar(self, nxt))
+
+        self.ret()
+
 
-    The compiler might generate mutants in different modules. To gain access
-    to all mutants between modules, each list needs to be merged after linking.
-    This is done using magic provided by llvm.global_ctors (appending linkage).
-    Each module provides its own implementation of a CTor, that are executed
-    before the main function is called.
+class GetMutationFlag(CDefinition):
     '''
-    def __init__(self, name, mutants):
-        CTor._name_ = 'P86.ctor.%s' % name
-        self.mutants = mutants
+    Returns one of the per mutant flags of the Nth (index) mutant, stored
+    in the table descriptor field given by _field_.
+    '''
+    _retty_ = Type.int(32)
+    _argtys_ = [('index', Type.int(32))]
+    _field_ = None
+
+    def body(self, index):
+        mod = self.function.module
+        c_int32 = lambda val: Constant.int(Type.int(32), val)
+
+        lst_var = mod.get_global_variable_named("P86.mutant_tables")
+        lst_val = self.builder.load(lst_var)
+        ptr = self.var(Type.pointer(mutant_table_t), lst_val)
+        null = Constant.null(Type.pointer(mutant_table_t))
+        one = self.constant(Type.int(32), 1)
+
+        with self.loop() as loop:
+            with loop.condition() as setcond:
+                not_null = self.builder.icmp(core.ICMP_NE, ptr.value, null)
+                setcond(CTemp(self, not_null))
+
+            with loop.body():
+                cnt = self.builder.gep(ptr.value, [c_int32(0), c_int32(0)])
+                cnt = CTemp(self, self.builder.load(cnt))
+
+                with self.ifelse(index <= cnt) as ifelse:
+                    with ifelse.then():
+                        flags = self.builder.gep(ptr.value,
+                                    [c_int32(0), c_int32(self._field_)])
+                        flags = self.builder.load(flags)
+                        pos = (index - one).value
+                        handle = self.builder.gep(flags, [pos])
+                        handle = self.builder.load(handle)
+                        self.ret(CTemp(self, handle).cast(Type.int(32)))
+
+                index -= cnt
+                nxt = self.builder.gep(ptr.value, [c_int32(0), c_int32(3)])
+                ptr.assign(CVar(self, nxt))
+
+        self.ret(self.constant(Type.int(32), 0))
+
+
+class GetMutationCovered(GetMutationFlag):
+    '''
+    Tells whether the guard of the Nth (index) mutant has been evaluated,
+    i.e. if the mutated code has been reached.
+    '''
+    _name_ = 'P86.getmutationcovered'
+    _field_ = 4
+
+
+class GetMutationInfected(GetMutationFlag):
+    '''
+    Returns the infection flags of the Nth (index) mutant under weak
+    mutation, i.e. whether its mutated expression has evaluated to a
+    different value than the original one (constants.INFECTED_FLAG), or
+    whether it was reached without anything to compare (REACHED_FLAG).
+    '''
+    _name_ = 'P86.getmutationinfected'
+    _field_ = 5
+
+
+class SetLoopBudget(CDefinition):
+    '''
+    Sets the number of loop iterations the program may execute before
+    it is halted. Used to detect mutants that never terminate.
+    '''
+    _name_ = 'P86.setloopbudget'
+    _argtys_ = [('budget', Type.int(64))]
+
+    def body(self, budget):
+        mod = self.function.module
+
+        # global counter of executed loop iterations
+        cnt_var = mod.add_global_variable(Type.int(64), "P86.loop_count")
+        cnt_var.initializer = Constant.int(Type.int(64), 0)
+        cnt_var.linkage = core.LINKAGE_EXTERNAL
+
+        # maximum number of loop iterations (unsigned), unlimited by default
+        bgt_var = mod.add_global_variable(Type.int(64), "P86.loop_budget")
+        bgt_var.initializer = Constant.int(Type.int(64), -1)
+        bgt_var.linkage = core.LINKAGE_EXTERNAL
+
+        self.builder.store(budget.value, bgt_var)
+        self.ret()
+
+
+class GetLoopCount(CDefinition):
+    '''
+    Convenient function to expose the number of loop iterations executed
+    '''
+    _name_ = 'P86.getloopcount'
+    _retty_ = Type.int(64)
 
     def body(self):
         mod = self.function.module
 
-        c_int32 = lambda val: Constant.int(Type.int(32), val)
+        var = mod.get_global_variable_named("P86.loop_count")
+
+        value = self.builder.load(var)
+        self.ret(CTemp(self, value))
+
+
+def _string_constant(cdef, name, text):
+    '''
+    Returns a pointer to a read-only, null terminated string in the module
+    of the CDefinition cdef.
+    '''
+    mod = cdef.function.module
+    try:
+        var = mod.get_global_variable_named(name)
+    except:
+        value = Constant.stringz(text)
+        var = mod.add_global_variable(value.type, name)
+        var.initializer = value
+        var.global_constant = True
+        var.linkage = core.LINKAGE_INTERNAL
+
+    zero = Constant.int(Type.int(32), 0)
+    return cdef.builder.gep(var, [zero, zero])
+
+
+def _report_test(cdef, event, num):
+    '''
+    Writes a line with event and the number num, i.e. a test number or a
+    mutant id, to the file descriptor given by the environment variable
+    P86_TEST_FD, if any.
+    '''
+    mod = cdef.function.module
+    null = Constant.null(Type.pointer(Type.int(8)))
+
+    name = _string_constant(cdef, "P86.str.test_fd", "P86_TEST_FD")
+    env = cdef.builder.call(f_getenv(mod), [name])
+    not_null = cdef.builder.icmp(core.ICMP_NE, env, null)
+
+    with cdef.ifelse(CTemp(cdef, not_null)) as ifelse:
+        with ifelse.then():
+            fd = cdef.builder.call(f_atoi(mod), [env])
+            fmt = _string_constant(cdef, "P86.str.test_%s" % event,
+                                   "%s %%d\n" % event)
+            cdef.builder.call(f_dprintf(mod), [fd, fmt, num.value])
+
+
+class BeginTest(CDefinition):
+    '''
+    Marks the beginning of the Nth test case of a test driver, so that a
+    mutant terminating abnormally can be attributed to the test case.
+    '''
+    _name_ = 'P86.begintest'
+    _argtys_ = [('num', Type.int(32))]
+
+    def body(self, num):
+        _report_test(self, 'begin', num)
+        self.ret()
+
+
+class FailTest(CDefinition):
+    '''
+    Marks the Nth test case of a test driver as failed. The program is
+    halted if the environment variable P86_TEST_STOP is set, i.e. when
+    only the first failing test case is of interest.
+    '''
+    _name_ = 'P86.failtest'
+    _argtys_ = [('num', Type.int(32))]
+
+    def body(self, num):
+        mod = self.function.module
+        null = Constant.null(Type.pointer(Type.int(8)))
+
+        _report_test(self, 'fail', num)
+
+        name = _string_constant(self, "P86.str.test_stop", "P86_TEST_STOP")
+        env = self.builder.call(f_getenv(mod), [name])
+        not_null = self.builder.icmp(core.ICMP_NE, env, null)
+
+        with self.ifelse(CTemp(self, not_null)) as ifelse:
+            with ifelse.then():
+                code = Constant.int(Type.int(32), 1)
+                self.builder.call(f_exit(mod), [code])
+
+        self.ret()
+
+
+class GetTestOrder(CDefinition):
+    '''
+    Returns the number of the test case to execute at position i, as given
+    by the comma separated list in the environment variable P86_TEST_ORDER.
+    Test cases are executed in their natural order (i) by default. The
+    executor always passes a permutation of all test cases, since positions
+    past the end of the list fall back to i as well.
+    '''
+    _name_ = 'P86.gettestorder'
+    _retty_ = Type.int(32)
+    _argtys_ = [('i', Type.int(32))]
+
+    def body(self, i):
+        mod = self.function.module
+        c_int8 = lambda val: Constant.int(Type.int(8), val)
+        null = Constant.null(Type.pointer(Type.int(8)))
+
+        name = _string_constant(self, "P86.str.test_order", "P86_TEST_ORDER")
+        env = self.builder.call(f_getenv(mod), [name])
+        is_null = self.builder.icmp(core.ICMP_EQ, env, null)
+
+        with self.ifelse(CTemp(self, is_null)) as ifelse:
+            with ifelse.then():
+                self.ret(i)
+
+        ptr = self.var(Type.pointer(Type.int(8)), env)
+        k = self.var(Type.int(32), 1)
+        one = self.constant(Type.int(32), 1)
+        c_one = Constant.int(Type.int(32), 1)
+
+        # skip the first i - 1 entries of the list
+        with self.loop() as loop:
+            with loop.condition() as setcond:
+                char = self.builder.load(ptr.value)
+                more = self.builder.icmp(core.ICMP_NE, char, c_int8(0))
+                less = self.builder.icmp(core.ICMP_SLT, k.value, i.value)
+                setcond(CTemp(self, self.builder.and_(more, less)))
+
+            with loop.body():
+                char = self.builder.load(ptr.value)
+                comma = self.builder.icmp(core.ICMP_EQ, char, c_int8(ord(',')))
+                with self.ifelse(CTemp(self, comma)) as ifelse:
+                    with ifelse.then():
+                        k.assign(k + one)
+
+                nxt = self.builder.gep(ptr.value, [c_one])
+                ptr.assign(CTemp(self, nxt))
+
+        # the list holds fewer than i entries
+        with self.ifelse(k < i) as ifelse:
+            with ifelse.then():
+                self.ret(i)
+
+        value = self.builder.call(f_atoi(mod), [ptr.value])
+        self.ret(CTemp(self, value))
+
+
+class SetSplitHook(CDefinition):
+    '''
+    Installs the hook called by P86.splitmutation(), enabling split-stream
+    execution of the mutants.
+    '''
+    _name_ = 'P86.setsplithook'
+    _argtys_ = [('hook', Type.pointer(split_hook_t))]
+
+    def body(self, hook):
+        mod = self.function.module
+
+        # no hook installed by default, i.e. split-stream execution disabled
+        var = mod.add_global_variable(Type.pointer(split_hook_t),
+                                      "P86.split_hook")
+        var.initializer = Constant.null(Type.pointer(split_hook_t))
+        var.linkage = core.LINKAGE_EXTERNAL
+
+        self.builder.store(hook.value, var)
+        self.ret()
+
+
+class SplitMutation(CDefinition):
+    '''
+    Called by the original program when the state of a mutant first
+    diverges from it. The split hook forks the process, and the child
+    continues executing with the mutant selected. Does nothing unless
+    a hook has been installed.
+    '''
+    _name_ = 'P86.splitmutation'
+    _argtys_ = [('idx', Type.int(32))]
+
+    def body(self, idx):
+        mod = self.function.module
 
-        for id_val in self.mutants:
-            # allocate memory for mutant info
-            handle = self.builder.malloc(mutant_t)
+        var = mod.get_global_variable_named("P86.split_hook")
+        hook = self.builder.load(var)
+        null = Constant.null(Type.pointer(split_hook_t))
+        not_null = self.builder.icmp(core.ICMP_NE, hook, null)
+        zero = self.constant(Type.int(32), 0)
 
-            # set mutant id
-            id_val = Constant.int(mutant_t.elements[0], id_val)
-            id_var = self.builder.gep(handle, [c_int32(0), c_int32(0)])
-            self.builder.store(id_val, id_var)
+        with self.ifelse(CTemp(self, not_null)) as ifelse:
+            with ifelse.then():
+                pid = CTemp(self, self.builder.call(hook, [idx.value]))
 
-            # set the module id
-            str_val = self.constant_string(mod.id).value
-            str_var = self.builder.gep(handle, [c_int32(0), c_int32(1)])
-            self.builder.store(str_val, str_var)
+                with self.ifelse(pid == zero) as child:
+                    with child.then():
+                        func = mod.get_function_named('P86.setmutationid')
+                        self.builder.call(func, [idx.value])
 
-            # set the pointer to the next mutant info
-            ptr_var = self.builder.gep(handle, [c_int32(0), c_int32(2)])
+        self.ret()
 
-            try:
-                lst_var = mod.get_global_variable_named("P86.mutant_list")
-            except:
-                lst_var = mod.add_global_variable(Type.pointer(mutant_t),
-                                                  "P86.mutant_list")
-                lst_var.linkage = core.LINKAGE_EXTERNAL
 
-            lst_val = self.builder.load(lst_var)
-            self.builder.store(lst_val, ptr_var)
-            self.builder.store(handle, lst_var)
+class CTor(CDefinition):
+    '''
+    Creates a module constructor used for registering mutants generated
+    in different modules.
+
+    The compiler might generate mutants in different modules. Each module
+    emits a static, read-only table with the ids of its mutants (sorted),
+    together with a descriptor of that table. To gain access to all mutants
+    between modules, the descriptors are chained together after linking.
+    This is done using magic provided by llvm.global_ctors (appending
+    linkage). Each module provides its own implementation of a CTor, that
+    are executed before the main function is called. No memory is allocated.
+    Before a table is chained, its ids are checked against the tables
+    chained so far, so that mutant ids are unique within the linked program.
+    '''
+    def __init__(self, name, mutants):
+        CTor._name_ = 'P86.ctor.%s' % name
+        self.mutants = mutants
 
-            # increment the total number of mutants
-            try:
-                cnt_var = mod.get_global_variable_named("P86.mutant_count")
-            except:
-                cnt_var = mod.add_global_variable(Type.int(32),
-                                                  "P86.mutant_count")
-                cnt_var.linkage = core.LINKAGE_EXTERNAL
+    def body(self):
+        mod = self.function.module
 
-            one = Constant.int(Type.int(32), 1)
-            cnt_val = self.builder.load(cnt_var)
-            handle = self.builder.add(cnt_val, one)
+        c_int32 = lambda val: Constant.int(Type.int(32), val)
 
-            self.builder.store(handle, cnt_var)
+        if not self.mutants:
+            self.ret()
+            return
+
+        # read-only table with sorted mutant ids
+        ids = sorted(set(self.mutants))
+        ids_val = [c_int32(id_val) for id_val in ids]
+        ids_val = Constant.array(Type.int(32), ids_val)
+
+        ids_var = mod.add_global_variable(ids_val.type,
+                                          "P86.mutant_ids.%s" % mod.id)
+        ids_var.initializer = ids_val
+        ids_var.global_constant = True
+        ids_var.linkage = core.LINKAGE_INTERNAL
+
+        # module name
+        str_val = Constant.stringz(mod.id)
+        str_var = mod.add_global_variable(str_val.type,
+                                          "P86.mutant_name.%s" % mod.id)
+        str_var.initializer = str_val
+        str_var.global_constant = True
+        str_var.linkage = core.LINKAGE_INTERNAL
+
+        # coverage flags, set when the guard of a mutant is evaluated
+        cov_var = mutant_coverage_var(mod, len(ids))
+
+        # infection flags, set when a mutant alters the state (weak mutation)
+        inf_var = mutant_infected_var(mod, len(ids))
+
+        # table descriptor
+        tbl_var = mod.add_global_variable(mutant_table_t,
+                                          "P86.mutant_table.%s" % mod.id)
+        tbl_var.initializer = Constant.null(mutant_table_t)
+        tbl_var.linkage = core.LINKAGE_INTERNAL
+
+        handle = self.builder.gep(tbl_var, [c_int32(0), c_int32(0)])
+        self.builder.store(c_int32(len(ids)), handle)
+
+        value = self.builder.gep(ids_var, [c_int32(0), c_int32(0)])
+        handle = self.builder.gep(tbl_var, [c_int32(0), c_int32(1)])
+        self.builder.store(value, handle)
+
+        value = self.builder.gep(str_var, [c_int32(0), c_int32(0)])
+        handle = self.builder.gep(tbl_var, [c_int32(0), c_int32(2)])
+        self.builder.store(value, handle)
+
+        value = self.builder.gep(cov_var, [c_int32(0), c_int32(0)])
+        handle = self.builder.gep(tbl_var, [c_int32(0), c_int32(4)])
+        self.builder.store(value, handle)
+
+        value = self.builder.gep(inf_var, [c_int32(0), c_int32(0)])
+        handle = self.builder.gep(tbl_var, [c_int32(0), c_int32(5)])
+        self.builder.store(value, handle)
+
+        # push the descriptor onto the list of tables
+        try:
+            lst_var = mod.get_global_variable_named("P86.mutant_tables")
+        except:
+            lst_var = mod.add_global_variable(Type.pointer(mutant_table_t),
+                                              "P86.mutant_tables")
+            lst_var.linkage = core.LINKAGE_EXTERNAL
+
+        self.builder.call(f_check_mutation_ids(mod), [tbl_var])
+
+        lst_val = self.builder.load(lst_var)
+        handle = self.builder.gep(tbl_var, [c_int32(0), c_int32(3)])
+        self.builder.store(lst_val, handle)
+        self.builder.store(tbl_var, lst_var)
+
+        # increment the total number of mutants
+        try:
+            cnt_var = mod.get_global_variable_named("P86.mutant_count")
+        except:
+            cnt_var = mod.add_global_variable(Type.int(32),
+                                              "P86.mutant_count")
+            cnt_var.linkage = core.LINKAGE_EXTERNAL
+
+        cnt_val = self.builder.load(cnt_var)
+        handle = self.builder.add(cnt_val, c_int32(len(ids)))
+        self.builder.store(handle, cnt_var)
 
         self.ret()
 
 
 def _declare_builtin(mod, cls):
     assert isinstance(cls, type)
-    assert CDefinition in cls.__bases__
+    assert issubclass(cls, CDefinition)
 
     ret = cls._retty_
     args = [x[1] for x in cls._argtys_]
@@ -664,6 +1167,14 @@ def f_set_mutation_id(mod):
     return _declare_builtin(mod, SetMutationId)
 
 
+def f_check_mutation_ids(mod):
+    '''
+    built-in: halts the program if a mutant table defines an id that
+    is already defined by another module
+    '''
+    return _declare_builtin(mod, CheckMutationIds)
+
+
 def f_get_mutation_mod(mod):
     '''
     built-in: returns a pointer to the module name
@@ -679,6 +1190,151 @@ def f_get_mutation_count(mod):
     return _declare_builtin(mod, GetMutationCount)
 
 
+def f_set_loop_budget(mod):
+    '''
+    built-in: sets the number of loop iterations allowed
+    '''
+    return _declare_builtin(mod, SetLoopBudget)
+
+
+def f_get_loop_count(mod):
+    '''
+    built-in: returns the number of loop iterations executed
+    '''
+    return _declare_builtin(mod, GetLoopCount)
+
+
+def f_get_mutation_covered(mod):
+    '''
+    built-in: tells whether the Nth mutant has been reached
+    '''
+    return _declare_builtin(mod, GetMutationCovered)
+
+
+def f_begin_test(mod):
+    '''
+    built-in: marks the beginning of a test case
+    '''
+    return _declare_builtin(mod, BeginTest)
+
+
+def f_fail_test(mod):
+    '''
+    built-in: marks a test case as failed
+    '''
+    return _declare_builtin(mod, FailTest)
+
+
+def f_get_test_order(mod):
+    '''
+    built-in: returns the test case to execute at a given position
+    '''
+    return _declare_builtin(mod, GetTestOrder)
+
+
+def f_get_mutation_infected(mod):
+    '''
+    built-in: tells whether the Nth mutant has infected the program state
+    '''
+    return _declare_builtin(mod, GetMutationInfected)
+
+
+def f_set_split_hook(mod):
+    '''
+    built-in: installs the hook used for split-stream execution
+    '''
+    return _declare_builtin(mod, SetSplitHook)
+
+
+def f_split_mutation(mod):
+    '''
+    built-in: forks a child executing the given mutant
+    '''
+    return _declare_builtin(mod, SplitMutation)
+
+
+def mutant_coverage_var(mod, count=None):
+    '''
+    Returns the coverage flags of the mutants defined in mod, with one
+    byte per mutant in the same order as the mutant table.
+    '''
+    name = "P86.mutant_cov.%s" % mod.id
+    try:
+        return mod.get_global_variable_named(name)
+    except:
+        type_ = Type.array(Type.int(8), count)
+        var = mod.add_global_variable(type_, name)
+        var.initializer = Constant.null(type_)
+        var.linkage = core.LINKAGE_INTERNAL
+        return var
+
+
+def mutant_infected_var(mod, count=None):
+    '''
+    Returns the infection flags of the mutants defined in mod, with one
+    byte per mutant in the same order as the mutant table.
+    '''
+    name = "P86.mutant_inf.%s" % mod.id
+    try:
+        return mod.get_global_variable_named(name)
+    except:
+        type_ = Type.array(Type.int(8), count)
+        var = mod.add_global_variable(type_, name)
+        var.initializer = Constant.null(type_)
+        var.linkage = core.LINKAGE_INTERNAL
+        return var
+
+
+def mutant_split_var(mod, count=None):
+    '''
+    Returns the split flags of the mutants defined in mod, set once a
+    child has been forked for the mutant during split-stream execution.
+    One byte per mutant in the same order as the mutant table.
+    '''
+    name = "P86.mutant_split.%s" % mod.id
+    try:
+        return mod.get_global_variable_named(name)
+    except:
+        type_ = Type.array(Type.int(8), count)
+        var = mod.add_global_variable(type_, name)
+        var.initializer = Constant.null(type_)
+        var.linkage = core.LINKAGE_INTERNAL
+        return var
+
+
+def mutant_id_var(mod):
+    '''
+    Returns the global holding the id of the currently selected mutant,
+    declared as external when defined by another module. The variable
+    is hidden so that it can be accessed without indirection.
+    '''
+    try:
+        return mod.get_global_variable_named("P86.mutant_id")
+    except:
+        var = mod.add_global_variable(Type.int(32), "P86.mutant_id")
+        var.linkage = core.LINKAGE_EXTERNAL
+        var.visibility = core.VISIBILITY_HIDDEN
+        return var
+
+
+def loop_budget_vars(mod):
+    '''
+    Returns the global loop counter and loop budget, declared as
+    external when defined by another module.
+    '''
+    l = []
+    for name in ["P86.loop_count", "P86.loop_budget"]:
+        try:
+            var = mod.get_global_variable_named(name)
+        except:
+            var = mod.add_global_variable(Type.int(64), name)
+            var.linkage = core.LINKAGE_EXTERNAL
+
+        l.append(var)
+
+    return l
+
+
 def f_module_constructor(mod):
     '''
     built-in: initializes the mutation functions
@@ -912,6 +1568,24 @@ def f_exit(mod):
     return mod.get_or_insert_function(type_, "exit")
 
 
+def f_getenv(mod):
+    '''libc: get an environment variable'''
+    ret = Type.pointer(Type.int(8))
+    args = [Type.pointer(Type.int(8))]
+
+    type_ = Type.function(ret, args)
+    return mod.get_or_insert_function(type_, "getenv")
+
+
+def f_dprintf(mod):
+    '''libc: formatted output conversion to a file descriptor'''
+    ret = Type.int(32)
+    args = [Type.int(32), Type.pointer(Type.int(8))]
+
+    type_ = Type.function(ret, args, True)
+    return mod.get_or_insert_function(type_, "dprintf")
+
+
 def f_atoi(mod):
     '''libc: convert a string to an integer'''
     ret = Type.int(32)
@@ -987,6 +1661,16 @@ def define_mutation(ctx):
     _install_function(ctx, GetMutationCount()(ctx.module))
     _install_function(ctx, GetMutationMod()(ctx.module))
     _install_function(ctx, SetMutationId()(ctx.module))
+    CheckMutationIds()(ctx.module)
+    _install_function(ctx, GetMutationCovered()(ctx.module))
+    _install_function(ctx, GetMutationInfected()(ctx.module))
+    _install_function(ctx, BeginTest()(ctx.module))
+    _install_function(ctx, FailTest()(ctx.module))
+    _install_function(ctx, GetTestOrder()(ctx.module))
+    _install_function(ctx, SetSplitHook()(ctx.module))
+    _install_function(ctx, SplitMutation()(ctx.module))
+    _install_function(ctx, SetLoopBudget()(ctx.module))
+    _install_function(ctx, GetLoopCount()(ctx.module))
 
 
 def declare_mutation(ctx):
@@ -997,12 +1681,15 @@ def declare_mutation(ctx):
     _install_function(ctx, f_get_mutation_id(ctx.module))
     _install_function(ctx, f_get_mutation_mod(ctx.module))
     _install_function(ctx, f_get_mutation_count(ctx.module))
+    _install_function(ctx, f_begin_test(ctx.module))
+    _install_function(ctx, f_fail_test(ctx.module))
+    _install_function(ctx, f_get_test_order(ctx.module))
 
 
 def define_ctor(ctx, mutants):
     '''
-    sets up global ctor that will initialize a linked list
-    with mutant information
+    sets up global ctor that will register the static mutant table
+    of the module
     '''
     fn = CTor(ctx.module.id, mutants)(ctx.module)
 
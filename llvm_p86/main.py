@@ -25,8 +25,10 @@ import os
 
 from . import log
 from . import compiler
+from . import mutation
 
 from argparse import ArgumentParser
+from argparse import ArgumentTypeError
 from argparse import RawTextHelpFormatter
 
 __all__ = []
@@ -37,6 +39,27 @@ __updated__ = '2013-10-29'
 DEBUG = 0
 
 
+def mutation_operators(s):
+    mops = [mop.strip().lower() for mop in s.split(',')]
+    for mop in mops:
+        if mop not in mutation.OPERATORS:
+            raise ArgumentTypeError("invalid mutation operator '%s'" % mop)
+
+    return mops
+
+
+def timeout_factor(s):
+    try:
+        factor = int(s)
+    except ValueError:
+        raise ArgumentTypeError("invalid timeout factor '%s'" % s)
+
+    if factor < 1:
+        raise ArgumentTypeError("timeout factor must be at least 1")
+
+    return factor
+
+
 class CLIError(Exception):
     '''Generic exception to raise and log different fatal errors.'''
 
@@ -72,7 +95,8 @@ def run(argv=None):
   created by John Törnblom on %s.
 ''' % (program_shortdesc, str(__date__))
 
-    mutation_help = '''Mutate the code using on of the mutation operators.
+    mutation_help = '''Mutate the code using one or more of the mutation operators,
+separated by commas, e.g. ror,aor,cor,sdl.
     sc  - statement coverage
     dcc - decision/condition coverage
 
@@ -98,9 +122,27 @@ def run(argv=None):
         parser.add_argument("-D", "--define", dest="defs", metavar="DEF", action="append", help="define constants for the preprocessor")
         parser.add_argument("-I", "--include", dest="incs", metavar="PATH", action="append", help="define include directories for the preprocessor")
         parser.add_argument("-e", "--execute", dest="execute", action="store_true", help="execute the main function using the LLVM JIT compiler")
+        parser.add_argument("-x", "--run-mutants", dest="run_mutants", action="store_true", help="execute the main function once for each mutant using the LLVM JIT compiler,\nforking a child process for each mutant")
+        parser.add_argument("-j", "--jobs", dest="jobs", metavar="N", action="store", type=int, default=1, help="number of mutants to execute in parallel when running mutants")
+        parser.add_argument("-R", "--results", dest="results", metavar="PATH", action="store", help="stream the results of running mutants to PATH in json lines format,\ndefaults to the folder of the mutation report")
+        parser.add_argument("--timeout", dest="timeout", metavar="FACTOR", action="store", type=timeout_factor, help="count loop iterations and halt mutants executing FACTOR times more\niterations than the original program when running mutants")
+        parser.add_argument("--coverage", dest="coverage", action="store_true", help="flag mutants reached by the original program, and skip mutants never\nreached when running mutants")
+        parser.add_argument("-w", "--weak-mutation", dest="weak", action="store_true", help="execute the main function once using the LLVM JIT compiler, and record\nthe mutants whose mutated expression evaluates to a different value\nthan the original one (weak mutation)")
+        parser.add_argument("--tests", dest="tests", action="store_true", help="record the test cases killing each mutant when running mutants,\nreported by the program with begintest() and failtest()")
+        parser.add_argument("--prioritize", dest="history", metavar="PATH", action="store", help="execute the test cases that killed mutants in the results stored in\nPATH first when running mutants, halting each mutant at its first\nfailing test case")
+        parser.add_argument("--cache", dest="cache", metavar="PATH", action="store", help="reuse verdicts of mutants in functions unchanged since an earlier\nrun when running mutants, using the results store (sqlite) in PATH, e.g. the store of the\nreports in wwwroot/data/llvm-p86.sqlite")
+        parser.add_argument("--split-stream", dest="split_stream", action="store_true", help="execute the original program once when running mutants, and fork a\nchild for each mutant when its state first diverges from the original")
         parser.add_argument("-a", "--arguments", dest="args", metavar="ARGS", action="store", default='', help="optional string with arguments when executing the main function using the JIT compiler")
         parser.add_argument("-r", "--report", dest="report", metavar="PATH", action="store", help="collect information on mutations and store it as json formatted data in the folder PATH")
-        parser.add_argument("-m", "--mutation", dest="mutation", action="store", choices=['sc', 'dcc', 'ror', 'cor', 'aor', 'sdl'], help=mutation_help)
+        parser.add_argument("-m", "--mutation", dest="mutation", metavar="OPS", action="store", type=mutation_operators, help=mutation_help)
+        parser.add_argument("--sample", dest="sample", metavar="RATE|COUNT", action="store", type=float, help="only generate a random sample of the mutants, either a fraction\n(RATE below 1) or a fixed number of mutants (COUNT)")
+        parser.add_argument("--seed", dest="seed", metavar="N", action="store", type=int, default=0, help="seed used when sampling mutants")
+        parser.add_argument("--stratify", dest="stratify", action="store", choices=['operator', 'function', 'line'], help="draw the sample of mutants separately per operator, function or line")
+        parser.add_argument("--function", dest="functions", metavar="GLOB", action="append", help="only mutate functions and procedures with names matching GLOB")
+        parser.add_argument("--lines", dest="lines", metavar="RANGES", action="append", help="only mutate the given lines, e.g. 10-20,42")
+        parser.add_argument("--diff", dest="diff", metavar="PATH", action="store", help="only mutate lines changed according to the unified diff in PATH")
+        parser.add_argument("--tce", dest="tce", metavar="LEVEL", action="store", type=int, choices=[1, 2, 3], help="prune mutants that are equivalent to the original program, or to\nanother mutant, once optimized at LEVEL (trivial compiler equivalence)")
+        parser.add_argument("--sequential-ids", dest="sequential_ids", action="store_true", help="number mutants 1, 2, ... instead of hashing their position,\nonly one module with mutants can then be linked into a program")
         parser.add_argument("-v", "--verbosity", dest="verbosity", action="count", default=0)
         parser.add_argument('-V', '--version', action='version', version=program_version_message)
         parser.add_argument(dest="file", metavar="file")
@@ -123,13 +165,28 @@ def run(argv=None):
             for i in args.incs:
                 c.include(i)
 
+        if args.functions:
+            for f in args.functions:
+                c.restrict_function(f)
+
+        if args.lines:
+            for l in args.lines:
+                c.restrict_lines(l)
+
+        if args.diff:
+            c.restrict_diff(args.diff)
+
         c.analyze()
 
         if args.tree:
             c.print_tree()
 
         if args.mutation:
-            c.mutate(args.mutation, args.report)
+            c.mutate(args.mutation, args.report, args.sequential_ids,
+                     args.sample, args.seed, args.stratify)
+
+        if args.mutation and args.tce:
+            c.prune(args.tce)
 
         if args.tree and args.mutation:
             c.print_tree()
@@ -138,10 +195,12 @@ def run(argv=None):
             c.save_source_code(args.src_code)
 
         synthesize = (args.ir_code or args.bit_code or
-                      args.obj_code or args.execute)
+                      args.obj_code or args.execute or args.run_mutants or
+                      args.weak)
 
         if synthesize:
-            c.synthesize()
+            c.synthesize(args.timeout is not None, args.coverage or args.weak,
+                         args.split_stream and args.run_mutants, args.weak)
 
         if args.opt and synthesize:
             c.optimize(int(args.opt))
@@ -158,6 +217,16 @@ def run(argv=None):
         if args.execute:
             c.execute(args.args)
 
+        if args.weak:
+            # -R names the results of running mutants when both are given
+            path = None if args.run_mutants else args.results
+            c.run_weak_mutation(args.args, path)
+
+        if args.run_mutants:
+            c.run_mutants(args.args, args.jobs, args.results, args.timeout,
+                          args.coverage, args.split_stream, args.tests,
+                          args.history, args.cache)
+
         return 0
 
     except KeyboardInterrupt:
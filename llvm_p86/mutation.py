@@ -21,6 +21,7 @@ Mutation operators for Pascal-86.
 '''
 
 import copy
+from collections import OrderedDict
 
 from . import ast
 from . import symtab
@@ -33,6 +34,55 @@ class MutationVisitor(ast.NodeVisitor):
     def __init__(self, name, filename, md5):
         self.report = report.MutationReport(name, filename, md5)
 
+    def visit(self, node, arg=None):
+        '''
+        Code inserted by earlier mutation operators, i.e. conditions on the
+        mutant id and mutated copies of statements, is never mutated again.
+        Only the original code it guards or wraps is visited.
+        '''
+        if getattr(node, 'guarded', None):
+            return self.visit_guard(node, arg)
+
+        if hasattr(node, 'mutant') or getattr(node, 'mutant_wrapper', False):
+            return self.visit_generated(node, arg)
+
+        if isinstance(node, (ast.FunctionNode, ast.ProcedureNode)):
+            return self.visit_routine(node, arg)
+
+        return ast.NodeVisitor.visit(self, node, arg)
+
+    def visit_routine(self, node, arg=None):
+        '''
+        Keeps track of the function or procedure being mutated, so that
+        mutants can be attributed to it. Nested routines are qualified by
+        the routines they are nested within, e.g. Outer.Inner.
+        '''
+        outer = self.report.function
+        if node.header.identifier:
+            name = node.header.identifier.name
+            if outer:
+                name = '%s.%s' % (outer, name)
+
+            self.report.function = name
+
+        try:
+            return ast.NodeVisitor.visit(self, node, arg)
+        finally:
+            self.report.function = outer
+
+    def visit_guard(self, node, arg=None):
+        stmt = getattr(node, node.guarded)
+        if stmt:
+            setattr(node, node.guarded, stmt.accept(self, arg))
+
+        return node
+
+    def visit_generated(self, node, arg=None):
+        if hasattr(node, 'mutant'):
+            return node
+
+        return self.default_visit(node, arg)
+
     def default_visit(self, node, arg=None):
         if not node:
             return
@@ -44,9 +94,22 @@ class MutationVisitor(ast.NodeVisitor):
 
         return node
 
-    def make_mut_cmp(self, m_id, cmp_token):
+    @staticmethod
+    def original_stmt(stmt):
         '''
-        Creates a condition that tests the current mutant id against m_id.
+        Finds the original statement guarded by if-statements inserted by
+        earlier mutation operators, if any.
+        '''
+        while getattr(stmt, 'guarded', None):
+            stmt = getattr(stmt, stmt.guarded)
+
+        return stmt
+
+    def make_mut_id(self):
+        '''
+        Creates an expression that evaluates to the current mutant id.
+        The expression is tagged so that the code generator may load
+        the id directly, instead of calling getmutationid.
         '''
         id_mut = ast.IdentifierNode("getmutationid")
         acc_mut = ast.VarAccessNode(id_mut)
@@ -54,6 +117,15 @@ class MutationVisitor(ast.NodeVisitor):
 
         var_mut = ast.VarLoadNode(acc_mut)
         var_mut.type = symtab.SIntType(32)
+        var_mut.active_mutant = True
+
+        return var_mut
+
+    def make_mut_cmp(self, m_id, cmp_token):
+        '''
+        Creates a condition that tests the current mutant id against m_id.
+        '''
+        var_mut = self.make_mut_id()
 
         op_cmp = ast.OpNode(cmp_token)
         val_cm = ast.IntegerNode(m_id)
@@ -61,6 +133,7 @@ class MutationVisitor(ast.NodeVisitor):
 
         cond = ast.BinaryOpNode(op_cmp, var_mut, val_cm)
         cond.type = symtab.BoolType()
+        cond.mutant = m_id
 
         return cond
 
@@ -139,10 +212,7 @@ class MutationVisitor(ast.NodeVisitor):
         '''
         # create mutant
         m_id = self.report.add_mutant(node.op.position, sign)
-        if m_id is None:
-            log.w('mutation', 'a mutant located in at %s was ignored' %
-                              node.op.position)
-        else:
+        if m_id is not None:
             mut_cond = copy.deepcopy(node)
             mut_cond.op.name = sign
             mut_cond = self.make_mut_eq_cond(m_id, mut_cond)
@@ -168,24 +238,17 @@ class MutationVisitor(ast.NodeVisitor):
             if m_id op 1 then x := 5;
         '''
         if m_id is None:
-            log.w('mutation', 'a mutant located in at %s was ignored' %
-                              stmt.position)
             return stmt
 
         val_mut = ast.IntegerNode(m_id)
         val_mut.type = symtab.SIntType(32)
 
         op_neq = ast.OpNode(op)
-        id_mut = ast.IdentifierNode("getmutationid")
-
-        acc_mut = ast.VarAccessNode(id_mut)
-        acc_mut.type = symtab.SIntType(32)
-
-        var_mut = ast.VarLoadNode(acc_mut)
-        var_mut.type = symtab.SIntType(32)
+        var_mut = self.make_mut_id()
 
         cond_cm = ast.BinaryOpNode(op_neq, val_mut, var_mut)
         cond_cm.type = symtab.BoolType()
+        cond_cm.mutant = m_id
 
         return ast.IfNode(cond_cm, stmt)
 
@@ -202,6 +265,9 @@ class MutationVisitor(ast.NodeVisitor):
 
         mut = self.guard_stmt(m_id, stmt, '=')
         mut.branch_prediction = False
+        if mut is not stmt:
+            mut.guarded = 'iffalse'
+
         return mut
 
     def disable_stmt(self, m_id, stmt):
@@ -217,6 +283,9 @@ class MutationVisitor(ast.NodeVisitor):
 
         mut = self.guard_stmt(m_id, stmt, '<>')
         mut.branch_prediction = True
+        if mut is not stmt:
+            mut.guarded = 'iftrue'
+
         return mut
 
     def make_bomb_stmt(self, m_id):
@@ -272,7 +341,8 @@ class SdlMutationVisitor(MutationVisitor):
         for c in node.children:
             c = c.accept(self)
 
-            m_id = self.report.add_mutant(c.position, '(* NOP *)')
+            pos = self.original_stmt(c).position
+            m_id = self.report.add_mutant(pos, '(* NOP *)')
             stmt_guard = self.disable_stmt(m_id, c)
             children.append(stmt_guard)
 
@@ -300,7 +370,12 @@ class SCMutationVisitor(MutationVisitor):
         for c in node.children:
             c = c.accept(self)
 
-            m_id = self.report.add_mutant(c.position, 'halt')
+            pos = self.original_stmt(c).position
+            m_id = self.report.add_mutant(pos, 'halt')
+            if m_id is None:
+                children.append(c)
+                continue
+
             bomb = self.make_bomb_stmt(m_id)
             bomb.iffalse = c
             children.append(bomb)
@@ -331,22 +406,21 @@ class BoolMutationVisitor(MutationVisitor):
         if cond.type.value is not None:
             return cond
 
+        m_id = self.report.add_mutant(cond.position, 'false')
+        if m_id is None:
+            return cond
+
         s = "a function call at %s will be omitted, global state might be"\
         " affected"
         if isinstance(cond, ast.FunctionCallNode):
             log.w('mutation', s % cond.position)
 
-        m_id = self.report.add_mutant(cond.position, 'false')
-        if m_id is None:
-            log.w('mutation', 'a mutant located in at %s was ignored' %
-                              cond.position)
-            return cond
-
         false_cond = self.make_mut_neq(m_id)
 
         op_and = ast.OpNode("and")
         ret = ast.BinaryOpNode(op_and, false_cond, cond)
         ret.type = symtab.BoolType()
+        ret.mutant_wrapper = True
 
         return ret
 
@@ -370,34 +444,32 @@ class BoolMutationVisitor(MutationVisitor):
         if cond.type.value is not None:
             return cond
 
+        true_id = self.report.add_mutant(cond.position, 'true')
+        false_id = self.report.add_mutant(cond.position, 'false')
+        if true_id is None and false_id is None:
+            return cond
+
         s = "a function call at %s will be omitted, global state might be"\
         " affected"
         if isinstance(cond, ast.FunctionCallNode):
             log.w('mutation', s % cond.position)
 
-        m_id = self.report.add_mutant(cond.position, 'true')
-        if m_id is None:
-            log.w('mutation', 'a mutant located in at %s was ignored' %
-                              cond.position)
-            return cond
-
-        true_cond = self.make_mut_eq(m_id)
+        ret = cond
+        if true_id is not None:
+            true_cond = self.make_mut_eq(true_id)
 
-        m_id = self.report.add_mutant(cond.position, 'false')
-        if m_id is None:
-            log.w('mutation', 'a mutant located in at %s was ignored' %
-                              cond.position)
-            return cond
-
-        false_cond = self.make_mut_neq(m_id)
+            op_or = ast.OpNode("or")
+            ret = ast.BinaryOpNode(op_or, true_cond, ret)
+            ret.type = symtab.BoolType()
+            ret.mutant_wrapper = True
 
-        op_or = ast.OpNode("or")
-        true_cond = ast.BinaryOpNode(op_or, true_cond, cond)
-        true_cond.type = symtab.BoolType()
+        if false_id is not None:
+            false_cond = self.make_mut_neq(false_id)
 
-        op_and = ast.OpNode("and")
-        ret = ast.BinaryOpNode(op_and, true_cond, false_cond)
-        ret.type = symtab.BoolType()
+            op_and = ast.OpNode("and")
+            ret = ast.BinaryOpNode(op_and, ret, false_cond)
+            ret.type = symtab.BoolType()
+            ret.mutant_wrapper = True
 
         return ret
 
@@ -429,6 +501,9 @@ class DCCMutationVisitor(BoolMutationVisitor):
         node.case_constant_list = node.case_constant_list.accept(self)
 
         m_id = self.report.add_mutant(node.statement.position, 'halt')
+        if m_id is None:
+            node.statement = node.statement.accept(self)
+            return node
 
         bomb = self.make_bomb_stmt(m_id)
         bomb.iffalse = node.statement.accept(self)
@@ -467,7 +542,7 @@ class DCCMutationVisitor(BoolMutationVisitor):
         else:
             m_id = None
 
-        if m_id:
+        if m_id is not None:
             bomb = self.make_bomb_stmt(m_id)
             bomb.iffalse = node.otherwise
             node.otherwise = bomb
@@ -528,17 +603,46 @@ class DCCMutationVisitor(BoolMutationVisitor):
 
 class StatementMutationVisitor(MutationVisitor):
 
+    def __init__(self, name, filename, md5):
+        MutationVisitor.__init__(self, name, filename, md5)
+        self.indices = dict()
+
     def default_visit(self, node, arg):
         l = []
         for c in filter(None, node.children):
             child, muts = c.accept(self, arg)
-            if child != c:
+            # nodes within a statement may be shared with mutants
+            # of the statement, and are never modified in place
+            if child is not c and arg is not None:
+                node = node.clone_replace(c, child)
+
+            elif child is not c:
                 node.replace(c, child)
 
             l.extend(muts)
 
         return node, l
 
+    def visit_guard(self, node, arg):
+        stmt = getattr(node, node.guarded)
+        if not stmt:
+            return node, []
+
+        child, muts = stmt.accept(self, arg)
+        if child is not stmt and arg is not None:
+            node = node.clone_replace(stmt, child)
+
+        elif child is not stmt:
+            setattr(node, node.guarded, child)
+
+        return node, muts
+
+    def visit_generated(self, node, arg):
+        if hasattr(node, 'mutant'):
+            return node, []
+
+        return self.default_visit(node, arg)
+
     def visit_StatementListNode(self, node, arg):
         '''
         Generate mutants by guarding statements. Each statement will generate
@@ -549,45 +653,122 @@ class StatementMutationVisitor(MutationVisitor):
 
         l = []
         for c in filter(None, node.children):
+            # statements guarded by earlier mutation operators are mutated
+            # without their guards, which are then put back in place
+            guards = []
+            while getattr(c, 'guarded', None):
+                guards.append(c)
+                c = getattr(c, c.guarded)
+
             org, muts = c.accept(self, c)
+            self.indices.pop(id(c), None)
+            head = org
             prev = None
 
             for m in muts:
                 assert isinstance(m, ast.IfNode)
 
+                # lowered into a switch on the mutant id by the codegen
+                m.mutant_chain = True
+
                 if prev:
                     prev.iffalse = m
                 else:
-                    l.append(m)
+                    head = m
                 prev = m
 
             if prev:
                 prev.iffalse = org
-            else:
-                l.append(org)
+
+            for g in reversed(guards):
+                stmt = getattr(g, g.guarded)
+                if stmt is not head:
+                    g = g.clone_replace(stmt, head)
+                head = g
+
+            l.append(head)
+
+        if arg is not None:
+            node = node.clone()
 
         node._children = l
 
         return node, []
 
-    def find_node(self, org, mut):
-        if not org or not org.position or not mut.position:
-            return None
+    def get_index(self, root):
+        '''
+        Returns the node index of a statement, built the first time a
+        mutant of the statement is generated.
+        '''
+        index = self.indices.get(id(root))
+        if not index or index.root is not root:
+            index = ast.NodeIndex(root)
+            self.indices[id(root)] = index
 
-        if (org.position.lexpos    == mut.position.lexpos and
-            org.position.lexendpos == mut.position.lexendpos and
-            type(org)              == type(mut)):
-                return org
+        return index
 
-        for c in filter(None, org.children):
-            if not c.position:
-                continue
+    def clone_path(self, root, node, replacement=None):
+        '''
+        Copies the statement root along the path down to node, see
+        ast.Node.clone_path().
+        '''
+        return root.clone_path(node, replacement, self.get_index(root))
 
-            c = self.find_node(c, mut)
-            if not c:
-                continue
+    _PURE = (ast.BinaryOpNode, ast.UnaryOpNode, ast.OpNode, ast.ValueNode,
+             ast.TypeConvertNode, ast.VarLoadNode, ast.VarAccessNode,
+             ast.IdentifierNode, ast.IndexedVarNode, ast.IndexListNode,
+             ast.ExprListNode, ast.FieldAccessNode)
+
+    def is_pure(self, node):
+        '''
+        Tells whether an expression can be evaluated without side effects,
+        i.e. it contains no function calls. Calls to functions without
+        parameters look like variable accesses, and are marked as calls
+        by typesys.TypeSetVisitor.
+        '''
+        if not isinstance(node, self._PURE):
+            return False
+
+        if isinstance(node.type, symtab.FunctionType):
+            return False
+
+        if getattr(node, 'function_call', False):
+            return False
+
+        for c in filter(None, node.children):
+            if isinstance(c, ast.Node) and not self.is_pure(c):
+                return False
+
+        return True
 
-            return c
+    def diverge(self, guard, root, org, mut):
+        '''
+        Tags the guard of a mutant with the original expression org and
+        its mutated counterpart mut. During split-stream execution and weak
+        mutation, both are evaluated ahead of the statement root, and the
+        mutant is only forked, or flagged as infected, if their values
+        differ. Only done when that is safe, i.e.
+        the expression is evaluated once when the statement is entered,
+        nothing before it has side effects and the mutant does not
+        introduce a division.
+        '''
+        if isinstance(root, ast.IfNode):
+            parts = [root.expr]
+        elif isinstance(root, ast.AssignmentNode):
+            parts = [root.var_access, root.expr]
+        else:
+            return
+
+        path = self.get_index(root).path(org)
+        if not path or len(path) < 2 or path[1] is not root.expr:
+            return
+
+        if isinstance(mut, ast.BinaryOpNode) and \
+           mut.op.name in ['/', 'div', 'mod']:
+            return
+
+        if all(self.is_pure(p) for p in parts) and self.is_pure(mut):
+            guard.diverge = (org, mut)
 
 
 class AorMutationVisitor(StatementMutationVisitor):
@@ -640,12 +821,6 @@ class AorMutationVisitor(StatementMutationVisitor):
                     continue
 
                 elif op in ['left', 'right']:
-                    mut_root = copy.deepcopy(root)
-                    mut = self.find_node(mut_root, node)
-
-                    lval = self.get_value(node.left)
-                    rval = self.get_value(node.right)
-
                     if isinstance(node.type, symtab.SetType):
                         val = ast.SetEmptyNode()
                         ty = symtab.EmptySetType()
@@ -658,48 +833,59 @@ class AorMutationVisitor(StatementMutationVisitor):
                     else:
                         continue
 
-                    # Disable the left operator
+                    if op == 'right' and lval is 0:
+                        continue
+
+                    if op == 'left' and rval is 0:
+                        continue
+
                     if op == 'right':
-                        if lval is 0:
-                            continue
+                        pos = copy.deepcopy(node.position)
+                        pos.lexendpos = node.op.position.lexendpos
+                    else:
+                        pos = copy.deepcopy(node.op.position)
+                        pos.lexendpos = node.position.lexendpos
+
+                    m_id = self.report.add_mutant(pos, '(* NOP *)')
+                    if m_id is None:
+                        continue
+
+                    mut_root, mut = self.clone_path(root, node)
 
+                    # Disable the left operator
+                    if op == 'right':
                         mut.left = val
                         mut.left.type = ty
                         mut.left = ast.TypeConvertNode(mut.left)
                         mut.left.type = mut.right.type
 
-                        pos = copy.deepcopy(node.position)
-                        pos.lexendpos = node.op.position.lexendpos
-
                     # Disable the right operator
                     elif op == 'left':
-                        if rval is 0:
-                            continue
-
                         mut.right = val
                         mut.right.type = ty
                         mut.right = ast.TypeConvertNode(mut.right)
                         mut.right.type = mut.left.type
 
-                        pos = copy.deepcopy(node.op.position)
-                        pos.lexendpos = node.position.lexendpos
-
                     # change the operator to +
-                    mut = self.find_node(mut_root, node.op)
-                    mut.name = '+'
+                    mut.op = mut.op.clone()
+                    mut.op.name = '+'
 
-                    m_id = self.report.add_mutant(pos, '(* NOP *)')
                     stmt_guard = self.enable_stmt(m_id, mut_root)
+                    self.diverge(stmt_guard, root, node, mut)
 
                     l.append(stmt_guard)
 
                 else:
-                    mut_root = copy.deepcopy(root)
-                    mut = self.find_node(mut_root, node.op)
-                    mut.name = op.replace(' ', '')
+                    m_id = self.report.add_mutant(node.op.position, op)
+                    if m_id is None:
+                        continue
+
+                    mut_root, mut = self.clone_path(root, node)
+                    mut.op = mut.op.clone()
+                    mut.op.name = op.replace(' ', '')
 
-                    m_id = self.report.add_mutant(mut.position, op)
                     stmt_guard = self.enable_stmt(m_id, mut_root)
+                    self.diverge(stmt_guard, root, node, mut)
 
                     l.append(stmt_guard)
 
@@ -730,42 +916,43 @@ class CorMutationVisitor(StatementMutationVisitor):
             return node, l
 
         for op in self._MUTANT[node.op.name]:
-            mut_root = copy.deepcopy(root)
 
             # replace the expr with either true or false
             if op in ['true', 'false']:
-                mut = self.find_node(mut_root, node)
-
-                c = ast.IdentifierNode(op)
-                c = ast.VarAccessNode(c)
-                c.type = symtab.BoolType()
-                c = ast.VarLoadNode(c)
-                c.type = symtab.BoolType()
-
-                mut_root.replace(mut, c)
+                mut = node
 
             # replace the expr with either left or right,
             # by setting  left or right to either true or false
             elif op in ['left', 'right']:
-                mut = self.find_node(mut_root, getattr(node, op))
+                mut = getattr(node, op)
                 if node.op.name == 'and':
                     op = 'true'
                 else:
                     op = 'false'
+            else:
+                mut = node.op
 
+            m_id = self.report.add_mutant(mut.position, op)
+            if m_id is None:
+                continue
+
+            if mut is node.op:
+                org = node
+                mut_root, mut = self.clone_path(root, node)
+                mut.op = mut.op.clone()
+                mut.op.name = op
+            else:
                 c = ast.IdentifierNode(op)
                 c = ast.VarAccessNode(c)
                 c.type = symtab.BoolType()
                 c = ast.VarLoadNode(c)
                 c.type = symtab.BoolType()
 
-                mut_root.replace(mut, c)
-            else:
-                mut = self.find_node(mut_root, node.op)
-                mut.name = op
+                org = mut
+                mut_root, mut = self.clone_path(root, mut, c)
 
-            m_id = self.report.add_mutant(mut.position, op)
             stmt_guard = self.enable_stmt(m_id, mut_root)
+            self.diverge(stmt_guard, root, org, mut)
             l.append(stmt_guard)
 
         return node, l
@@ -845,25 +1032,41 @@ class RorMutationVisitor(StatementMutationVisitor):
             if self.detect_equivalent_mutant(node, op):
                 continue
 
-            # replace the expr with either true or false
-            mut_root = copy.deepcopy(root)
             if op in ['true', 'false']:
-                mut = self.find_node(mut_root, node)
+                pos = node.position
+            else:
+                pos = node.op.position
+
+            m_id = self.report.add_mutant(pos, op)
+            if m_id is None:
+                continue
 
+            # replace the expr with either true or false
+            if op in ['true', 'false']:
                 c = ast.IdentifierNode(op)
                 c = ast.VarAccessNode(c)
                 c.type = symtab.BoolType()
                 c = ast.VarLoadNode(c)
                 c.type = symtab.BoolType()
 
-                mut_root.replace(mut, c)
+                mut_root, mut = self.clone_path(root, node, c)
             else:
-                mut = self.find_node(mut_root, node.op)
-                mut.name = op
+                mut_root, mut = self.clone_path(root, node)
+                mut.op = mut.op.clone()
+                mut.op.name = op
 
-            m_id = self.report.add_mutant(mut.position, op)
             stmt_guard = self.enable_stmt(m_id, mut_root)
+            self.diverge(stmt_guard, root, node, mut)
 
             l.append(stmt_guard)
 
         return node, l
+
+
+OPERATORS = OrderedDict()
+OPERATORS['sc'] = SCMutationVisitor
+OPERATORS['dcc'] = DCCMutationVisitor
+OPERATORS['ror'] = RorMutationVisitor
+OPERATORS['cor'] = CorMutationVisitor
+OPERATORS['aor'] = AorMutationVisitor
+OPERATORS['sdl'] = SdlMutationVisitor
@@ -18,70 +18,432 @@
 
 '''
 Tools for generating mutation reports in json format.
+
+Reports are saved in json lines format, with a header record followed
+by one record per mutant. Reports saved as a single json document by
+earlier versions can still be loaded.
 '''
 
+import fnmatch
+import hashlib
 import json
+import re
 import time
 import os
+from collections import OrderedDict
 
 from . import log
 
 
-def c_mul32(a, b):
-    '''Simulate a 32bit multiplication in C (overflow)'''
-    return eval(hex((long(a) * b) & (2 ** 32 - 1))[:-1])
+REPORT_EXT = '.jsonl'
+LEGACY_REPORT_EXT = '.json'
+RESULTS_EXT = '.results.jsonl'
+WEAK_EXT = '.weak.jsonl'
+
+# number of lines of context around a mutant in a hunk
+HUNK_CONTEXT = 3
 
 
-def hash32(s):
+def hash64(s):
     '''
-    Hash a string into a 32bit integer.
-    The hash in not secure and may cause collisions
+    Hash a string into a 64bit integer, stable across runs and platforms.
+    '''
+    return int(hashlib.md5(s.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class IdAllocator(object):
+    '''
+    Allocates mutant ids. Each mutant is identified by a 64bit key, hashed
+    from the md5 of the source file, the position of the mutant and its
+    replacement. The runtime holds mutant ids in 32bit integers, so the
+    id of a mutant is its key folded into 31 bits. Colliding ids are
+    detected and rehashed. Ids colliding with those of another module can
+    not be seen at compile time, and halt the linked program at startup.
+
+    In sequential mode, mutants are numbered 1, 2, ... in the order they
+    are allocated. Such ids are compact, but every module starts at 1, so
+    sequential ids are only usable when mutating a single linked module.
     '''
-    if not s:
-        return 0  # empty
 
-    value = ord(s[0]) << 7
-    for char in s:
-        value = c_mul32(1000003, value) ^ ord(char)
-        value = value ^ len(s)
+    def __init__(self, md5_hash, sequential=False):
+        self.md5 = md5_hash
+        self.sequential = sequential
+        self.keys = dict()
+        self.ids = dict()
+
+    def key(self, pos, s):
+        return hash64('%s:%d:%d:%d:%s' % (self.md5, pos.lineno, pos.lexpos,
+                                          pos.lexendpos, s))
+
+    @staticmethod
+    def fold(key):
+        id_ = (key ^ (key >> 31) ^ (key >> 62)) & (2 ** 31 - 1)
+
+        # zero is reserved for the original program
+        return id_ or 1
+
+    def allocate(self, key):
+        '''
+        Returns the id of the mutant with the given key, allocating a new
+        id unless an identical mutant has been allocated already.
+        '''
+        if key in self.keys:
+            return self.keys[key]
+
+        if self.sequential:
+            id_ = len(self.ids) + 1
+        else:
+            id_ = self.fold(key)
+            salt = 0
+            while id_ in self.ids:
+                log.w("report", "mutant id %d is already taken, rehashing"
+                      % id_)
+                salt += 1
+                id_ = self.fold(hash64('%x:%d' % (key, salt)))
+
+        self.keys[key] = id_
+        self.ids[id_] = key
+
+        return id_
+
+
+class Sampler(object):
+    '''
+    Selects a random sample of mutants, either a fraction of them (size
+    below one) or a fixed number (size of one or more), optionally
+    stratified per operator, function or line. The size of the sample is
+    divided between strata in proportion to their size, so that small
+    strata are not rounded down to nothing one by one.
+
+    Mutants are first enumerated in a census, without being generated.
+    The sample is then drawn from each stratum by a priority hashed from
+    the seed and the mutant key, so a seed always selects the same
+    mutants.
+    '''
+
+    STRATA = ('operator', 'function', 'line')
+
+    def __init__(self, size, seed=0, stratify=None):
+        assert stratify is None or stratify in self.STRATA
+        self.size = size
+        self.seed = seed
+        self.stratify = stratify
+        self.population = OrderedDict()
+        self.selected = None
+
+    def priority(self, key):
+        return hash64('%d:%x' % (self.seed, key))
+
+    def select(self, key, stratum):
+        '''
+        Returns True if the mutant with the given key is in the sample.
+        During the census, mutants are only counted.
+        '''
+        if self.selected is None:
+            self.population.setdefault(stratum, OrderedDict())[key] = True
+            return False
+
+        return key in self.selected
+
+    def quotas(self):
+        total = self.count()
+        if not total:
+            return dict()
+
+        if self.size < 1:
+            size = int(round(total * self.size))
+        else:
+            size = min(int(self.size), total)
+
+        shares = dict([(stratum, float(len(keys)) * size / total)
+                       for stratum, keys in self.population.items()])
+        quotas = dict([(stratum, int(share))
+                       for stratum, share in shares.items()])
+
+        # hand out what is left by the largest remainders
+        left = size - sum(quotas.values())
+        order = sorted(shares, key=lambda st: quotas[st] - shares[st])
+        for stratum in order[:left]:
+            quotas[stratum] += 1
+
+        return quotas
+
+    def draw(self):
+        '''
+        Ends the census and draws the sample.
+        '''
+        self.selected = set()
+        quotas = self.quotas()
+
+        for stratum, keys in self.population.items():
+            keys = sorted(keys, key=self.priority)
+            self.selected.update(keys[:quotas[stratum]])
+
+        log.i("report", "Sampled %d out of %d mutants" %
+                        (len(self.selected), self.count()))
+
+    def count(self):
+        return sum([len(keys) for keys in self.population.values()])
+
+    def obj(self):
+        quotas = self.quotas()
+        strata = dict([(str(stratum), [quotas[stratum], len(keys)])
+                       for stratum, keys in self.population.items()])
+
+        return {'size': self.size,
+                'seed': self.seed,
+                'stratify': self.stratify,
+                'population': self.count(),
+                'strata': strata}
+
+
+class Region(object):
+    '''
+    Restricts mutation to a region of a source file, given by globs on
+    function and procedure names, and line ranges, e.g. the lines changed
+    according to a unified diff. When both are given, mutants must be
+    located within one of the functions, and within one of the ranges.
+    '''
+
+    def __init__(self):
+        self.functions = None
+        self.lines = None
+
+    def add_function(self, pattern):
+        self.functions = self.functions or []
+        self.functions.append(pattern.lower())
+
+    def add_lines(self, first, last=None):
+        self.lines = self.lines or []
+        self.lines.append((first, last or first))
+
+    def add_diff(self, f, filename):
+        '''
+        Adds the lines of filename that are added or modified according to
+        a unified diff read from the file f. Lines next to removed lines
+        are included as well.
+        '''
+        self.lines = self.lines or []
+        filename = os.path.normpath(filename)
+        selected = False
+        lineno = 0
+
+        # lines left of the current hunk in the old and the new file, so
+        # that content lines are never mistaken for file headers
+        old = new = 0
+
+        for line in f:
+            if old > 0 or new > 0:
+                if line.startswith('+'):
+                    new -= 1
+                    if selected:
+                        self.add_lines(lineno)
+                    lineno += 1
+
+                elif line.startswith('-'):
+                    old -= 1
+                    if selected:
+                        self.add_lines(max(lineno - 1, 1), lineno)
+
+                elif not line.startswith('\\'):
+                    old -= 1
+                    new -= 1
+                    lineno += 1
+
+            elif line.startswith('+++ '):
+                path = line[4:].split('\t')[0].strip()
+                if path[:2] in ('a/', 'b/'):
+                    path = path[2:]
+
+                path = os.path.normpath(path)
+                selected = (path != os.devnull and
+                            same_file(path, filename))
 
-    if value == -1:
-        value = -2
+            elif line.startswith('@@'):
+                m = re.match(r'@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@',
+                             line)
+                if m:
+                    old = int(m.group(1) or 1)
+                    lineno = int(m.group(2))
+                    new = int(m.group(3) or 1)
 
-    if value >= 2 ** 31:
-        value -= 2 ** 32
+    def contains(self, function, lineno, last=None):
+        '''
+        Tells whether a mutant in function, spanning the lines from lineno
+        to last, is located within the region.
+        '''
+        if self.functions is not None:
+            if not function:
+                return False
 
-    return value
+            # nested routines match by their qualified or plain name
+            name = function.lower()
+            names = (name, name.split('.')[-1])
+            if not any([fnmatch.fnmatchcase(n, p)
+                        for n in names for p in self.functions]):
+                return False
+
+        if self.lines is not None:
+            last = max(last or lineno, lineno)
+            if not any([lo <= last and lineno <= hi
+                        for lo, hi in self.lines]):
+                return False
+
+        return True
+
+    def obj(self):
+        return {'functions': self.functions,
+                'lines': self.lines}
+
+
+def same_file(a, b):
+    '''
+    Tells whether two paths name the same file, when one of them is
+    relative to some folder of the other, e.g. src/t.p and /home/src/t.p.
+    Paths are compared by whole components, so t.p never matches at.p.
+    '''
+    a = os.path.normpath(a).split(os.sep)
+    b = os.path.normpath(b).split(os.sep)
+    n = min(len(a), len(b))
+
+    return a[-n:] == b[-n:]
 
 
 def default_serializer(o):
     return o.obj()
 
 
+def report_name(filename):
+    '''
+    Returns the name of the module that a report file belongs to, or
+    None if filename is not a mutation report.
+    '''
+    if filename.endswith(RESULTS_EXT) or filename.endswith(WEAK_EXT):
+        return None
+
+    for ext in (REPORT_EXT, LEGACY_REPORT_EXT):
+        if filename.endswith(ext):
+            return filename[:-len(ext)]
+
+
+def hunk(source, mutant, context=HUNK_CONTEXT):
+    '''
+    Render a mutant as a hunk of source, i.e. the lines holding the
+    mutated span and context lines before and after it. The hunk is
+    returned as a dict holding the number of its first and last line, the
+    source before and after the mutated span, the original span and the
+    mutated value.
+    '''
+    start = mutant['start']
+    stop = mutant['stop']
+
+    lo = source.rfind('\n', 0, start) + 1
+    for _ in range(context):
+        if lo == 0:
+            break
+        lo = source.rfind('\n', 0, lo - 1) + 1
+
+    hi = source.find('\n', stop)
+    for _ in range(context):
+        if hi < 0:
+            break
+        hi = source.find('\n', hi + 1)
+
+    if hi < 0:
+        hi = max(len(source.rstrip('\n')), stop)
+
+    first = source.count('\n', 0, lo) + 1
+
+    return {'id': str(mutant['id']),
+            'line': first,
+            'last': first + source.count('\n', lo, hi),
+            'before': source[lo:start],
+            'original': source[start:stop],
+            'value': mutant['value'],
+            'after': source[stop:hi]}
+
+
+def load(path):
+    '''
+    Load a mutation report saved in either json lines format, or as a
+    single json document. The report is returned as a dict holding the
+    header fields, and a list of mutants.
+    '''
+    f = open(path, 'r')
+    try:
+        first = f.readline()
+        try:
+            obj = json.loads(first)
+        except ValueError:
+            obj = None
+
+        # a single json document, possibly spanning several lines
+        if obj is None or 'mutants' in obj:
+            f.seek(0)
+            return json.load(f)
+
+        obj['mutants'] = [json.loads(line) for line in f if line.strip()]
+        return obj
+
+    finally:
+        f.close()
+
+
 class MutationReport(object):
 
-    def __init__(self, name, filename, md5_hash):
+    def __init__(self, name, filename, md5_hash, sequential=False):
         self.name = name
         self.filename = filename
         self.md5 = md5_hash
         self.mutations = list()
-        self.mutants = list()
+        self.mutants = OrderedDict()
+        self.allocator = IdAllocator(md5_hash, sequential)
+        self.sampler = None
+        self.region = None
+        self.pruning = None
+        self.operator = None
+        self.function = None
+
+        # text of the source file, read when first needed by last_line()
+        self.source = None
+
+        # dependency hash and start of each function, see add_function()
+        self.functions = dict()
+
+    def add_function(self, name, hash_, start):
+        '''
+        Registers the dependency hash of a function, keyed by its qualified
+        name, and its position, used to recognize unchanged functions
+        between runs.
+        '''
+        self.functions[name] = {'hash': hash_, 'start': start}
 
     def add_mutant(self, pos, s):
+        '''
+        Registers a mutant and returns its id, or None if the mutant is
+        not to be generated, e.g. when located in an included file.
+        '''
         if pos.path[-1] != os.path.basename(self.filename):
+            if not self.sampler or self.sampler.selected is not None:
+                log.w('report', 'a mutant located in at %s was ignored' %
+                                pos)
             return None
 
-        id_ = str(self.md5)
-        id_ += str(pos.lineno)
-        id_ += str(pos.lexpos)
-        id_ += str(pos.lexendpos)
-        id_ += str(s)
-        id_ = hash32(id_)
-        id_ = int(id_)
+        if self.region and not self.region.contains(self.function,
+                                                    pos.lineno,
+                                                    self.last_line(pos)):
+            return None
+
+        key = self.allocator.key(pos, s)
+        if self.sampler and not self.sampler.select(key, self.stratum(pos)):
+            return None
 
-        if id_ not in self.ids():
+        id_ = self.allocator.allocate(key)
+
+        if id_ not in self.mutants:
             mutant = {
                       'id': str(id_),
+                      'key': '%016x' % key,
                       'file': pos.path[-1],
                       'line': pos.lineno,
                       'start': pos.lexpos,
@@ -89,37 +451,99 @@ class MutationReport(object):
                       'value': s
                       }
 
-            self.mutants.append(mutant)
+            if self.operator:
+                mutant['operator'] = self.operator
+
+            if self.function:
+                mutant['function'] = self.function
+
+            self.mutants[id_] = mutant
 
         return id_
 
+    def last_line(self, pos):
+        '''
+        Returns the line where the mutated span at pos ends, counted in the
+        source file of the report, or the line it starts at if the source
+        is unavailable.
+        '''
+        if self.source is None:
+            try:
+                f = open(self.filename, 'r')
+                try:
+                    self.source = f.read()
+                finally:
+                    f.close()
+            except (IOError, OSError):
+                self.source = ''
+
+        return pos.lineno + self.source.count('\n', pos.lexpos,
+                                              pos.lexendpos)
+
+    def set_equivalent(self, id_):
+        self.mutants[id_]['equivalent'] = True
+
+    def set_duplicate(self, id_, original_id):
+        self.mutants[id_]['duplicate'] = str(original_id)
+
+    def count_equivalent(self):
+        return len([m for m in self.mutants.values() if m.get('equivalent')])
+
+    def count_duplicate(self):
+        return len([m for m in self.mutants.values() if m.get('duplicate')])
+
+    def stratum(self, pos):
+        if self.sampler.stratify == 'operator':
+            return self.operator
+        elif self.sampler.stratify == 'function':
+            return self.function
+        elif self.sampler.stratify == 'line':
+            return pos.lineno
+
+    def get_mutant(self, id_):
+        return self.mutants.get(id_)
+
     @property
     def count(self):
         return len(self.mutants)
 
     def ids(self):
-        l = []
-
-        for m in self.mutants:
-            l.append(int(m['id']))
-
-        return l
+        return list(self.mutants.keys())
 
     def save(self, path):
+        '''
+        Save the report in json lines format. The header is written first,
+        followed by the mutants, one at a time.
+        '''
         log.i("report", "Saving json to %s" % path)
         dir_ = os.path.dirname(path)
-        if not os.path.exists(dir_):
+        if dir_ and not os.path.exists(dir_):
             os.makedirs(dir_)
 
         f = open(path, 'w')
-        f.write(str(self))
+        try:
+            f.write(json.dumps(self.header()) + '\n')
+            for mutant in self.mutants.values():
+                f.write(json.dumps(mutant) + '\n')
+        finally:
+            f.close()
 
-    def obj(self):
+    def header(self):
         return {'name': self.name,
                 'filename': self.filename,
                 'md5': self.md5,
                 'timestamp': int(time.time()),
-                'mutants': self.mutants}
+                'count': self.count,
+                'sequential': self.allocator.sequential,
+                'sample': self.sampler.obj() if self.sampler else None,
+                'region': self.region.obj() if self.region else None,
+                'pruning': self.pruning,
+                'functions': self.functions}
+
+    def obj(self):
+        obj = self.header()
+        obj['mutants'] = list(self.mutants.values())
+        return obj
 
     def __str__(self):
         return json.dumps(self.obj(), default=default_serializer)
@@ -0,0 +1,341 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+SQLite store of mutation reports and results, kept next to the reports
+and queried by the web server.
+
+The store holds one row per mutated file (named like its report), one
+row per mutant, and one row per run of mutants with the verdict of each
+mutant executed by that run.
+
+The store also serves as a cache of verdicts for incremental mutation
+testing. Each verdict is saved with a cache key made from the dependency
+hash of the function enclosing the mutant, the position of the mutant
+relative to the start of that function and the mutated value, and each
+run with a hash of the tests executed by it. Verdicts of mutants in
+functions whose dependencies are unchanged, executed by unchanged tests,
+are reused by later runs even if other parts of the file have changed.
+Mutants outside of any function are keyed by the md5 of the whole file.
+'''
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from . import log
+
+
+# name of the store within a folder of mutation reports
+STORE_FILE = 'llvm-p86.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id        INTEGER PRIMARY KEY,
+    name      TEXT NOT NULL UNIQUE,
+    filename  TEXT,
+    md5       TEXT,
+    report    TEXT,
+    count     INTEGER,
+    timestamp INTEGER,
+    header    TEXT
+);
+
+CREATE TABLE IF NOT EXISTS mutants (
+    file_id   INTEGER NOT NULL REFERENCES files(id),
+    id        TEXT NOT NULL,
+    line      INTEGER,
+    start     INTEGER,
+    stop      INTEGER,
+    value     TEXT,
+    operator  TEXT,
+    function  TEXT,
+    data      TEXT,
+    PRIMARY KEY (file_id, id)
+);
+
+CREATE INDEX IF NOT EXISTS mutants_id ON mutants(id);
+CREATE INDEX IF NOT EXISTS mutants_line ON mutants(file_id, line);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_id   INTEGER NOT NULL REFERENCES files(id),
+    timestamp INTEGER,
+    info      TEXT
+);
+
+CREATE TABLE IF NOT EXISTS verdicts (
+    run_id    INTEGER NOT NULL REFERENCES runs(id),
+    file_id   INTEGER NOT NULL REFERENCES files(id),
+    mutant_id TEXT NOT NULL,
+    verdict   TEXT NOT NULL,
+    exit      INTEGER,
+    time      REAL,
+    covered   INTEGER,
+    data      TEXT
+);
+
+CREATE INDEX IF NOT EXISTS verdicts_mutant ON verdicts(file_id, mutant_id);
+'''
+
+# columns added after the first version of the store, as (table, column,
+# type), added to stores lacking them when opened
+COLUMNS = [('runs', 'tests_hash', 'TEXT'),
+           ('verdicts', 'cache_key', 'TEXT')]
+
+INDICES = '''
+CREATE INDEX IF NOT EXISTS verdicts_cache ON verdicts(cache_key);
+'''
+
+
+def store_path(folder):
+    return os.path.join(folder, STORE_FILE)
+
+
+def cache_key(rep, mutant):
+    '''
+    Returns the cache key of a mutant in the mutation report rep.
+    '''
+    name = mutant.get('function')
+    function = rep.functions.get(name) if name else None
+
+    if function:
+        hash_ = function['hash']
+        offset = mutant['start'] - function['start']
+    else:
+        name = ''
+        hash_ = rep.md5
+        offset = mutant['start']
+
+    key = '%s:%s:%s:%d:%d:%s:%s' % (mutant['file'], name, hash_, offset,
+                                    mutant['stop'] - mutant['start'],
+                                    mutant['value'],
+                                    mutant.get('operator') or '')
+
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+class ResultsStore(object):
+
+    def __init__(self, path):
+        dir_ = os.path.dirname(path)
+        if dir_ and not os.path.exists(dir_):
+            os.makedirs(dir_)
+
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+        for table, column, type_ in COLUMNS:
+            rows = self.db.execute('PRAGMA table_info(%s)' % table)
+            if column not in [row['name'] for row in rows]:
+                self.db.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                                (table, column, type_))
+
+        self.db.executescript(INDICES)
+
+    def file_id(self, name):
+        row = self.db.execute('SELECT id FROM files WHERE name=?',
+                              (name,)).fetchone()
+        if row:
+            return row['id']
+
+    def save_report(self, name, rep):
+        '''
+        Store the mutation report rep under name, replacing the mutants
+        of any earlier report with the same name.
+        '''
+        log.i("store", "Storing report %s" % name)
+        header = rep.header()
+
+        file_id = self.file_id(name)
+        if file_id is None:
+            cur = self.db.execute('INSERT INTO files (name) VALUES (?)',
+                                  (name,))
+            file_id = cur.lastrowid
+
+        self.db.execute('UPDATE files SET filename=?, md5=?, report=?, '
+                        'count=?, timestamp=?, header=? WHERE id=?',
+                        (header['filename'], header['md5'], header['name'],
+                         header['count'], header['timestamp'],
+                         json.dumps(header), file_id))
+
+        self.db.execute('DELETE FROM mutants WHERE file_id=?', (file_id,))
+        self.db.executemany('INSERT INTO mutants VALUES '
+                            '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            [(file_id, m['id'], m['line'], m['start'],
+                              m['stop'], m['value'], m.get('operator'),
+                              m.get('function'), json.dumps(m))
+                             for m in rep.mutants.values()])
+        self.db.commit()
+
+    def save_results(self, name, info, results, tests_hash=None,
+                     keys=None):
+        '''
+        Store a run of the mutants of the report stored under name, with
+        one executor.MutantResult per executed mutant. When the verdicts
+        are to be reused by later runs, tests_hash is the hash of the tests
+        executed and keys holds the cache key of each mutant, keyed by id.
+        '''
+        file_id = self.file_id(name)
+        if file_id is None:
+            log.w("store", "No report named %s, results not stored" % name)
+            return
+
+        self._save_run(file_id, info, results, tests_hash, keys)
+        self.db.commit()
+
+    def save_run(self, info, results):
+        '''
+        Store a run of mutants that may be located in any of the stored
+        reports, e.g. of a program linked from several modules, with one
+        executor.MutantResult per executed mutant. The report of each
+        mutant is resolved by its id.
+        '''
+        files = dict()
+        unknown = 0
+        for r in results:
+            rows = []
+            if r.id is not None:
+                rows = self.db.execute('SELECT file_id FROM mutants '
+                                       'WHERE id=?', (str(r.id),)).fetchall()
+            if len(rows) != 1:
+                unknown += 1
+                continue
+
+            files.setdefault(rows[0]['file_id'], []).append(r)
+
+        if unknown:
+            log.w("store", "%d mutants not found in any single report, "
+                           "their results are not stored" % unknown)
+
+        for file_id in sorted(files):
+            self._save_run(file_id, info, files[file_id])
+
+        self.db.commit()
+
+    def _save_run(self, file_id, info, results, tests_hash=None, keys=None):
+        keys = keys or dict()
+        cur = self.db.execute('INSERT INTO runs (file_id, timestamp, info, '
+                              'tests_hash) VALUES (?, ?, ?, ?)',
+                              (file_id, int(time.time()), json.dumps(info),
+                               tests_hash))
+        run_id = cur.lastrowid
+
+        self.db.executemany('INSERT INTO verdicts (run_id, file_id, '
+                            'mutant_id, verdict, exit, time, covered, data, '
+                            'cache_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            [(run_id, file_id, str(r.id), r.verdict, r.code,
+                              r.time, int(r.covered), json.dumps(r.obj()),
+                              keys.get(r.id))
+                             for r in results if r.id is not None])
+
+    def lookup(self, key, tests_hash):
+        '''
+        Returns the latest verdict with the cache key, saved by a run of
+        the tests with tests_hash, as a dict of the result, or None.
+        '''
+        row = self.db.execute('SELECT verdicts.data FROM verdicts JOIN runs '
+                              'ON verdicts.run_id = runs.id '
+                              'WHERE verdicts.cache_key=? AND '
+                              'runs.tests_hash=? ORDER BY runs.id DESC',
+                              (key, tests_hash)).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row['data'])
+
+    def names(self):
+        '''
+        Returns the names of all stored reports.
+        '''
+        rows = self.db.execute('SELECT name FROM files ORDER BY name')
+        return [row['name'] for row in rows]
+
+    def report(self, name):
+        '''
+        Returns the report stored under name as a dict of the report header,
+        with the mutants in 'mutants', or None if not found. Each mutant
+        holds its latest verdict (if any) in 'result'.
+        '''
+        f = self.db.execute('SELECT id, header FROM files WHERE name=?',
+                            (name,)).fetchone()
+        if f is None:
+            return None
+
+        # sqlite takes the bare data column from the row of the latest run
+        rows = self.db.execute('SELECT mutant_id, data, MAX(run_id) '
+                               'FROM verdicts WHERE file_id=? '
+                               'GROUP BY mutant_id', (f['id'],))
+        results = dict([(row['mutant_id'], row['data']) for row in rows])
+
+        obj = json.loads(f['header'] or '{}')
+        obj['mutants'] = list()
+
+        rows = self.db.execute('SELECT id, data FROM mutants '
+                               'WHERE file_id=?', (f['id'],))
+        for row in rows:
+            mutant = json.loads(row['data'])
+            if row['id'] in results:
+                mutant['result'] = json.loads(results[row['id']])
+            obj['mutants'].append(mutant)
+
+        return obj
+
+    def search(self, id_):
+        '''
+        Returns the names of the reports containing a mutant with id_.
+        '''
+        rows = self.db.execute('SELECT files.name FROM mutants JOIN files '
+                               'ON mutants.file_id = files.id '
+                               'WHERE mutants.id=? ORDER BY files.name',
+                               (str(id_),))
+        return [row['name'] for row in rows]
+
+    def mutant(self, id_, name=None):
+        '''
+        Returns a mutant with id_ as a dict, together with the report name
+        and its latest verdict (if any), or None if not found.
+        '''
+        sql = ('SELECT files.name, mutants.file_id, mutants.data '
+               'FROM mutants JOIN files ON mutants.file_id = files.id '
+               'WHERE mutants.id=?')
+        args = (str(id_),)
+        if name is not None:
+            sql += ' AND files.name=?'
+            args += (name,)
+
+        row = self.db.execute(sql, args).fetchone()
+        if row is None:
+            return None
+
+        obj = json.loads(row['data'])
+        obj['report'] = row['name']
+
+        verdict = self.db.execute('SELECT data FROM verdicts WHERE file_id=? '
+                                  'AND mutant_id=? ORDER BY run_id DESC',
+                                  (row['file_id'], str(id_))).fetchone()
+        if verdict:
+            obj['result'] = json.loads(verdict['data'])
+
+        return obj
+
+    def close(self):
+        self.db.close()
@@ -717,6 +717,19 @@ class TypeSetVisitor(ast.DefaultP86Visitor):
         ty = symtab.FunctionType('P86', 'getmutationcount', symtab.SIntType(32))
         self.ctx.install_function(ty.name, ty)
 
+        # builtin test case functions
+        ty = symtab.FunctionType('P86', 'begintest')
+        ty.params.append(symtab.ParameterType('n', symtab.SIntType(32)))
+        self.ctx.install_function(ty.name, ty)
+
+        ty = symtab.FunctionType('P86', 'failtest')
+        ty.params.append(symtab.ParameterType('n', symtab.SIntType(32)))
+        self.ctx.install_function(ty.name, ty)
+
+        ty = symtab.FunctionType('P86', 'gettestorder', symtab.SIntType(32))
+        ty.params.append(symtab.ParameterType('i', symtab.SIntType(32)))
+        self.ctx.install_function(ty.name, ty)
+
     def visit(self, node, arg=None):
         try:
             return ast.DefaultP86Visitor.visit(self, node, arg)
@@ -891,6 +904,9 @@ class TypeSetVisitor(ast.DefaultP86Visitor):
         except symtab.SymtabException:
             try:
                 sym = self.ctx.find_function(name)
+
+                # a call to a function without parameters
+                node.function_call = True
                 return sym.type.ret
             except symtab.SymtabException:
                 raise NodeException(node, "call to unknown function '%s'" %
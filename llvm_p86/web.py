@@ -20,92 +20,566 @@
 Simple web server that serves mutation data.
 '''
 
-import os
+import bisect
+import email.utils
 import json
+import os
+import threading
+import time
+import zlib
 from argparse import ArgumentParser
+from collections import OrderedDict
 
 try:
     # Python 2
     import SimpleHTTPServer
     import SocketServer
-except:
+    import Queue as queue
+    from urlparse import parse_qs
+except ImportError:
     # Python 3
-    from http.server import SimpleHTTPServer
-    from socketserver import SocketServer
+    import http.server as SimpleHTTPServer
+    import socketserver as SocketServer
+    import queue
+    from urllib.parse import parse_qs
+
+from . import report
+from . import store
+
+
+# minimum number of seconds between two scans of the data folder
+REFRESH_INTERVAL = 1.0
+
+# files served with gzip compression, when accepted by the client
+COMPRESSIBLE = ('.p', '.json', '.jsonl', '.js', '.css', '.map', '.html')
+
+# responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+# number of compressed files kept in memory
+GZIP_CACHE_SIZE = 64
+
+# default and maximum number of mutants in a page of /api/mutants
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# number of rendered hunks kept in memory, and maximum lines of context
+HUNK_CACHE_SIZE = 4096
+MAX_HUNK_CONTEXT = 50
+
+
+def gzip(data):
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+
+class LRUCache(object):
+    '''
+    Thread safe cache keeping the most recently used entries.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class IndexedReport(object):
+    '''
+    A parsed mutation report, with its mutants ordered by position so
+    that the mutants on a range of lines are found by bisection.
+    '''
+
+    def __init__(self, name, obj):
+        self.name = name
+        self.mutants = sorted(obj.pop('mutants'),
+                              key=lambda m: (m['line'], m['start']))
+        self.lines = [m['line'] for m in self.mutants]
+        self.header = obj
+
+    def select(self, offset=0, limit=None, first=None, last=None):
+        '''
+        Returns the number of mutants located between the lines first
+        and last, and a page of limit of those mutants starting at offset.
+        '''
+        lo = 0
+        hi = len(self.mutants)
+        if first is not None:
+            lo = bisect.bisect_left(self.lines, first)
+        if last is not None:
+            hi = bisect.bisect_right(self.lines, last)
+
+        total = max(hi - lo, 0)
+        lo += offset
+        if limit is not None:
+            hi = min(hi, lo + limit)
+
+        return total, self.mutants[lo:hi]
+
+    def info(self):
+        info = dict(self.header)
+        info['report'] = self.name
+        return info
+
+
+class ReportIndex(object):
+    '''
+    Index of the mutation reports in a folder. The reports are queried
+    from the results store of the folder, if any, where each mutant holds
+    its latest verdict, and a report is only loaded in full when its
+    mutants are listed. Otherwise, the report files in the folder are
+    parsed, and each mutant id is mapped to the reports holding it.
+    Reports are loaded again only when their modification time (or that
+    of the store) changes.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.checked = 0
+        self.mtimes = dict()
+        self.reports = dict()
+        self.files = dict()
+        self.sources = set()
+        self.ids = dict()
+        self.store = None
+
+    def refresh(self):
+        with self.lock:
+            if time.time() - self.checked < REFRESH_INTERVAL:
+                return
+
+            self.checked = time.time()
+            mtimes = dict()
+            sources = set()
+            path = store.store_path(self.path)
+            use_store = os.path.exists(path)
+
+            for f in os.listdir(self.path):
+                if f.endswith(".p"):
+                    sources.add(f[:-2])
+                elif f == store.STORE_FILE and use_store:
+                    mtimes[f] = os.stat(path).st_mtime
+                elif report.report_name(f) and not use_store:
+                    mtimes[f] = os.stat(os.path.join(self.path, f)).st_mtime
+
+            self.sources = sources
+            if mtimes == self.mtimes:
+                return
+
+            if use_store:
+                # reports are loaded from the store when first requested
+                self.store = path
+                self.reports = dict()
+            else:
+                self.store = None
+                self.reports = dict([(f, r) for f, r in self.reports.items()
+                                     if report.report_name(f)])
+
+                for f in mtimes:
+                    if self.mtimes.get(f) != mtimes[f]:
+                        ds = report.load(os.path.join(self.path, f))
+                        self.reports[f] = IndexedReport(report.report_name(f),
+                                                        ds)
+
+                for f in set(self.reports) - set(mtimes):
+                    del self.reports[f]
+
+            # reports in json lines format take precedence over legacy ones
+            files = dict()
+            ids = dict()
+            for f in sorted(self.reports):
+                rep = self.reports[f]
+                files[rep.name] = rep
+
+            for name in sorted(files):
+                for m in files[name].mutants:
+                    ids.setdefault(str(m['id']), []).append((name, m))
+
+            self.files = files
+            self.ids = ids
+            self.mtimes = mtimes
+
+    def query(self, func, *args):
+        '''
+        Returns func(st, *args) evaluated on the results store, or None if
+        the reports are not stored.
+        '''
+        path = self.store
+        if path is None:
+            return None
+
+        st = store.ResultsStore(path)
+        try:
+            return func(st, *args)
+        finally:
+            st.close()
+
+    def names(self):
+        '''
+        Returns the names of all reports having a source file.
+        '''
+        self.refresh()
+        if self.store:
+            names = self.query(store.ResultsStore.names) or []
+        else:
+            names = self.files
+
+        return sorted(set(names) & self.sources)
+
+    def get(self, name):
+        self.refresh()
+        if not self.store:
+            return self.files.get(name)
+
+        with self.lock:
+            if name not in self.files:
+                obj = self.query(store.ResultsStore.report, name)
+                self.files[name] = obj and IndexedReport(name, obj)
+
+            return self.files[name]
+
+    def search(self, id_):
+        '''
+        Returns the names of the reports containing a mutant with id_.
+        '''
+        self.refresh()
+        if self.store:
+            return self.query(store.ResultsStore.search, id_) or []
+
+        return [name for name, _ in self.ids.get(id_, [])]
+
+    def mutant(self, id_, name=None):
+        '''
+        Returns the name of a report containing a mutant with id_, and the
+        mutant itself, or None if not found.
+        '''
+        self.refresh()
+        if self.store:
+            obj = self.query(store.ResultsStore.mutant, id_, name)
+            if obj is not None:
+                return obj.pop('report'), obj
+
+            return None
+
+        for hit in self.ids.get(id_, []):
+            if name is None or hit[0] == name:
+                return hit
 
 
 class MyHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
+    index = None
+
+    # compressed file contents, keyed by path and etag
+    compressed = dict()
+    compressed_lock = threading.Lock()
+
+    # rendered hunks, keyed by report md5, name, mutant id and context
+    hunks = LRUCache(HUNK_CACHE_SIZE)
+
     def do_GET(self):
+        path = self.path.split('?')[0]
+
         if self.path.endswith(".mut"):
             self.do_mutation('data' + self.path[:-4])
 
         elif self.path.startswith('/search?id='):
             self.do_search(self.path[11:])
 
+        elif self.path.startswith('/mutant?id='):
+            self.do_mutant(self.path[11:])
+
+        elif path.startswith('/api/'):
+            self.do_api(path[5:])
+
         elif self.path == "/":
             self.do_index()
 
+        elif path.endswith(COMPRESSIBLE):
+            self.do_file(self.translate_path(path))
+
         else:
             SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
 
+    def accepts_gzip(self):
+        encodings = self.headers.get('Accept-Encoding') or ''
+        return 'gzip' in [e.split(';')[0].strip()
+                          for e in encodings.split(',')]
+
+    def send_body(self, body, ctype, headers=None, key=None):
+        '''
+        Send a response with body, compressed with gzip when accepted by
+        the client. When key is given, the compressed body is cached
+        under that key.
+        '''
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        headers = list(headers or [])
+        if len(body) >= GZIP_MIN_SIZE and self.accepts_gzip():
+            with self.compressed_lock:
+                data = self.compressed.get(key) if key else None
+
+            if data is None:
+                data = gzip(body)
+                if key:
+                    with self.compressed_lock:
+                        if len(self.compressed) >= GZIP_CACHE_SIZE:
+                            self.compressed.clear()
+                        self.compressed[key] = data
+
+            body = data
+            headers.append(('Content-Encoding', 'gzip'))
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        self.send_response(200)
+        self.send_header('Content-Length', len(body))
+        self.send_header('Content-type', ctype)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def open_store(self):
+        '''
+        Returns the results store of the served reports, or None if the
+        reports were saved without one.
+        '''
+        path = store.store_path('data')
+        if os.path.exists(path):
+            return store.ResultsStore(path)
+
     def do_search(self, query):
         prefix = "<html><body>"
         s = ''
         postfix = "</body></html>"
-        hits = 0
 
-        for f in os.listdir("data"):
-            if not f.endswith(".json"):
-                continue
+        names = self.index.search(query)
+        for name in names:
+            s += '<a href="%s.mut#%s">%s</a><br>' % (name, query, name)
 
-            ds = json.load(open('data/' + f))
-
-            for m in ds['mutants']:
-                if str(m['id']) == query:
-                    s += '<a href="%s.mut#%s">%s</a><br>' % (f[:-5],
-                                                             query,
-                                                             f[:-5])
-                    hits += 1
-
-        if hits == 0:
+        if not names:
             s = "<p>Mutant %s not found!</p>" % query
-            self.wfile.write(prefix + s + postfix)
-        elif hits == 1:
+            self.send_body(prefix + s + postfix, 'text/html; charset=utf-8')
+        elif len(names) == 1:
             self.send_response(301)
-            self.send_header('Location', '%s.mut#%s' % (f[:-5], query))
+            self.send_header('Location', '%s.mut#%s' % (names[0], query))
             self.end_headers()
         else:
             html = prefix + s + postfix
-            self.send_response(200)
-            self.send_header('Content-Length', len(html))
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html)
+            self.send_body(html, 'text/html; charset=utf-8')
+
+    def do_mutant(self, query):
+        st = self.open_store()
+        if not st:
+            self.send_error(404, "No results store")
+            return
+
+        try:
+            obj = st.mutant(query)
+        finally:
+            st.close()
+
+        if obj is None:
+            self.send_error(404, "Mutant %s not found" % query)
+            return
+
+        self.send_body(json.dumps(obj), 'application/json')
+
+    def send_json(self, obj):
+        self.send_body(json.dumps(obj), 'application/json')
+
+    def query(self):
+        if '?' not in self.path:
+            return dict()
+
+        query = parse_qs(self.path.split('?', 1)[1])
+        return dict([(k, v[-1]) for k, v in query.items()])
+
+    def do_api(self, path):
+        '''
+        JSON interface of the viewer:
+          /api/files                      headers of all reports
+          /api/mutants?file=NAME          a page of the mutants in a report,
+                        &offset=N&limit=N   ordered by position, optionally
+                        &line=N[-M]         restricted to a range of lines
+          /api/mutant/ID[?file=NAME]      a single mutant
+          /api/hunk/ID[?file=NAME         a mutant as a hunk of source
+                      &context=N]         with N lines of context
+        '''
+        query = self.query()
+        if path == 'files':
+            self.send_json([self.index.get(name).info()
+                            for name in self.index.names()])
+
+        elif path == 'mutants':
+            rep = self.index.get(query.get('file'))
+            if rep is None:
+                self.send_error(404, "Report not found")
+                return
+
+            try:
+                offset = max(int(query.get('offset', 0)), 0)
+                limit = min(int(query.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+                first = last = None
+                if 'line' in query:
+                    lines = query['line'].split('-')
+                    first = int(lines[0])
+                    last = int(lines[-1])
+            except ValueError:
+                self.send_error(400, "Bad page or line number")
+                return
+
+            total, mutants = rep.select(offset, max(limit, 0), first, last)
+            self.send_json({'report': rep.info(),
+                            'total': total,
+                            'offset': offset,
+                            'limit': limit,
+                            'mutants': mutants})
+
+        elif path.startswith('mutant/'):
+            hit = self.index.mutant(path[7:], query.get('file'))
+            if hit is None:
+                self.send_error(404, "Mutant %s not found" % path[7:])
+                return
+
+            obj = dict(hit[1])
+            obj['report'] = hit[0]
+            self.send_json(obj)
+
+        elif path.startswith('hunk/'):
+            try:
+                context = int(query.get('context', report.HUNK_CONTEXT))
+            except ValueError:
+                self.send_error(400, "Bad context")
+                return
+
+            obj = self.hunk(path[5:], query.get('file'),
+                            min(max(context, 0), MAX_HUNK_CONTEXT))
+            if obj is None:
+                self.send_error(404, "Mutant %s not found" % path[5:])
+                return
+
+            self.send_json(obj)
 
-    def do_index(self):
-        source_files = []
-        data_files = []
-
-        for f in os.listdir("data"):
-            if f.endswith(".p"):
-                source_files.append(f[:-2])
-            elif f.endswith(".json"):
-                data_files.append(f[:-5])
+        else:
+            self.send_error(404, "Unknown request")
+
+    def hunk(self, id_, name, context):
+        '''
+        Returns a mutant rendered as a hunk of source, or None if either
+        the mutant or its source is not found.
+        '''
+        hit = self.index.mutant(id_, name)
+        if hit is None:
+            return None
+
+        name, mutant = hit
+        rep = self.index.get(name)
+        key = (rep and rep.header.get('md5'), name, id_, context)
+        obj = self.hunks.get(key)
+        if obj is not None:
+            return obj
+
+        try:
+            f = open('data/%s.p' % name, 'rb')
+        except IOError:
+            return None
+
+        try:
+            source = f.read().decode('utf-8', 'replace')
+        finally:
+            f.close()
+
+        obj = report.hunk(source, mutant, context)
+        obj['report'] = name
+        self.hunks.put(key, obj)
+
+        return obj
 
+    def do_index(self):
         html = "<html><body>"
 
-        for f in sorted(data_files):
-            if f in source_files:
-                html += '<a href="%s.mut">%s</a><br>' % (f, f)
+        for f in self.index.names():
+            html += '<a href="%s.mut">%s</a><br>' % (f, f)
 
         html += "</body></html>"
 
-        self.send_response(200)
-        self.send_header('Content-Length', len(html))
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html)
+        self.send_body(html, 'text/html; charset=utf-8')
+
+    def do_file(self, path):
+        '''
+        Serve a report, source file or static asset with an ETag and
+        Last-Modified header, and answer requests for unchanged files
+        with 304. Files outside of the www root are never served.
+        '''
+        root = os.path.realpath(os.getcwd())
+        path = os.path.realpath(path)
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        etag = '"%x-%x"' % (int(st.st_mtime * 1000000), st.st_size)
+        modified = email.utils.formatdate(int(st.st_mtime), usegmt=True)
+
+        if self.not_modified(etag, int(st.st_mtime)):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', modified)
+            self.end_headers()
+            return
+
+        f = open(path, 'rb')
+        try:
+            body = f.read()
+        finally:
+            f.close()
+
+        if path.endswith('.p'):
+            ctype = 'text/plain; charset=utf-8'
+        elif report.report_name(path) or path.endswith('.map'):
+            ctype = 'application/json'
+        else:
+            ctype = self.guess_type(path)
+
+        self.send_body(body, ctype, [('ETag', etag),
+                                     ('Last-Modified', modified),
+                                     ('Cache-Control', 'no-cache')],
+                       key=(path, etag))
+
+    def not_modified(self, etag, mtime):
+        tags = self.headers.get('If-None-Match')
+        if tags is not None:
+            return etag in [t.strip() for t in tags.split(',')] or tags == '*'
+
+        since = self.headers.get('If-Modified-Since')
+        if since is not None:
+            date = email.utils.parsedate_tz(since)
+            if date is not None:
+                return mtime <= email.utils.mktime_tz(date)
+
+        return False
 
     def do_mutation(self, name):
         html = '''
@@ -171,33 +645,63 @@ class MyHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
                   </div>
                   <div id="popup" style="display: none;"></div>
                   <pre id="code" class="sh_pascal"></pre>
+                  <div id="hunk" style="display: none;">
+                    <span id="hunk_lines" class="xx_label"></span>
+                    <pre id="hunk_code" class="sh_pascal"></pre>
+                  </div>
                 </body>
                 </html>''' % name
 
-        self.send_response(200)
-        self.send_header('Content-Length', len(html))
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html)
+        self.send_body(html, 'text/html; charset=utf-8')
 
 
 class MyTCPServer(SocketServer.TCPServer):
+    '''
+    TCP server handing accepted requests to a fixed number of worker
+    threads, so that one slow client does not block the others.
+    '''
     allow_reuse_address = True
 
+    def __init__(self, address, handler, workers=1):
+        SocketServer.TCPServer.__init__(self, address, handler)
+        self.pending = queue.Queue()
+
+        for _ in range(max(workers, 1)):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+
+    def work(self):
+        while True:
+            request, client_address = self.pending.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self.pending.put((request, client_address))
+
 
 def run():
     try:
         parser = ArgumentParser()
         parser.add_argument("-p", "--port", dest="port", action="store", default="8000", help="selects the port that the http server will bind to")
         parser.add_argument("-r", "--root", dest="root", action="store", default="wwwroot", metavar="PATH", help="path pointing at the www root")
+        parser.add_argument("-j", "--jobs", dest="jobs", metavar="N", action="store", type=int, default=8, help="number of requests to serve in parallel")
 
         args = parser.parse_args()
 
-        httpd = MyTCPServer(("", int(args.port)), MyHandler)
+        httpd = MyTCPServer(("", int(args.port)), MyHandler, args.jobs)
         httpd.allow_reuse_address = True
         if args.root:
             os.chdir(args.root)
 
+        MyHandler.index = ReportIndex('data')
+        MyHandler.index.refresh()
+
         print(("Serving mutation reports at http://localhost:%s" % args.port))
         httpd.serve_forever()
 
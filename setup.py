@@ -74,7 +74,7 @@ setup(name='llvm-p86',
       data_files = [('share/llvm-p86/css', css),
                     ('share/llvm-p86/js', js),
                     ('share/llvm-p86/data', ['wwwroot/data/.keep'])],
-      scripts=['llvm-p86', 'llvm-p86-webserver'],
+      scripts=['llvm-p86', 'llvm-p86-run', 'llvm-p86-webserver', 'llvm-p86-report'],
       cmdclass={'prepare': PrepareCommand}
       )
 
@@ -0,0 +1,35 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Unit tests of the parts of LLVM-P86 written in pure Python, i.e. those
+that do not depend on llvmpy.
+'''
+
+
+class Pos(object):
+    '''
+    Position of a node in a source file, as set by the parser.
+    '''
+
+    def __init__(self, lineno, lexpos, lexendpos, path='t.p'):
+        self.path = [path]
+        self.lineno = lineno
+        self.lexpos = lexpos
+        self.lexendpos = lexendpos
@@ -0,0 +1,236 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Tests of the pure Python parts of the mutant executors.
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from argparse import ArgumentTypeError
+
+from llvm_p86 import executor
+from llvm_p86 import main
+from llvm_p86.constants import INFECTED_FLAG, REACHED_FLAG
+
+
+class TestMutantResult(unittest.TestCase):
+
+    def test_verdicts(self):
+        def verdict(code, covered=True):
+            return executor.MutantResult(1, 1, code, 0.0, covered).verdict
+
+        self.assertEqual(verdict(0), executor.SURVIVED)
+        self.assertEqual(verdict(1), executor.KILLED)
+        self.assertEqual(verdict(-11), executor.KILLED)
+        self.assertEqual(verdict(executor.TIMEOUT_EXIT_CODE),
+                         executor.TIMEOUT)
+        self.assertEqual(verdict(None, False), executor.SURVIVED)
+        self.assertEqual(verdict(None), executor.UNKNOWN)
+
+    def test_obj(self):
+        obj = executor.MutantResult(2, 5, 1, 0.1234567, tests=[3]).obj()
+
+        self.assertEqual(obj, {'index': 2, 'id': 5, 'verdict': 'killed',
+                               'exit': 1, 'time': 0.123457, 'covered': True,
+                               'tests': [3]})
+
+
+class TestKillMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'results.jsonl')
+        with open(self.path, 'w') as f:
+            for obj in [{'jobs': 1},
+                        {'index': 1, 'id': 100, 'tests': [3, 1]},
+                        {'index': 2, 'id': None, 'tests': [2]},
+                        {'index': 3, 'id': 300}]:
+                f.write(json.dumps(obj) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_keyed_by_id(self):
+        matrix = executor.load_kill_matrix(self.path)
+        self.assertEqual(matrix, {100: [3, 1], 2: [2]})
+
+    def test_keyed_by_index(self):
+        matrix = executor.load_kill_matrix(self.path, by_index=True)
+        self.assertEqual(matrix, {1: [3, 1], 2: [2]})
+
+
+class TestTestOrder(unittest.TestCase):
+
+    def executor(self, history, count):
+        e = executor.Executor()
+        e.track_tests(history)
+        e.test_count = count
+        return e
+
+    def test_permutation(self):
+        e = self.executor({1: [4, 9, 2]}, 5)
+
+        self.assertEqual(e.test_order(1)[:2], [4, 2])
+        self.assertEqual(sorted(e.test_order(1)), [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(e.test_order(2)), [1, 2, 3, 4, 5])
+
+    def test_most_killing_tests_first(self):
+        e = self.executor({1: [3], 2: [3, 2], 3: [3]}, 4)
+
+        self.assertEqual(e.test_order(4), [3, 2, 1, 4])
+
+    def test_unknown_order(self):
+        self.assertEqual(self.executor({1: [1]}, 0).test_order(1), None)
+        self.assertEqual(self.executor({1: [1]}, 3).test_order(0), None)
+        self.assertEqual(self.executor(None, 3).test_order(1), None)
+
+
+class TestCollectTests(unittest.TestCase):
+
+    def collect(self, lines, code, tests=True):
+        e = executor.Executor()
+        e.tests = tests
+        tmp = tempfile.TemporaryFile()
+        tmp.write(''.join([l + '\n' for l in lines]).encode())
+        e._test_files[42] = (7, tmp)
+
+        return e, e.collect_tests(42, code)
+
+    def test_failed_tests(self):
+        e, failed = self.collect(['begin 1', 'begin 2', 'fail 2',
+                                  'begin 3', 'fail 3', 'fail 3'], 1)
+
+        self.assertEqual(failed, [2, 3])
+        self.assertEqual(e.test_count, 3)
+
+    def test_abnormal_termination(self):
+        _, failed = self.collect(['begin 1', 'begin 2'], -11)
+        self.assertEqual(failed, [2])
+
+        _, failed = self.collect(['begin 1', 'begin 2'], 0)
+        self.assertEqual(failed, [])
+
+    def test_mutant_id(self):
+        e, failed = self.collect(['mutant 1234', 'begin 1'], 0, tests=False)
+
+        self.assertEqual(failed, None)
+        self.assertEqual(e.mutant_id(7), 1234)
+
+    def test_untracked(self):
+        e = executor.Executor()
+        self.assertEqual(e.collect_tests(42, 0), None)
+
+
+class TestWeakResult(unittest.TestCase):
+
+    def test_verdicts(self):
+        verdicts = [executor.WeakResult(1, 1, flags, True).verdict
+                    for flags in (0, INFECTED_FLAG, REACHED_FLAG,
+                                  INFECTED_FLAG | REACHED_FLAG)]
+
+        self.assertEqual(verdicts, [executor.SURVIVED, executor.KILLED,
+                                    executor.UNKNOWN, executor.KILLED])
+
+
+class TestTimeoutFactor(unittest.TestCase):
+
+    def test_factor(self):
+        self.assertEqual(executor.timeout_factor('2.5'), 2.5)
+
+        for s in ('0', '-1', 'x'):
+            self.assertRaises(ArgumentTypeError, executor.timeout_factor, s)
+
+        self.assertEqual(main.timeout_factor('3'), 3)
+
+        for s in ('0', '-1', '1.5'):
+            self.assertRaises(ArgumentTypeError, main.timeout_factor, s)
+
+
+class ExitExecutor(executor.Executor):
+
+    def execute(self, index):
+        return index
+
+
+class TestExecutor(unittest.TestCase):
+
+    def test_run(self):
+        e = ExitExecutor(jobs=2)
+        self.assertTrue(e.check_original())
+
+        results = e.run(range(1, 4))
+        self.assertEqual(sorted([(r.index, r.code) for r in results]),
+                         [(1, 1), (2, 2), (3, 3)])
+
+    def test_command(self):
+        e = executor.CommandExecutor(['sh', '-c', 'exit $0'], jobs=2)
+
+        results = e.run(range(0, 3))
+        self.assertEqual(sorted([(r.index, r.code) for r in results]),
+                         [(0, 0), (1, 1), (2, 2)])
+
+    def test_command_not_found(self):
+        e = executor.CommandExecutor(['/nonexistent/program'])
+
+        self.assertEqual([r.code for r in e.run([1])], [127])
+
+
+class TestProbe(unittest.TestCase):
+
+    def test_probe(self):
+        state = []
+
+        def func(index):
+            state.append(index)
+            if index:
+                raise ValueError
+
+        e = executor.ForkExecutor(func)
+
+        self.assertEqual(e.probe(0, lambda: state), ([0], 0))
+        self.assertEqual(e.probe(2, lambda: state), ([2], 1))
+        self.assertEqual(state, [])
+
+
+class TestRunSplit(unittest.TestCase):
+
+    def verdicts(self, func):
+        e = executor.ForkExecutor(func, mutant_id=lambda index: index)
+        results = e.run_split(range(1, 3), covered=set([1]))
+
+        return [r.verdict for r in results]
+
+    def test_never_forked(self):
+        self.assertEqual(self.verdicts(lambda index: None),
+                         [executor.SURVIVED, executor.SURVIVED])
+
+    def test_original_fails(self):
+        def func(index):
+            raise ValueError
+
+        self.assertEqual(self.verdicts(func),
+                         [executor.UNKNOWN, executor.SURVIVED])
+
+
+if __name__ == '__main__':
+    unittest.main()
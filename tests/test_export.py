@@ -0,0 +1,160 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Tests of the export of mutation reports as a static web site.
+'''
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from llvm_p86 import export
+from llvm_p86 import report
+
+from tests import Pos
+
+
+WWWROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'wwwroot')
+
+# runs the scripts given as arguments in the global scope, like a browser,
+# with just enough of a document to highlight a line of pascal
+SCRIPT_RUNNER = '''
+var fs = require('fs');
+var vm = require('vm');
+navigator = {userAgent: ''};
+function Element() {}
+Element.prototype.cloneNode = function() { return new Element(); };
+document = {createElement: function(name) { return new Element(); }};
+process.argv.slice(1).forEach(function(path) {
+  vm.runInThisContext(fs.readFileSync(path, 'utf8'), path);
+});
+sh_highlightString('x := 1;', sh_languages['pascal']);
+'''
+
+
+def which(program):
+    for folder in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(folder, program)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+
+class TestStaticSite(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.dir, 'data')
+        self.output = os.path.join(self.dir, 'site')
+        os.makedirs(self.data)
+
+        lines = ['line %d' % i for i in range(1, 8)]
+        source = '\n'.join(lines) + '\n'
+        with open(os.path.join(self.data, 't.p'), 'w') as f:
+            f.write(source)
+
+        rep = report.MutationReport('t', 't.p', 'abc')
+        self.ids = []
+        for lineno in (2, 6):
+            start = source.index('line %d' % lineno)
+            self.ids.append(rep.add_mutant(Pos(lineno, start, start + 4),
+                                           '<b>'))
+        rep.save(os.path.join(self.data, 't' + report.REPORT_EXT))
+
+        with open(os.path.join(self.data, 't' + report.RESULTS_EXT), 'w') as f:
+            f.write(json.dumps({'jobs': 1}) + '\n')
+            f.write(json.dumps({'index': 1, 'id': self.ids[0],
+                                'verdict': 'killed'}) + '\n')
+
+        # a report without source is not exported
+        report.MutationReport('u', 'u.p', 'def').save(
+            os.path.join(self.data, 'u' + report.REPORT_EXT))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, name):
+        with open(os.path.join(self.output, name)) as f:
+            return f.read()
+
+    def test_export(self):
+        site = export.StaticSite(self.data, self.output, page_size=4,
+                                 context=0)
+        site.export()
+
+        self.assertEqual([name for name, _, _ in site.reports], ['t'])
+        self.assertEqual(sorted(os.listdir(self.output)),
+                         ['index.html', 't.2.html', 't.html'])
+
+        index = self.read('index.html')
+        self.assertTrue('href="t.html"' in index)
+        self.assertTrue('2 (1 killed)' in index)
+
+        first = self.read('t.html')
+        self.assertTrue('Lines 1-4' in first)
+        self.assertTrue('#%d, lines 2-2, killed' % self.ids[0] in first)
+        self.assertTrue('&lt;b&gt;' in first)
+        self.assertFalse('#%d' % self.ids[1] in first)
+
+        second = self.read('t.2.html')
+        self.assertTrue('Lines 5-' in second)
+        self.assertTrue('#%d, lines 6-6</span>' % self.ids[1] in second)
+
+    def test_assets(self):
+        root = os.path.join(self.dir, 'www')
+        os.makedirs(os.path.join(root, 'js'))
+        with open(os.path.join(root, 'js', 'sh_main.js'), 'w') as f:
+            f.write('')
+
+        site = export.StaticSite(self.data, self.output)
+        site.export()
+        site.copy_assets(root)
+
+        self.assertTrue(os.path.isfile(os.path.join(self.output, 'js',
+                                                    'sh_main.js')))
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'css')))
+
+    @unittest.skipUnless(which('node'), 'requires node')
+    def test_scripts(self):
+        site = export.StaticSite(self.data, self.output)
+        site.export()
+        site.copy_assets(WWWROOT)
+
+        # the scripts of a page, inline ones saved to files, in page order
+        paths = []
+        page = self.read('t.html')
+        for i, (attrs, body) in enumerate(re.findall(
+                r'<script([^>]*)>(.*?)</script>', page, re.S)):
+            src = re.search(r'src="([^"]*)"', attrs)
+            if src:
+                paths.append(os.path.join(self.output, src.group(1)))
+            else:
+                paths.append(os.path.join(self.dir, 'inline%d.js' % i))
+                with open(paths[-1], 'w') as f:
+                    f.write(body)
+
+        subprocess.check_call(['node', '-e', SCRIPT_RUNNER] + paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+'''
+Tests of the mutation operators on programs built directly as syntax trees,
+i.e. as produced by the parser.
+'''
+
+import unittest
+
+from llvm_p86 import ast
+from llvm_p86 import mutation
+from llvm_p86 import report
+from llvm_p86 import typesys
+
+from tests import Pos
+
+
+def ident(name):
+    return ast.IdentifierNode(name)
+
+
+def var(name):
+    return ast.VarLoadNode(ast.VarAccessNode(ident(name)))
+
+
+def assign(name, expr):
+    return ast.AssignmentNode(ast.VarAccessNode(ident(name)), expr)
+
+
+def add(left, right):
+    return ast.BinaryOpNode(ast.OpNode('+'), left, right)
+
+
+def greater(left, right):
+    return ast.BinaryOpNode(ast.OpNode('>'), left, right)
+
+
+def if_then(expr, stmt):
+    return ast.IfNode(expr, stmt)
+
+
+def statements(*stmts):
+    l = None
+    for stmt in stmts:
+        l = ast.StatementListNode(stmt, l)
+
+    return l
+
+
+def block(stmt, variables=(), func=None):
+    var_list = None
+    for name in variables:
+        decl = ast.VarDeclNode(ast.IdentifierListNode(ident(name)),
+                               ast.TypeNode(ident('integer')))
+        var_list = ast.VarDeclListNode(decl, var_list)
+
+    return ast.BlockNode(None, None, None, var_list, func, stmt)
+
+
+def program(stmt):
+    '''
+    A program with a function next without parameters, that increments
+    the global variable c as a side effect:
+
+      program t;
+      var c, x: integer;
+      function next: integer;
+      begin
+        c := c + 1;
+        next := c
+      end;
+      begin
+        <stmt>
+      end.
+    '''
+    head = ast.FunctionHeadNode(ast.TypeNode(ident('integer')),
+                                ident('next'))
+    func = ast.FunctionNode(head, block(statements(
+        assign('c', add(var('c'), ast.IntegerNode(1))),
+        assign('next', var('c')))))
+
+    return ast.ProgramNode(ident('t'),
+                           block(statements(stmt), ['c', 'x'],
+                                 ast.FunctionListNode(func)))
+
+
+def walk(node):
+    yield node
+    for c in filter(None, node.children):
+        if isinstance(c, ast.Node):
+            for n in walk(c):
+                yield n
+
+
+def mutate(prog, mop):
+    for lineno, node in enumerate(walk(prog)):
+        node.pos_info = Pos(lineno + 1, lineno, lineno + 1)
+
+    prog.accept(typesys.TypeSetVisitor())
+    prog.accept(typesys.CallByRefVisitor())
+
+    rep = report.MutationReport(mop, 't.p', '0' * 32)
+    mutator = mutation.OPERATORS[mop]('t.p', '0' * 32)
+    mutator.report = rep
+    rep.operator = mop
+    prog.accept(mutator)
+
+    return rep
+
+
+def diverging(prog, stmt):
+    '''
+    Returns the guards of mutants of stmt tagged by diverge().
+    '''
+    nodes = [id(n) for n in walk(stmt)]
+
+    return [n for n in walk(prog)
+            if hasattr(n, 'diverge') and id(n.diverge[0]) in nodes]
+
+
+class TestDiverge(unittest.TestCase):
+
+    def test_pure(self):
+        stmt = assign('x', add(var('c'), ast.IntegerNode(1)))
+        prog = program(stmt)
+        rep = mutate(prog, 'aor')
+
+        self.assertTrue(rep.ids())
+        self.assertTrue(diverging(prog, stmt))
+
+    def test_function_without_parameters(self):
+        stmt = assign('x', add(var('next'), ast.IntegerNode(1)))
+        prog = program(stmt)
+        rep = mutate(prog, 'aor')
+
+        self.assertTrue(rep.ids())
+        self.assertFalse(diverging(prog, stmt))
+
+
+class TestWeakMutation(unittest.TestCase):
+    '''
+    Weak mutation flags a mutant as infected only when the expressions
+    tagged by diverge() evaluate to different values, and as merely
+    reached (an unknown outcome) when its guard is not tagged.
+    '''
+
+    def test_pure(self):
+        stmt = if_then(greater(var('c'), ast.IntegerNode(1)),
+                       assign('x', ast.IntegerNode(1)))
+        prog = program(stmt)
+        rep = mutate(prog, 'ror')
+
+        self.assertTrue(rep.ids())
+        self.assertEqual(len(diverging(prog, stmt)), len(rep.ids()))
+
+    def test_function_without_parameters(self):
+        stmt = if_then(greater(var('next'), ast.IntegerNode(1)),
+                       assign('x', ast.IntegerNode(1)))
+        prog = program(stmt)
+        rep = mutate(prog, 'ror')
+
+        self.assertTrue(rep.ids())
+        self.assertFalse(diverging(prog, stmt))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+'''
+Tests of mutation reports, mutant ids, sampling and regions.
+'''
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from llvm_p86 import report
+
+from tests import Pos
+
+
+class TestIdAllocator(unittest.TestCase):
+
+    def test_hashed_ids_are_stable(self):
+        a = report.IdAllocator('abc')
+        b = report.IdAllocator('abc')
+        key = a.key(Pos(1, 2, 3), '<')
+
+        self.assertEqual(a.allocate(key), b.allocate(key))
+        self.assertEqual(a.allocate(key), a.allocate(key))
+        self.assertTrue(0 < a.allocate(key) < 2 ** 31)
+
+    def test_hashed_ids_depend_on_position_and_value(self):
+        a = report.IdAllocator('abc')
+        ids = set([a.allocate(a.key(Pos(1, 2, 3), '<')),
+                   a.allocate(a.key(Pos(1, 2, 4), '<')),
+                   a.allocate(a.key(Pos(1, 2, 3), '>'))])
+
+        self.assertEqual(len(ids), 3)
+
+    def test_colliding_ids_are_rehashed(self):
+        a = report.IdAllocator('abc')
+        first = a.allocate(1)
+
+        # a key folding into the same id as key 1
+        other = 1 | (1 << 31) | (1 << 62)
+        self.assertEqual(a.fold(other), first)
+        self.assertNotEqual(a.allocate(other), first)
+
+    def test_zero_is_reserved(self):
+        self.assertEqual(report.IdAllocator.fold(0), 1)
+
+    def test_sequential_ids(self):
+        a = report.IdAllocator('abc', sequential=True)
+
+        self.assertEqual(a.allocate(10), 1)
+        self.assertEqual(a.allocate(20), 2)
+        self.assertEqual(a.allocate(10), 1)
+
+
+class TestSampler(unittest.TestCase):
+
+    def census(self, sampler, strata):
+        for stratum, count in strata:
+            for i in range(count):
+                sampler.select(report.hash64('%s:%d' % (stratum, i)), stratum)
+        sampler.draw()
+
+    def test_fraction(self):
+        s = report.Sampler(0.5)
+        self.census(s, [(None, 10)])
+
+        self.assertEqual(len(s.selected), 5)
+
+    def test_fraction_of_small_strata(self):
+        s = report.Sampler(0.1, stratify='line')
+        self.census(s, [(line, 3) for line in range(10)])
+
+        self.assertEqual(sum(s.quotas().values()), 3)
+        self.assertEqual(len(s.selected), 3)
+
+    def test_fixed_number_is_divided_between_strata(self):
+        s = report.Sampler(4, stratify='operator')
+        self.census(s, [('ror', 6), ('aor', 2)])
+
+        self.assertEqual(s.quotas(), {'ror': 3, 'aor': 1})
+        self.assertEqual(len(s.selected), 4)
+
+    def test_fixed_number_larger_than_population(self):
+        s = report.Sampler(100)
+        self.census(s, [(None, 3)])
+
+        self.assertEqual(len(s.selected), 3)
+
+    def test_seed_selects_the_same_mutants(self):
+        a = report.Sampler(0.3, seed=7)
+        b = report.Sampler(0.3, seed=7)
+        c = report.Sampler(0.3, seed=8)
+        for s in (a, b, c):
+            self.census(s, [(None, 50)])
+
+        self.assertEqual(a.selected, b.selected)
+        self.assertNotEqual(a.selected, c.selected)
+
+
+class TestRegion(unittest.TestCase):
+
+    DIFF = '\n'.join(['--- a/src/t.p',
+                      '+++ b/src/t.p',
+                      '@@ -1,3 +1,3 @@',
+                      ' a',
+                      '-b',
+                      '+B',
+                      ' c',
+                      '@@ -10,2 +10,3 @@',
+                      ' j',
+                      '+k',
+                      ' l',
+                      '--- a/other.p',
+                      '+++ b/other.p',
+                      '@@ -1 +1 @@',
+                      '+x',
+                      ''])
+
+    def test_add_diff(self):
+        r = report.Region()
+        r.add_diff(io.StringIO(self.DIFF), 'src/t.p')
+
+        self.assertEqual(r.lines, [(1, 2), (2, 2), (11, 11)])
+
+    def test_add_diff_of_other_file(self):
+        r = report.Region()
+        r.add_diff(io.StringIO(self.DIFF), 'src/u.p')
+
+        self.assertEqual(r.lines, [])
+        self.assertFalse(r.contains(None, 1))
+
+    def test_add_diff_matches_whole_path_components(self):
+        r = report.Region()
+        r.add_diff(io.StringIO(self.DIFF), 'mysrc/t.p')
+
+        self.assertEqual(r.lines, [])
+
+        r = report.Region()
+        r.add_diff(io.StringIO(self.DIFF), '/home/src/t.p')
+
+        self.assertEqual(r.lines, [(1, 2), (2, 2), (11, 11)])
+
+    def test_add_diff_of_lines_looking_like_headers(self):
+        diff = '\n'.join(['--- a/t.p',
+                          '+++ b/t.p',
+                          '@@ -1,2 +1,3 @@',
+                          ' a',
+                          '+++ b/other.p',
+                          '--- c',
+                          '+d',
+                          ''])
+        r = report.Region()
+        r.add_diff(io.StringIO(diff), 't.p')
+
+        self.assertEqual(r.lines, [(2, 2), (2, 3), (3, 3)])
+
+    def test_lines_spanned(self):
+        r = report.Region()
+        r.add_lines(5, 7)
+
+        self.assertTrue(r.contains(None, 3, 5))
+        self.assertTrue(r.contains(None, 7, 9))
+        self.assertFalse(r.contains(None, 2, 4))
+        self.assertFalse(r.contains(None, 8))
+
+    def test_functions(self):
+        r = report.Region()
+        r.add_function('Tri*')
+
+        self.assertTrue(r.contains('TriangleType', 1))
+        self.assertTrue(r.contains('Outer.TriangleArea', 1))
+        self.assertFalse(r.contains('RunTest', 1))
+        self.assertFalse(r.contains(None, 1))
+
+    def test_functions_and_lines(self):
+        r = report.Region()
+        r.add_function('f')
+        r.add_lines(5, 7)
+
+        self.assertTrue(r.contains('F', 6))
+        self.assertFalse(r.contains('F', 8))
+
+    def test_mutant_spanning_lines(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 't.p')
+            f = open(path, 'w')
+            f.write('x :=\n  a +\n  b;\n')
+            f.close()
+
+            rep = report.MutationReport('aor', path, '0' * 32)
+            rep.region = report.Region()
+            rep.region.add_lines(3)
+
+            self.assertIsNotNone(rep.add_mutant(Pos(2, 7, 15), '-'))
+            self.assertIsNone(rep.add_mutant(Pos(2, 7, 10), '-'))
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestHunk(unittest.TestCase):
+
+    SOURCE = 'one\ntwo\nif a < b then\nfour\nfive\n'
+
+    def test_context(self):
+        start = self.SOURCE.index('<')
+        mutant = {'id': 5, 'start': start, 'stop': start + 1, 'value': '>'}
+        h = report.hunk(self.SOURCE, mutant, 1)
+
+        self.assertEqual(h['id'], '5')
+        self.assertEqual((h['line'], h['last']), (2, 4))
+        self.assertEqual(h['before'], 'two\nif a ')
+        self.assertEqual(h['original'], '<')
+        self.assertEqual(h['value'], '>')
+        self.assertEqual(h['after'], ' b then\nfour')
+
+    def test_context_at_the_edges(self):
+        mutant = {'id': 1, 'start': 0, 'stop': 3, 'value': 'ONE'}
+        h = report.hunk(self.SOURCE, mutant, 10)
+
+        self.assertEqual((h['line'], h['last']), (1, 5))
+        self.assertEqual(h['before'], '')
+        self.assertEqual(h['after'], '\ntwo\nif a < b then\nfour\nfive')
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_json_lines(self):
+        rep = report.MutationReport('t', 't.p', 'abc')
+        id_ = rep.add_mutant(Pos(1, 2, 3), '<')
+        path = os.path.join(self.dir, 't' + report.REPORT_EXT)
+        rep.save(path)
+
+        obj = report.load(path)
+        self.assertEqual(obj['md5'], 'abc')
+        self.assertEqual([m['id'] for m in obj['mutants']], [str(id_)])
+
+    def test_single_document(self):
+        path = os.path.join(self.dir, 't' + report.LEGACY_REPORT_EXT)
+        with open(path, 'w') as f:
+            json.dump({'md5': 'abc', 'mutants': [{'id': 1}]}, f, indent=2)
+
+        obj = report.load(path)
+        self.assertEqual(obj['mutants'], [{'id': 1}])
+
+    def test_report_name(self):
+        self.assertEqual(report.report_name('t' + report.REPORT_EXT), 't')
+        self.assertEqual(report.report_name('t' + report.RESULTS_EXT), None)
+        self.assertEqual(report.report_name('t.p'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+'''
+Tests of the SQLite store of mutation reports and results.
+'''
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from llvm_p86 import executor
+from llvm_p86 import report
+from llvm_p86 import store
+
+from tests import Pos
+
+
+def make_report(name='t', md5='abc', function_hash='h1', start=10):
+    rep = report.MutationReport(name, name + '.p', md5)
+    rep.add_function('F', function_hash, start)
+    rep.function = 'F'
+    inside = rep.add_mutant(Pos(2, start + 2, start + 3, name + '.p'), '<')
+    rep.function = None
+    outside = rep.add_mutant(Pos(9, 90, 91, name + '.p'), '>')
+    return rep, inside, outside
+
+
+class TestCacheKey(unittest.TestCase):
+
+    def test_unchanged_function(self):
+        # the function and its mutant moved, while the file changed
+        a, a_in, a_out = make_report(md5='abc', start=10)
+        b, b_in, b_out = make_report(md5='def', start=20)
+
+        self.assertEqual(store.cache_key(a, a.get_mutant(a_in)),
+                         store.cache_key(b, b.get_mutant(b_in)))
+        self.assertNotEqual(store.cache_key(a, a.get_mutant(a_out)),
+                            store.cache_key(b, b.get_mutant(b_out)))
+
+    def test_changed_function(self):
+        a, a_in, _ = make_report(function_hash='h1')
+        b, b_in, _ = make_report(function_hash='h2')
+
+        self.assertNotEqual(store.cache_key(a, a.get_mutant(a_in)),
+                            store.cache_key(b, b.get_mutant(b_in)))
+
+
+class TestResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'data', store.STORE_FILE)
+        self.store = store.ResultsStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_reports(self):
+        rep, inside, outside = make_report()
+        self.store.save_report('t', rep)
+        self.store.save_report('t', rep)
+
+        self.assertEqual(self.store.names(), ['t'])
+        self.assertEqual(self.store.search(inside), ['t'])
+        self.assertEqual(self.store.search(12345), [])
+
+        obj = self.store.report('t')
+        self.assertEqual((len(obj['mutants']), obj['md5']), (2, 'abc'))
+        self.assertEqual(self.store.report('u'), None)
+
+    def test_results(self):
+        rep, inside, outside = make_report()
+        self.store.save_report('t', rep)
+        self.store.save_results('t', {'jobs': 1},
+                                [executor.MutantResult(1, inside, 0, 0.5),
+                                 executor.MutantResult(2, outside, 1, 0.5)])
+        self.store.save_results('t', {'jobs': 1},
+                                [executor.MutantResult(1, inside, 1, 0.5)])
+        self.store.save_results('t', {'jobs': 1},
+                                [executor.MutantResult(2, outside, 0, 0.5)])
+
+        obj = self.store.mutant(inside)
+        self.assertEqual(obj['report'], 't')
+        self.assertEqual(obj['result']['verdict'], executor.KILLED)
+
+        obj = self.store.report('t')
+        verdicts = dict([(m['id'], m['result']['verdict'])
+                         for m in obj['mutants']])
+        self.assertEqual(verdicts, {str(inside): executor.KILLED,
+                                    str(outside): executor.SURVIVED})
+
+    def test_results_of_unknown_report(self):
+        self.store.save_results('t', {}, [executor.MutantResult(1, 1, 0, 0)])
+        self.assertEqual(self.store.mutant(1), None)
+
+    def test_lookup(self):
+        rep, inside, outside = make_report()
+        keys = dict([(id_, store.cache_key(rep, rep.get_mutant(id_)))
+                     for id_ in rep.ids()])
+
+        self.store.save_report('t', rep)
+        self.store.save_results('t', {}, [executor.MutantResult(
+            1, inside, 1, 0.5, tests=[2])], 'tests', keys)
+
+        obj = self.store.lookup(keys[inside], 'tests')
+        self.assertEqual((obj['exit'], obj['tests']), (1, [2]))
+        self.assertEqual(self.store.lookup(keys[inside], 'other'), None)
+        self.assertEqual(self.store.lookup(keys[outside], 'tests'), None)
+
+    def test_save_run(self):
+        a, a_in, _ = make_report('a', 'abc')
+        b, b_in, _ = make_report('b', 'def')
+        self.store.save_report('a', a)
+        self.store.save_report('b', b)
+
+        self.store.save_run({}, [executor.MutantResult(1, a_in, 1, 0.5),
+                                 executor.MutantResult(2, b_in, 0, 0.5),
+                                 executor.MutantResult(3, 99, 0, 0.5),
+                                 executor.MutantResult(4, None, 0, 0.5)])
+
+        self.assertEqual(self.store.mutant(a_in)['result']['verdict'],
+                         executor.KILLED)
+        self.assertEqual(self.store.mutant(b_in)['result']['verdict'],
+                         executor.SURVIVED)
+
+    def test_columns_are_added(self):
+        self.store.close()
+        os.remove(self.path)
+
+        db = sqlite3.connect(self.path)
+        db.executescript(store.SCHEMA)
+        db.execute('ALTER TABLE verdicts RENAME TO old')
+        db.execute('CREATE TABLE verdicts (run_id, file_id, mutant_id, '
+                   'verdict, exit, time, covered, data)')
+        db.commit()
+        db.close()
+
+        self.store = store.ResultsStore(self.path)
+        rep, inside, _ = make_report()
+        keys = {inside: store.cache_key(rep, rep.get_mutant(inside))}
+        self.store.save_report('t', rep)
+        self.store.save_results('t', {}, [executor.MutantResult(
+            1, inside, 1, 0.5)], 'tests', keys)
+
+        self.assertEqual(self.store.lookup(keys[inside], 'tests')['exit'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+# encoding: utf-8
+# Copyright (C) 2013 John Törnblom
+#
+# This file is part of LLVM-P86.
+#
+# LLVM-P86 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# LLVM-P86 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with LLVM-P86.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+'''
+Tests of the report index and the request handler of the web server.
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+from llvm_p86 import executor
+from llvm_p86 import report
+from llvm_p86 import store
+from llvm_p86 import web
+
+from tests import Pos
+
+
+SOURCE = 'program t;\nbegin\n  if 1 < 2 then\n    halt(1)\nend.\n'
+
+
+def make_report():
+    rep = report.MutationReport('t', 't.p', 'abc')
+    start = SOURCE.index('<')
+    ids = [rep.add_mutant(Pos(3, start, start + 1), op)
+           for op in ('>', '=', '<=')]
+    ids.append(rep.add_mutant(Pos(4, SOURCE.index('halt'),
+                                  SOURCE.index('halt') + 7), ''))
+    return rep, ids
+
+
+class TestIndexedReport(unittest.TestCase):
+
+    def setUp(self):
+        mutants = [{'id': str(i), 'line': line, 'start': i}
+                   for i, line in enumerate([5, 1, 3, 3, 9])]
+        self.rep = web.IndexedReport('t', {'md5': 'abc', 'mutants': mutants})
+
+    def test_ordered_by_position(self):
+        self.assertEqual(self.rep.lines, [1, 3, 3, 5, 9])
+        self.assertEqual(self.rep.info(), {'md5': 'abc', 'report': 't'})
+
+    def test_select_lines(self):
+        total, mutants = self.rep.select(first=3, last=5)
+        self.assertEqual(total, 3)
+        self.assertEqual([m['id'] for m in mutants], ['2', '3', '0'])
+
+    def test_select_page(self):
+        total, mutants = self.rep.select(1, 2)
+        self.assertEqual(total, 5)
+        self.assertEqual([m['line'] for m in mutants], [3, 3])
+
+        total, mutants = self.rep.select(10, 2)
+        self.assertEqual((total, mutants), (5, []))
+
+
+class TestReportIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.rep, self.ids = make_report()
+        self.rep.save(os.path.join(self.dir, 't' + report.REPORT_EXT))
+        with open(os.path.join(self.dir, 't.p'), 'w') as f:
+            f.write(SOURCE)
+
+        self.index = web.ReportIndex(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def refresh(self):
+        self.index.checked = 0
+        self.index.refresh()
+
+    def save_results(self, code):
+        path = store.store_path(self.dir)
+        st = store.ResultsStore(path)
+        st.save_report('t', self.rep)
+        st.save_results('t', {}, [executor.MutantResult(1, self.ids[0],
+                                                        code, 0.5)])
+        st.close()
+
+        # a new modification time, even on file systems with a coarse one
+        mtime = self.index.mtimes.get(store.STORE_FILE, 0) + 1
+        os.utime(path, (mtime, mtime))
+        self.refresh()
+
+    def verdicts(self, name):
+        _, mutants = self.index.get(name).select()
+        return dict([(m['id'], m.get('result', {}).get('verdict'))
+                     for m in mutants])
+
+    def test_files(self):
+        self.assertEqual(self.index.names(), ['t'])
+        self.assertEqual(self.index.search(str(self.ids[0])), ['t'])
+        self.assertEqual(self.index.search('0'), [])
+
+        name, mutant = self.index.mutant(str(self.ids[1]))
+        self.assertEqual((name, mutant['value']), ('t', '='))
+        self.assertEqual(self.index.mutant(str(self.ids[1]), 'u'), None)
+
+    def test_report_without_source(self):
+        os.remove(os.path.join(self.dir, 't.p'))
+        self.refresh()
+
+        self.assertEqual(self.index.names(), [])
+        self.assertNotEqual(self.index.get('t'), None)
+
+    def test_store(self):
+        self.assertEqual(self.index.mutant(str(self.ids[0]))[1].get('result'),
+                         None)
+
+        self.save_results(1)
+
+        name, mutant = self.index.mutant(str(self.ids[0]))
+        self.assertEqual(name, 't')
+        self.assertEqual(mutant['result']['verdict'], executor.KILLED)
+        self.assertEqual(self.index.mutant(str(self.ids[0]), 'u'), None)
+        self.assertEqual(self.index.search(str(self.ids[0])), ['t'])
+        self.assertEqual(self.index.search('0'), [])
+        self.assertEqual(self.index.names(), ['t'])
+
+    def test_store_loads_reports_when_requested(self):
+        self.save_results(1)
+        self.assertEqual(self.index.files, {})
+
+        verdicts = self.verdicts('t')
+        self.assertEqual(verdicts.pop(str(self.ids[0])), executor.KILLED)
+        self.assertEqual(set(verdicts.values()), set([None]))
+        self.assertEqual(self.index.get('u'), None)
+
+        # a later run replaces the loaded report
+        self.save_results(0)
+        self.assertEqual(self.index.files, {})
+
+        self.assertEqual(self.verdicts('t')[str(self.ids[0])],
+                         executor.SURVIVED)
+
+
+class TestHandler(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.dir = tempfile.mkdtemp()
+        cls.root = os.path.join(cls.dir, 'www')
+        os.makedirs(os.path.join(cls.root, 'data'))
+
+        cls.rep, cls.ids = make_report()
+        cls.rep.save(os.path.join(cls.root, 'data', 't' + report.REPORT_EXT))
+        with open(os.path.join(cls.root, 'data', 't.p'), 'w') as f:
+            f.write(SOURCE)
+
+        with open(os.path.join(cls.dir, 'secret.p'), 'w') as f:
+            f.write('secret')
+        os.symlink(os.path.join(cls.dir, 'secret.p'),
+                   os.path.join(cls.root, 'data', 'link.p'))
+
+        os.chdir(cls.root)
+        web.MyHandler.index = web.ReportIndex('data')
+        web.MyHandler.log_message = lambda *args: None
+
+        cls.server = web.MyTCPServer(('127.0.0.1', 0), web.MyHandler, 2)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.dir)
+
+    def get(self, path, headers=None):
+        conn = httplib.HTTPConnection('127.0.0.1',
+                                      self.server.server_address[1])
+        try:
+            conn.request('GET', path, headers=headers or {})
+            res = conn.getresponse()
+            return res.status, dict(res.getheaders()), res.read()
+        finally:
+            conn.close()
+
+    def test_file(self):
+        status, headers, body = self.get('/data/t.p')
+        self.assertEqual(status, 200)
+        self.assertEqual(body.decode(), SOURCE)
+
+        status, _, _ = self.get('/data/t.p',
+                                {'If-None-Match': headers['ETag']})
+        self.assertEqual(status, 304)
+
+    def test_file_outside_of_root(self):
+        for path in ('/../secret.p', '/data/../../secret.p',
+                     '/data/%2e%2e/%2e%2e/secret.p', '/data/link.p',
+                     '/data/missing.p'):
+            status, _, _ = self.get(path)
+            self.assertEqual(status, 404, path)
+
+
+    def test_api(self):
+        status, _, body = self.get('/api/files')
+        self.assertEqual(status, 200)
+        self.assertEqual([f['report'] for f in json.loads(body.decode())],
+                         ['t'])
+
+        status, _, body = self.get('/api/mutants?file=t&line=4&limit=10')
+        obj = json.loads(body.decode())
+        self.assertEqual(obj['total'], 1)
+        self.assertEqual(obj['mutants'][0]['id'], str(self.ids[3]))
+
+        status, _, body = self.get('/api/mutant/%d' % self.ids[1])
+        obj = json.loads(body.decode())
+        self.assertEqual((obj['report'], obj['value']), ('t', '='))
+
+        status, _, _ = self.get('/api/mutant/0')
+        self.assertEqual(status, 404)
+
+        status, _, _ = self.get('/api/mutants?file=u')
+        self.assertEqual(status, 404)
+
+    def test_api_hunk(self):
+        status, _, body = self.get('/api/hunk/%d?context=0' % self.ids[0])
+        obj = json.loads(body.decode())
+        self.assertEqual((obj['original'], obj['value']), ('<', '>'))
+        self.assertEqual(obj['before'], '  if 1 ')
+        self.assertEqual(obj['report'], 't')
+
+        status, _, _ = self.get('/api/hunk/%d?context=x' % self.ids[0])
+        self.assertEqual(status, 400)
+
+        status, _, _ = self.get('/api/hunk/0')
+        self.assertEqual(status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
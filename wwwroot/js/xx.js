@@ -1,66 +1,91 @@
 
-var g_data;
+var g_report;
 var g_source;
 var g_mutant;
-
-function xx_highlightMutant(m_id) {
-    if(g_data === undefined || g_source == undefined)
+var g_name;
+var g_lines;
+var g_visible;
+var g_scrollTimer;
+
+function xx_showMutant(m_id) {
+    if(m_id == '' || m_id == '0') {
+	xx_highlightMutant(undefined);
 	return;
+    }
+
+    $.getJSON('api/hunk/' + m_id, {file: g_name}, function(hunk) {
+	xx_highlightMutant(hunk);
+    }).fail(function() {
+	xx_highlightMutant(undefined);
+    });
+}
+
+// highlight the original source, once both source and report are loaded
+function xx_showSource() {
+    if(g_report === undefined || g_source == undefined)
+	return false;
+
+    if(g_lines != undefined)
+	return true;
 
-    var date = new Date(g_data.timestamp * 1000);
+    var date = new Date(g_report.timestamp * 1000);
 
     $('#timestamp').text(date.toLocaleDateString() + ' ' + date.toLocaleTimeString());
-    $('#md5').text(g_data.md5);
-    $('#filename').text(g_data.filename);
-    $("#report").text(g_data.name);
+    $('#md5').text(g_report.md5);
+    $('#filename').text(g_report.filename);
+    $("#report").text(g_report.name);
 
-    var src = g_source;
     g_mutant = undefined;
+    g_lines = g_source.split('\n').length;
 
-    for(var i=0; i<g_data.mutants.length; i++) {
-	var mutant = g_data.mutants[i];
+    $('#code').hide();
+    $('#code').text(g_source);
+    sh_highlightElement($('#code').get(0), sh_languages['pascal']);
 
-	prefix = g_source.substring(0, mutant.start);
-	postfix = g_source.substring(mutant.stop);
-	original = g_source.substring(mutant.start, mutant.stop);
+    $("#current_mutant").show();
+    $('#info').show();
+    $('#code').show();
 
-	if($('#current_mutant').css('display') == 'none') {
-	    $('#current_mutant').append(
-		$('<option>', {
-		    value: mutant.id,
-		    text: '#' + mutant.id + " ('" + original + "' ==> '" + mutant.value + "')"
-		})
-	    );
-	}
+    $(document).bind('mousemove', function(e){
+	$('#popup').css({
+	    left:  e.pageX,
+	    top:   e.pageY
+	});
+    });
 
-	if(m_id == mutant.id) {
-	    src = prefix + mutant.value + postfix;
-	    g_mutant = new Object();
+    return true;
+}
 
-	    g_mutant.id = mutant.id;
-	    g_mutant.original = original;
-	    g_mutant.value = mutant.value;
-	    g_mutant.line = mutant.line;
-	    g_mutant.start = mutant.start;
-	    g_mutant.stop = mutant.start + mutant.value.length;
-	}
-    }
+// show a mutant as a hunk of source, rendered by the server
+function xx_highlightMutant(hunk) {
+    if(!xx_showSource())
+	return;
 
-    if(g_mutant == undefined)
+    g_mutant = undefined;
+
+    if(hunk == undefined) {
+	$('#hunk').hide();
 	$("#current_mutant").val(0);
-    else
-	$("#current_mutant").val(g_mutant.id);
+	g_visible = undefined;
+	xx_loadVisibleMutants();
+	return;
+    }
 
-    $('#code').hide();
-    $('#code').text(src);
- 
-    sh_highlightDocument();
- 
-    $("#current_mutant").show();
-    $('#info').show();
-    $('#code').show();
+    g_mutant = new Object();
+
+    g_mutant.id = hunk.id;
+    g_mutant.original = hunk.original;
+    g_mutant.value = hunk.value;
+    g_mutant.line = hunk.line;
+    g_mutant.start = hunk.before.length;
+    g_mutant.stop = hunk.before.length + hunk.value.length;
 
-    $(".xx_mutation").each(function(i, obj) {
+    $('#hunk_lines').text('Mutant #' + hunk.id + ', lines ' + hunk.line + '-' + hunk.last);
+    $('#hunk_code').text(hunk.before + hunk.value + hunk.after);
+    sh_highlightElement($('#hunk_code').get(0), sh_languages['pascal']);
+    $('#hunk').show();
+
+    $("#hunk_code .xx_mutation").each(function(i, obj) {
 	if(i == 0) {
 	    $('#popup').text(g_mutant.original);
 	    obj.id = g_mutant.id;
@@ -75,38 +100,88 @@ function xx_highlightMutant(m_id) {
 	});
     });
 
-    if(g_mutant != undefined) { 
-	var o = $("#" + m_id);
+    var height = $('#code').height() / g_lines;
+    window.scrollTo(0, $('#code').offset().top + (hunk.line - 1) * height - 30);
 
-	$(document).bind('mousemove', function(e){
-	    $('#popup').css({
-		left:  e.pageX,
-		top:   e.pageY
-	    });
-	});
+    g_visible = undefined;
+    xx_loadVisibleMutants();
+}
 
-	window.scrollTo(0, o.get(0).offsetTop - 30);
-    }
+function xx_mutantOption(id, original, value) {
+    return $('<option>', {
+	value: id,
+	text: '#' + id + " ('" + original + "' ==> '" + value + "')"
+    });
+}
+
+// list the mutants located on the lines currently visible
+function xx_loadVisibleMutants() {
+    if(g_lines == undefined)
+	return;
+
+    var height = $('#code').height() / g_lines;
+    if(!(height > 0))
+	return;
+
+    var top = $(window).scrollTop() - $('#code').offset().top;
+    var first = Math.max(Math.floor(top / height) + 1, 1);
+    var last = first + Math.ceil($(window).height() / height);
+    var range = first + '-' + last;
+
+    if(g_visible == range)
+	return;
+
+    g_visible = range;
+
+    $.getJSON('api/mutants', {file: g_name, line: range, limit: 1000}, function(data) {
+	if(g_visible != range)
+	    return;
+
+	var select = $('#current_mutant');
+	select.empty();
+	select.append($('<option>', {value: 0, text: 'Original'}));
+
+	if(g_mutant != undefined)
+	    select.append(xx_mutantOption(g_mutant.id, g_mutant.original, g_mutant.value));
+
+	for(var i=0; i<data.mutants.length; i++) {
+	    var mutant = data.mutants[i];
+	    if(g_mutant == undefined || mutant.id != g_mutant.id)
+		select.append(xx_mutantOption(mutant.id, g_source.substring(mutant.start, mutant.stop), mutant.value));
+	}
+
+	if(data.total > data.mutants.length) {
+	    select.append($('<option>', {
+		disabled: true,
+		text: (data.total - data.mutants.length) + ' more on lines ' + range
+	    }));
+	}
+
+	if(g_mutant == undefined)
+	    select.val(0);
+	else
+	    select.val(g_mutant.id);
+    });
 }
 
 function xx_load(base) {
-    url = base + '.json?r=' + Math.random();
+    g_name = base.substring(base.lastIndexOf('/') + 1);
 
-    $.getJSON(url, function(data) {
-	g_data = data;
-	xx_highlightMutant(window.location.hash.substring(1));
+    $.getJSON('api/mutants', {file: g_name, limit: 0}, function(data) {
+	g_report = data.report;
+	xx_showMutant(window.location.hash.substring(1));
     });
 
-    url = base + '.p?r=' + Math.random();
+    url = base + '.p';
 
     $.get(url, function(data) {
 	g_source = data;
-	xx_highlightMutant(window.location.hash.substring(1));
+	xx_showMutant(window.location.hash.substring(1));
     });
 
     $('#current_mutant').change(function() {
 	window.location.hash = $('#current_mutant').val();
-	xx_highlightMutant($('#current_mutant').val());
+	xx_showMutant($('#current_mutant').val());
     });
 
     var top = $('#info').offset().top - parseFloat($('#info').css('marginTop').replace(/auto/, 0));
@@ -121,5 +196,8 @@ function xx_load(base) {
 	    $('#info').addClass('fixed');
 	else
 	    $('#info').removeClass('fixed');
+
+	clearTimeout(g_scrollTimer);
+	g_scrollTimer = setTimeout(xx_loadVisibleMutants, 200);
     });
 }
\ No newline at end of file